@@ -0,0 +1,24 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+分析流程的默认参数
+不依赖NumPy/pandas，导入分析器或在交互菜单中显示选项时无需加载重量级依赖
+"""
+
+# 默认统计时间窗宽度（秒）
+DEFAULT_BIN_WIDTH = 60
+
+# 标准报表统计间隔：1分钟、5分钟、15分钟
+STANDARD_ROLLUP_WIDTHS = (60, 300, 900)
+
+# FCD流式解析时每个块缓存的记录数
+DEFAULT_CHUNK_SIZE = 262144
+
+# 解析结果的默认缓存目录
+CACHE_DIR = ".analysis_cache"
+
+# 完整FCD导出格式及文件扩展名
+FCD_EXPORT_FORMATS = {
+    'csv': '.csv.gz',
+    'parquet': '.parquet',
+}
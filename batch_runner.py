@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+批量场景仿真
+按需求水平、车型配置和随机种子组成场景网格，每个场景在独立目录中生成配置文件，
+路径文件由demand_generator按需求内容生成并去重（不同随机种子的同一需求共用一个路径文件），
+以有限大小的进程池并行运行无界面的sumo，并汇总各场景的输出文件和运行结果。
+SUMO程序可以替换（例如用于测试的替身脚本）
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import itertools
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+from demand_generator import DemandLibrary, DEMAND_DIR, DEMAND_PRESETS
+
+# 批量仿真输出目录
+BATCH_DIR = "batch_runs"
+
+# 默认场景网格
+DEFAULT_DEMAND_LEVELS = (0.8, 1.0, 1.2)
+DEFAULT_SEEDS = (1, 2, 3)
+
+# 与highway-ramp-analysis.sumocfg一致的仿真参数
+DEFAULT_NET_FILE = "highway.net.xml"
+DEFAULT_END_TIME = 1600
+DEFAULT_STEP_LENGTH = 0.1
+
+# 各场景目录中的文件名
+CONFIG_FILE = "scenario.sumocfg"
+OUTPUT_FILES = {
+    'tripinfo': "trip_info.xml",
+    'fcd': "vehicle_traces.xml",
+    'summary': "summary.xml",
+}
+
+# 单个场景的超时时间（秒）
+DEFAULT_TIMEOUT = 600
+
+
+class Scenario:
+    """一个仿真场景：需求水平（流量倍数）、车型配置和随机种子"""
+
+    def __init__(self, demand=1.0, vehicle_config="mixed", seed=1):
+        if vehicle_config not in DEMAND_PRESETS:
+            raise ValueError(f"未知的车型配置: {vehicle_config}")
+        self.demand = demand
+        self.vehicle_config = vehicle_config
+        self.seed = seed
+
+    @property
+    def name(self):
+        return f"d{self.demand:g}_{self.vehicle_config}_s{self.seed}"
+
+    def to_dict(self):
+        return {'demand': self.demand, 'vehicle_config': self.vehicle_config, 'seed': self.seed}
+
+    def demand_scenario(self):
+        """该场景的需求：车型配置的需求按需求水平缩放"""
+        return DEMAND_PRESETS[self.vehicle_config].scaled(self.demand).with_seed(self.seed)
+
+    def __repr__(self):
+        return f"Scenario({self.name})"
+
+
+def scenario_grid(demand_levels=DEFAULT_DEMAND_LEVELS, vehicle_configs=("mixed",), seeds=DEFAULT_SEEDS):
+    """需求水平 × 车型配置 × 随机种子的全部组合"""
+    return [Scenario(demand, vehicle_config, seed)
+            for demand, vehicle_config, seed in itertools.product(demand_levels, vehicle_configs, seeds)]
+
+
+def scenario_config(net_file, route_file, outputs, seed, end=DEFAULT_END_TIME,
+                    step_length=DEFAULT_STEP_LENGTH):
+    """场景的SUMO配置文件内容；输出文件写在场景目录中"""
+    output_lines = "\n".join(
+        f'        <{kind}-output value="{OUTPUT_FILES[kind]}"/>' for kind in outputs)
+    return f'''<?xml version="1.0" encoding="UTF-8"?>
+
+<sumoConfiguration xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" xsi:noNamespaceSchemaLocation="http://sumo.dlr.de/xsd/sumoConfiguration.xsd">
+
+    <input>
+        <net-file value="{net_file}"/>
+        <route-files value="{route_file}"/>
+    </input>
+
+    <time>
+        <begin value="0"/>
+        <end value="{end}"/>
+        <step-length value="{step_length}"/>
+    </time>
+
+    <random_number>
+        <seed value="{seed}"/>
+    </random_number>
+
+    <processing>
+        <ignore-route-errors value="true"/>
+        <collision.action value="warn"/>
+    </processing>
+
+    <report>
+        <verbose value="false"/>
+        <no-step-log value="true"/>
+        <no-warnings value="true"/>
+    </report>
+
+    <output>
+{output_lines}
+    </output>
+
+</sumoConfiguration>
+'''
+
+
+class BatchRunner:
+    """并行运行一组场景
+
+    sumo_binary为SUMO程序路径或命令前缀列表（如 [sys.executable, "stub_sumo.py"]），
+    以 "<sumo_binary> -c scenario.sumocfg" 在场景目录中运行。
+    jobs为同时运行的sumo进程数上限，默认为CPU核数。
+    路径文件保存在demand_dir中，相同的需求在多次批量运行之间复用
+    """
+
+    def __init__(self, batch_dir=BATCH_DIR, sumo_binary="sumo", jobs=None,
+                 net_file=DEFAULT_NET_FILE, outputs=tuple(OUTPUT_FILES), timeout=DEFAULT_TIMEOUT,
+                 demand_dir=DEMAND_DIR):
+        self.batch_dir = batch_dir
+        self.sumo_command = [sumo_binary] if isinstance(sumo_binary, str) else list(sumo_binary)
+        self.jobs = jobs or os.cpu_count() or 1
+        self.net_file = os.path.abspath(net_file)
+        self.outputs = tuple(outputs)
+        self.timeout = timeout
+        self.library = DemandLibrary(demand_dir)
+
+    def scenario_dir(self, scenario):
+        return os.path.join(self.batch_dir, scenario.name)
+
+    def prepare(self, scenario):
+        """在场景目录中写入配置文件（路径文件不存在时生成），返回场景目录"""
+        directory = self.scenario_dir(scenario)
+        os.makedirs(directory, exist_ok=True)
+        route_file = os.path.abspath(self.library.route_file(scenario.demand_scenario()))
+        with open(os.path.join(directory, CONFIG_FILE), "w", encoding="utf-8") as f:
+            f.write(scenario_config(self.net_file, route_file, self.outputs, scenario.seed))
+        return directory
+
+    def run_scenario(self, scenario):
+        """运行单个场景，返回结果字典"""
+        directory = self.prepare(scenario)
+        started = time.perf_counter()
+        result = {'scenario': scenario.name, **scenario.to_dict(), 'directory': directory}
+        try:
+            process = subprocess.run(self.sumo_command + ["-c", CONFIG_FILE], cwd=directory,
+                                     capture_output=True, text=True, timeout=self.timeout)
+            result['returncode'] = process.returncode
+            result['stderr'] = process.stderr[-2000:]
+        except subprocess.TimeoutExpired:
+            result['returncode'] = None
+            result['stderr'] = f"运行超时（{self.timeout}s）"
+        except OSError as e:
+            result['returncode'] = None
+            result['stderr'] = str(e)
+
+        result['duration'] = time.perf_counter() - started
+        result['ok'] = result['returncode'] == 0
+        result['outputs'] = {kind: os.path.join(directory, OUTPUT_FILES[kind]) for kind in self.outputs
+                             if os.path.exists(os.path.join(directory, OUTPUT_FILES[kind]))}
+        return result
+
+    def run(self, scenarios):
+        """并行运行全部场景，结果按场景顺序返回并写入batch_results.json"""
+        scenarios = list(scenarios)
+        os.makedirs(self.batch_dir, exist_ok=True)
+        # 先在主线程中生成全部路径文件（相同需求只生成一次），工作线程只读取
+        route_files = self.library.route_files([scenario.demand_scenario() for scenario in scenarios])
+        print(f"路径文件: {len(set(route_files))} 个（保存在 {self.library.directory}/）")
+        print(f"共 {len(scenarios)} 个场景，最多同时运行 {self.jobs} 个sumo进程")
+
+        started = time.perf_counter()
+        results = []
+        # sumo在独立进程中运行，线程只负责等待，因此用线程池限制并发进程数即可
+        with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+            for result in executor.map(self.run_scenario, scenarios):
+                status = "完成" if result['ok'] else f"失败 ({result['returncode']})"
+                print(f"  {result['scenario']}: {status}，用时 {result['duration']:.1f}s")
+                results.append(result)
+        elapsed = time.perf_counter() - started
+
+        summary = {
+            'created_at': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'jobs': self.jobs,
+            'elapsed': elapsed,
+            'results': results,
+        }
+        with open(os.path.join(self.batch_dir, 'batch_results.json'), 'w', encoding='utf-8') as f:
+            json.dump(summary, f, ensure_ascii=False, indent=2)
+
+        n_ok = sum(result['ok'] for result in results)
+        print(f"批量仿真结束: {n_ok}/{len(results)} 个场景成功，总用时 {elapsed:.1f}s")
+        return results
+
+
+def parse_args(argv=None):
+    """解析命令行参数"""
+    parser = argparse.ArgumentParser(description="批量场景仿真")
+    parser.add_argument('--demand', type=float, nargs='+', default=list(DEFAULT_DEMAND_LEVELS),
+                        help="需求水平（流量倍数）")
+    parser.add_argument('--vehicle-config', nargs='+', default=["mixed"], choices=sorted(DEMAND_PRESETS),
+                        help="车型配置")
+    parser.add_argument('--seeds', type=int, nargs='+', default=list(DEFAULT_SEEDS), help="随机种子")
+    parser.add_argument('--jobs', type=int, default=None, help="同时运行的sumo进程数，默认为CPU核数")
+    parser.add_argument('--sumo', nargs='+', default=["sumo"],
+                        help="SUMO程序路径或命令前缀（如 python stub_sumo.py）")
+    parser.add_argument('--batch-dir', default=BATCH_DIR, help="批量仿真输出目录")
+    parser.add_argument('--outputs', nargs='+', default=list(OUTPUT_FILES), choices=list(OUTPUT_FILES),
+                        help="各场景写出的输出文件")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """主函数"""
+    args = parse_args(argv)
+    print("=== 批量场景仿真 ===")
+    runner = BatchRunner(batch_dir=args.batch_dir, sumo_binary=args.sumo, jobs=args.jobs,
+                         outputs=args.outputs)
+    results = runner.run(scenario_grid(args.demand, args.vehicle_config, args.seeds))
+    return 0 if all(result['ok'] for result in results) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
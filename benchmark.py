@@ -0,0 +1,370 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+分析器性能基准
+用合成的vehicle_traces.xml和trip_info.xml（见synthetic_outputs）在不同数据规模下运行分析流程，
+记录每个阶段的用时、吞吐量（记录数/秒）和峰值内存；
+结果可保存为基准线，之后的运行与基准线比较，用时或内存超出容许范围时报告性能退化。
+--startup另外在全新的解释器中测量交互管理器的启动延迟和分析启动延迟
+"""
+
+import io
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import statistics
+import subprocess
+import warnings
+import contextlib
+import multiprocessing
+from queue import Empty
+
+import numpy as np
+import pandas as pd
+
+from synthetic_outputs import SyntheticOutputGenerator
+
+# 基准运行的输出目录和默认基准线文件
+BENCHMARK_DIR = "benchmark_runs"
+BASELINE_FILE = "benchmark_baseline.json"
+
+# 默认数据规模（FCD记录数）
+DEFAULT_SIZES = (10000, 100000, 1000000)
+
+# 计时的分析阶段
+STAGES = ('analyze_fcd_data', 'analyze_trip_data', 'calculate_traffic_parameters',
+          'generate_charts', 'save_results')
+
+# 等待基准进程结果时检查其是否仍在运行的间隔（秒）
+_POLL_INTERVAL = 1.0
+
+# 判定为性能退化的相对增幅
+DEFAULT_TOLERANCE = 0.25
+
+# 用时过短的阶段不参与退化判断（秒）
+MIN_COMPARABLE_SECONDS = 0.05
+
+# 启动延迟测量：在全新的解释器中运行的代码片段；片段给elapsed赋值时以其为结果，否则取进程的总用时
+STARTUP_SNIPPETS = {
+    'python': "pass",
+    'import_manager': "import traffic_manager",
+    'manager_help': """
+import io, contextlib, traffic_manager
+with contextlib.redirect_stdout(io.StringIO()):
+    traffic_manager.SimpleTrafficManager().show_help()
+""",
+    'import_analyzer': "import traffic_flow_analyzer",
+    # 首次分析：导入全部依赖并完成第一个分析阶段
+    'analysis_launch': """
+import io, contextlib
+from traffic_flow_analyzer import TrafficFlowAnalyzer, load_dependencies
+with contextlib.redirect_stdout(io.StringIO()):
+    load_dependencies()
+    TrafficFlowAnalyzer(cache_dir=None).load_network()
+""",
+    # 常驻分析器的再次分析：依赖已导入，只计第一个分析阶段
+    'analysis_relaunch': """
+import io, time, contextlib
+from traffic_flow_analyzer import TrafficFlowAnalyzer, load_dependencies
+analyzer = TrafficFlowAnalyzer(cache_dir=None)
+with contextlib.redirect_stdout(io.StringIO()):
+    load_dependencies()
+    analyzer.load_network()
+    started = time.perf_counter()
+    analyzer.reset()
+    analyzer.load_network()
+    elapsed = time.perf_counter() - started
+""",
+}
+DEFAULT_STARTUP_REPEATS = 5
+
+
+def dataset_paths(rows, seed, data_dir):
+    """合成数据文件路径"""
+    name = f"r{rows}_s{seed}"
+    return (os.path.join(data_dir, f"vehicle_traces_{name}.xml"),
+            os.path.join(data_dir, f"trip_info_{name}.xml"),
+            os.path.join(data_dir, f"dataset_{name}.json"))
+
+
+def prepare_dataset(rows, seed=1, data_dir=os.path.join(BENCHMARK_DIR, "data"),
+                    net_file="highway.net.xml", route_file="highway-ramp.rou.xml"):
+    """生成（或复用已生成的）合成数据，返回数据集信息"""
+    fcd_file, trip_file, info_file = dataset_paths(rows, seed, data_dir)
+    if os.path.exists(info_file) and os.path.exists(fcd_file) and os.path.exists(trip_file):
+        with open(info_file, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    os.makedirs(data_dir, exist_ok=True)
+    print(f"生成合成数据: {rows} 条轨迹记录...")
+    started = time.perf_counter()
+    generator = SyntheticOutputGenerator(net_file, route_file, seed=seed)
+    info = generator.write(fcd_file, trip_file, target_rows=rows)
+    info.update(fcd_file=os.path.abspath(fcd_file), trip_file=os.path.abspath(trip_file), seed=seed,
+                fcd_bytes=os.path.getsize(fcd_file), generate_seconds=time.perf_counter() - started)
+    with open(info_file, 'w', encoding='utf-8') as f:
+        json.dump(info, f, ensure_ascii=False, indent=2)
+    return info
+
+
+def _run_pipeline(dataset, net_file, route_file, chart_quality, workdir, verbose):
+    """在当前进程中依次运行各分析阶段，返回各阶段的计时结果"""
+    from traffic_flow_analyzer import TrafficFlowAnalyzer
+
+    os.makedirs(workdir, exist_ok=True)
+    os.chdir(workdir)
+    analyzer = TrafficFlowAnalyzer(cache_dir=None)
+    output = sys.stdout if verbose else io.StringIO()
+    if not verbose:
+        warnings.simplefilter('ignore')
+    with contextlib.redirect_stdout(output):
+        analyzer.load_network(net_file, route_file)
+
+    stage_calls = {
+        'analyze_fcd_data': lambda: analyzer.analyze_fcd_data(dataset['fcd_file']),
+        'analyze_trip_data': lambda: analyzer.analyze_trip_data(dataset['trip_file']),
+        'calculate_traffic_parameters': lambda: analyzer.calculate_traffic_parameters(),
+        'generate_charts': lambda: analyzer.generate_charts(quality=chart_quality),
+        'save_results': lambda: analyzer.save_results(),
+    }
+    for stage in STAGES:
+        with contextlib.redirect_stdout(output):
+            stage_calls[stage]()
+
+    # 各阶段的用时和内存由分析器自身的计量记录
+    stages = {}
+    for record in analyzer.instrumentation.records:
+        if record['stage'] not in STAGES or record['parent'] is not None:
+            continue
+        seconds = record['seconds']
+        rows = dataset['trips'] if record['stage'] == 'analyze_trip_data' else dataset['rows']
+        stages[record['stage']] = {
+            'seconds': seconds,
+            'rows': rows,
+            'rows_per_second': rows / seconds if seconds > 0 else None,
+            'peak_rss_mb': record['peak_rss_mb'],
+        }
+    return stages
+
+
+def _pipeline_worker(queue, *args):
+    try:
+        queue.put(('ok', _run_pipeline(*args)))
+    except Exception as e:
+        queue.put(('error', f"{type(e).__name__}: {e}"))
+
+
+def run_benchmark(dataset, net_file, route_file, chart_quality='draft', workdir=None, verbose=False):
+    """在独立进程中运行一个数据规模的分析流程，使峰值内存互不影响"""
+    workdir = workdir or os.path.join(BENCHMARK_DIR, f"work_r{dataset['rows']}")
+    context = multiprocessing.get_context('spawn')
+    queue = context.Queue()
+    process = context.Process(target=_pipeline_worker,
+                              args=(queue, dataset, os.path.abspath(net_file), os.path.abspath(route_file),
+                                    chart_quality, os.path.abspath(workdir), verbose))
+    process.start()
+    # 进程被直接终止（如内存不足时被系统杀死）时不会放入结果，不能无限等待
+    while True:
+        # 先记录进程状态再取结果：进程退出前放入的结果在此之后一定能取到
+        alive = process.is_alive()
+        try:
+            status, result = queue.get(timeout=_POLL_INTERVAL)
+            break
+        except Empty:
+            if alive:
+                continue
+            process.join()
+            raise RuntimeError(f"基准进程异常退出（{dataset['rows']} 条记录，退出码 {process.exitcode}），"
+                               f"未返回结果") from None
+    process.join()
+    if status != 'ok':
+        raise RuntimeError(f"基准运行失败（{dataset['rows']} 条记录）: {result}")
+    return result
+
+
+def _run_snippet(code):
+    """在全新的解释器中运行代码片段，返回用时（秒）"""
+    script = code + "\nif 'elapsed' in globals():\n    print(repr(elapsed))\n"
+    started = time.perf_counter()
+    process = subprocess.run([sys.executable, "-c", script], capture_output=True, text=True,
+                             cwd=os.path.dirname(os.path.abspath(__file__)))
+    seconds = time.perf_counter() - started
+    if process.returncode != 0:
+        raise RuntimeError(f"启动测量失败: {process.stderr.strip()[-500:]}")
+    output = process.stdout.strip()
+    return float(output.splitlines()[-1]) if output else seconds
+
+
+def measure_startup(repeats=DEFAULT_STARTUP_REPEATS):
+    """各启动场景的用时中位数"""
+    results = {}
+    for name, code in STARTUP_SNIPPETS.items():
+        samples = [_run_snippet(code) for _ in range(repeats)]
+        results[name] = {'seconds': statistics.median(samples), 'min_seconds': min(samples)}
+    return results
+
+
+def measure_metering(seed=1):
+    """匝道控制器每个仿真步的开销（微秒），使用模拟仿真器，不含SUMO自身的仿真用时"""
+    from ramp_metering import MockMergeSimulation, run_metering
+    results = {}
+    for mode in ('none', 'alinea'):
+        with contextlib.redirect_stdout(io.StringIO()):
+            summary, _ = run_metering(mode, sim=MockMergeSimulation(seed=seed))
+        results[mode] = {'us_per_step': summary['overhead_us_per_step'],
+                         'max_us': summary['overhead_max_us']}
+    return results
+
+
+def environment_info():
+    """运行环境信息，便于判断不同机器上的结果能否比较"""
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+    }
+
+
+def compare_with_baseline(results, baseline, tolerance=DEFAULT_TOLERANCE, startup=None, metering=None):
+    """与基准线比较，返回退化项描述列表；startup为measure_startup()的结果，metering为measure_metering()的结果"""
+    regressions = []
+    for size, stages in results.items():
+        base_stages = baseline.get('results', {}).get(size)
+        if not base_stages:
+            continue
+        for stage, metrics in stages.items():
+            base = base_stages.get(stage)
+            if not base:
+                continue
+            if (base['seconds'] >= MIN_COMPARABLE_SECONDS
+                    and metrics['seconds'] > base['seconds'] * (1 + tolerance)):
+                regressions.append(f"{size} 条记录 {stage}: 用时 {base['seconds']:.3f}s -> "
+                                   f"{metrics['seconds']:.3f}s")
+            if metrics['peak_rss_mb'] > base['peak_rss_mb'] * (1 + tolerance):
+                regressions.append(f"{size} 条记录 {stage}: 峰值内存 {base['peak_rss_mb']:.0f}MB -> "
+                                   f"{metrics['peak_rss_mb']:.0f}MB")
+    for name, metrics in (startup or {}).items():
+        base = baseline.get('startup', {}).get(name)
+        if (base and base['seconds'] >= MIN_COMPARABLE_SECONDS
+                and metrics['seconds'] > base['seconds'] * (1 + tolerance)):
+            regressions.append(f"启动 {name}: 用时 {base['seconds']:.3f}s -> {metrics['seconds']:.3f}s")
+    for mode, metrics in (metering or {}).items():
+        base = baseline.get('metering', {}).get(mode)
+        if base and metrics['us_per_step'] > base['us_per_step'] * (1 + tolerance):
+            regressions.append(f"匝道控制 {mode}: 每步开销 {base['us_per_step']:.1f}us -> "
+                               f"{metrics['us_per_step']:.1f}us")
+    return regressions
+
+
+def print_results(size, stages):
+    print(f"\n{size} 条轨迹记录:")
+    print(f"  {'阶段':<30}{'用时 (s)':>10}{'吞吐量 (行/s)':>16}{'峰值内存 (MB)':>16}")
+    for stage, metrics in stages.items():
+        throughput = metrics['rows_per_second']
+        print(f"  {stage:<30}{metrics['seconds']:>10.3f}"
+              f"{(f'{throughput:,.0f}' if throughput else '-'):>16}{metrics['peak_rss_mb']:>16.1f}")
+
+
+def print_startup(startup):
+    print("\n启动延迟（全新解释器，中位数）:")
+    for name, metrics in startup.items():
+        print(f"  {name:<30}{metrics['seconds']:>10.3f}s")
+
+
+def print_metering(metering):
+    print("\n匝道控制器开销（模拟仿真器，每仿真步）:")
+    for mode, metrics in metering.items():
+        print(f"  {mode:<30}{metrics['us_per_step']:>10.1f}us（最大 {metrics['max_us']:.0f}us）")
+
+
+def parse_args(argv=None):
+    """解析命令行参数"""
+    parser = argparse.ArgumentParser(description="分析器性能基准")
+    parser.add_argument('--rows', type=int, nargs='*', default=list(DEFAULT_SIZES),
+                        help="合成FCD数据的记录数（可指定多个规模，1万到5000万；不给出数值时跳过流程基准）")
+    parser.add_argument('--seed', type=int, default=1, help="合成数据的随机种子")
+    parser.add_argument('--data-dir', default=os.path.join(BENCHMARK_DIR, "data"),
+                        help="合成数据目录（已生成的数据会被复用）")
+    parser.add_argument('--chart-quality', choices=('draft', 'full'), default='draft',
+                        help="generate_charts阶段的图表质量")
+    parser.add_argument('--baseline', default=BASELINE_FILE, help="基准线文件")
+    parser.add_argument('--save-baseline', action='store_true', help="将本次结果保存为基准线")
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                        help="判定退化的相对增幅（0.25表示慢25%%以上）")
+    parser.add_argument('--startup', action='store_true',
+                        help="测量交互管理器的启动延迟和分析启动延迟")
+    parser.add_argument('--startup-repeats', type=int, default=DEFAULT_STARTUP_REPEATS,
+                        help="每个启动场景的重复次数")
+    parser.add_argument('--metering', action='store_true', help="测量匝道控制器每个仿真步的开销")
+    parser.add_argument('--verbose', action='store_true', help="显示分析器的输出")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """主函数"""
+    args = parse_args(argv)
+    print("=== 分析器性能基准 ===")
+
+    results = {}
+    datasets = {}
+    for rows in args.rows:
+        dataset = prepare_dataset(rows, seed=args.seed, data_dir=args.data_dir)
+        datasets[str(rows)] = dataset
+        stages = run_benchmark(dataset, "highway.net.xml", "highway-ramp.rou.xml",
+                               chart_quality=args.chart_quality, verbose=args.verbose)
+        results[str(rows)] = stages
+        print_results(rows, stages)
+
+    startup = None
+    if args.startup:
+        startup = measure_startup(args.startup_repeats)
+        print_startup(startup)
+
+    metering = None
+    if args.metering:
+        metering = measure_metering(args.seed)
+        print_metering(metering)
+
+    report = {
+        'created_at': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'environment': environment_info(),
+        'chart_quality': args.chart_quality,
+        'datasets': datasets,
+        'results': results,
+    }
+    if startup is not None:
+        report['startup'] = startup
+    if metering is not None:
+        report['metering'] = metering
+    os.makedirs(BENCHMARK_DIR, exist_ok=True)
+    report_file = os.path.join(BENCHMARK_DIR, f"benchmark_{time.strftime('%Y%m%d_%H%M%S')}.json")
+    with open(report_file, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"\n基准结果已保存: {report_file}")
+
+    exit_code = 0
+    if args.save_baseline:
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"已保存为基准线: {args.baseline}")
+    elif os.path.exists(args.baseline):
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare_with_baseline(results, baseline, args.tolerance, startup, metering)
+        if regressions:
+            print(f"\n与基准线（{baseline.get('created_at')}）相比出现性能退化:")
+            for line in regressions:
+                print(f"  {line}")
+            exit_code = 1
+        else:
+            print(f"\n与基准线（{baseline.get('created_at')}）相比未发现性能退化")
+    return exit_code
+
+
+if __name__ == "__main__":
+    sys.exit(main())
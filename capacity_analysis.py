@@ -0,0 +1,423 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+通行能力与流量崩溃分析
+在按时间窗和路段聚合的统计量上（TrafficAggregate累积量或traffic_stats数据框）：
+对每个路段拟合交通流基本图（Greenshields线性速度-密度模型和三角形流量-密度模型），
+以带滞回的速度阈值识别流量崩溃事件，并比较崩溃前的流量与排队消散流量（通行能力下降）。
+所有计算都在 (时间窗 × 路段) 二维数组上一次完成，不按路段或时间窗循环，
+单次仿真的统计量只需毫秒级时间，可以直接用于成百上千次场景运行的缓存结果
+"""
+
+import os
+import sys
+import glob
+import time
+import argparse
+import warnings
+
+import numpy as np
+import pandas as pd
+
+from analysis_defaults import DEFAULT_BIN_WIDTH
+
+# 自由流速度取各路段时间窗速度的分位数（%）
+FREE_FLOW_PERCENTILE = 85
+
+# 滞回阈值（相对自由流速度）：速度低于崩溃阈值进入拥堵，高于恢复阈值才恢复
+DEFAULT_BREAKDOWN_RATIO = 0.7
+DEFAULT_RECOVERY_RATIO = 0.85
+
+# 持续时间短于该值（秒）的速度下降视为波动，不计为崩溃
+DEFAULT_MIN_DURATION = 120.0
+
+# 崩溃前流量的统计时长（秒）
+DEFAULT_PRE_BREAKDOWN_WINDOW = 300.0
+
+# 增量分析/重复仿真保存的累积量文件名
+AGGREGATE_FILE = 'aggregate.npz'
+
+FUNDAMENTAL_DIAGRAM_COLUMNS = [
+    'edge', 'windows', 'congested_windows', 'free_flow_speed',
+    'greenshields_free_speed', 'greenshields_jam_density', 'greenshields_capacity', 'greenshields_r2',
+    'triangular_free_speed', 'wave_speed', 'jam_density', 'critical_density', 'capacity', 'max_flow']
+
+BREAKDOWN_COLUMNS = ['edge', 'start', 'end', 'duration', 'recovered', 'min_speed',
+                     'pre_breakdown_flow', 'pre_breakdown_peak', 'discharge_flow', 'capacity_drop']
+
+
+def _masked_sums(mask, *columns):
+    """按列（路段）对mask为True的元素求和"""
+    return [np.where(mask, column, 0.0).sum(axis=0) for column in columns]
+
+
+def _least_squares(mask, x, y):
+    """各列在mask内做 y = a + b·x 的最小二乘，返回 (a, b, 样本数)；样本不足或x无变化时为NaN"""
+    n = mask.sum(axis=0)
+    sx, sy, sxx, sxy = _masked_sums(mask, x, y, x * x, x * y)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        denominator = n * sxx - sx * sx
+        slope = np.where((n >= 2) & (denominator > 1e-9 * np.maximum(n * sxx, 1e-12)),
+                         (n * sxy - sx * sy) / denominator, np.nan)
+        intercept = (sy - slope * sx) / n
+    return intercept, slope, n
+
+
+def _forward_fill(codes):
+    """沿时间轴（第0轴）用前一个有效状态（>=0）填充-1，开头的-1视为0"""
+    rows = np.arange(codes.shape[0])[:, None]
+    last = np.maximum.accumulate(np.where(codes >= 0, rows, 0), axis=0)
+    filled = np.take_along_axis(codes, last, axis=0)
+    return np.maximum(filled, 0)
+
+
+def _runs(state):
+    """二维布尔数组各列中连续为True的区段，按 (路段, 开始时间窗) 排序，返回 (路段, 开始, 结束)（不含结束）"""
+    n_bins, n_edges = state.shape
+    padded = np.zeros((n_bins + 2, n_edges), dtype=np.int8)
+    padded[1:-1] = state
+    steps = np.diff(padded, axis=0).T
+    edges, starts = np.nonzero(steps == 1)
+    _, ends = np.nonzero(steps == -1)
+    return edges, starts, ends
+
+
+class CapacityAnalysis:
+    """各路段的基本图拟合与流量崩溃识别
+
+    speed（km/h）和density（veh/km，路段全部车道）为 (时间窗数, 路段数) 二维数组，没有车辆的分组为NaN；
+    流量采用Edie广义定义 q = k·v（veh/h），与密度和速度的定义一致。
+    只支持等宽时间窗
+    """
+
+    def __init__(self, time_intervals, edge_values, speed, density):
+        self.time_intervals = np.asarray(time_intervals, dtype=float)
+        self.edge_values = np.asarray(edge_values, dtype=object)
+        self.speed = np.asarray(speed, dtype=float)
+        self.density = np.asarray(density, dtype=float)
+        self.flow = self.density * self.speed
+        self.valid = ~(np.isnan(self.speed) | np.isnan(self.density))
+        widths = np.diff(self.time_intervals)
+        if len(widths) and not np.allclose(widths, widths[0]):
+            raise ValueError("通行能力分析只支持等宽时间窗")
+        self.bin_width = float(widths[0]) if len(widths) else DEFAULT_BIN_WIDTH
+
+    @classmethod
+    def from_aggregate(cls, aggregate, network=None, bin_width=None):
+        """由TrafficAggregate累积量构造；指定bin_width时先汇总到该时间窗宽度"""
+        if bin_width is not None and aggregate.bin_width != bin_width:
+            aggregate = aggregate.rollup(bin_width)
+        speed, density = aggregate.speed_density(network)
+        return cls(aggregate.time_intervals, aggregate.edge_values, speed, density)
+
+    @classmethod
+    def from_traffic_stats(cls, traffic_stats):
+        """由traffic_stats数据框构造（路段按首次出现的顺序排列）"""
+        if traffic_stats.empty:
+            return cls([0.0, DEFAULT_BIN_WIDTH], [], np.empty((1, 0)), np.empty((1, 0)))
+        starts = traffic_stats['time_start'].to_numpy(dtype=float)
+        ends = traffic_stats['time_end'].to_numpy(dtype=float)
+        width = ends[0] - starts[0]
+        if not np.allclose(ends - starts, width):
+            raise ValueError("通行能力分析只支持等宽时间窗")
+        origin = starts.min()
+        windows = np.rint((starts - origin) / width).astype(np.int64)
+        edges, edge_values = pd.factorize(traffic_stats['edge'], sort=False)
+        n_bins = int(windows.max()) + 1
+
+        speed = np.full((n_bins, len(edge_values)), np.nan)
+        density = np.full((n_bins, len(edge_values)), np.nan)
+        speed[windows, edges] = traffic_stats['avg_speed'].to_numpy(dtype=float)
+        density[windows, edges] = traffic_stats['density'].to_numpy(dtype=float)
+        return cls(origin + np.arange(n_bins + 1) * width, np.asarray(edge_values, dtype=object),
+                   speed, density)
+
+    @classmethod
+    def load(cls, path, network=None, bin_width=None):
+        """读取TrafficAggregate.save()保存的.npz累积量"""
+        from traffic_aggregator import TrafficAggregate
+        return cls.from_aggregate(TrafficAggregate.load(path), network, bin_width)
+
+    @property
+    def n_bins(self):
+        return self.speed.shape[0]
+
+    def _windows(self, seconds):
+        """时长对应的时间窗数（向上取整）"""
+        return int(np.ceil(seconds / self.bin_width - 1e-9))
+
+    def free_flow_speed(self):
+        """各路段的自由流速度：时间窗速度的FREE_FLOW_PERCENTILE分位数"""
+        with warnings.catch_warnings():
+            # 没有任何有效时间窗的路段为NaN
+            warnings.simplefilter('ignore', RuntimeWarning)
+            return np.nanpercentile(np.where(self.valid, self.speed, np.nan), FREE_FLOW_PERCENTILE, axis=0)
+
+    def congestion_state(self, breakdown_ratio=DEFAULT_BREAKDOWN_RATIO,
+                         recovery_ratio=DEFAULT_RECOVERY_RATIO, min_duration=DEFAULT_MIN_DURATION):
+        """各时间窗、各路段是否处于拥堵状态（布尔二维数组）
+
+        速度低于 breakdown_ratio × 自由流速度 时进入拥堵，直到速度高于 recovery_ratio × 自由流速度 才恢复，
+        两个阈值之间保持原状态；没有车辆的时间窗同样保持原状态。持续时间短于min_duration的拥堵区段被忽略
+        """
+        if breakdown_ratio > recovery_ratio:
+            raise ValueError("崩溃阈值不能高于恢复阈值")
+        free_speed = self.free_flow_speed()
+        codes = np.full(self.speed.shape, -1, dtype=np.int8)
+        with np.errstate(invalid='ignore'):
+            codes[self.speed > recovery_ratio * free_speed] = 0
+            codes[self.speed < breakdown_ratio * free_speed] = 1
+        return self._drop_short(_forward_fill(codes).astype(bool), min_duration)
+
+    def _drop_short(self, state, min_duration):
+        """去掉持续时间短于min_duration的拥堵区段"""
+        edges, starts, ends = _runs(state)
+        short = (ends - starts) < self._windows(min_duration)
+        if not short.any():
+            return state
+        delta = np.zeros((self.n_bins + 1, len(self.edge_values)), dtype=np.int32)
+        np.add.at(delta, (starts[short], edges[short]), 1)
+        np.add.at(delta, (ends[short], edges[short]), -1)
+        return state & (np.cumsum(delta, axis=0)[:-1] == 0)
+
+    def breakdowns(self, state=None, pre_window=DEFAULT_PRE_BREAKDOWN_WINDOW):
+        """流量崩溃事件表
+
+        pre_breakdown_flow / pre_breakdown_peak 为崩溃前pre_window秒内流量的均值和最大值，
+        discharge_flow为拥堵期间的平均流量（排队消散流量），capacity_drop = 1 - 消散流量 / 崩溃前流量；
+        数据开始时已处于拥堵的事件没有崩溃前流量，recovered表示数据结束前是否已恢复
+        """
+        if state is None:
+            state = self.congestion_state()
+        edges, starts, ends = _runs(state)
+        if len(edges) == 0:
+            return pd.DataFrame(columns=BREAKDOWN_COLUMNS)
+
+        # 拥堵期间的平均流量：沿时间轴的前缀和
+        flow = np.where(self.valid, self.flow, 0.0)
+        flow_sums = np.vstack([np.zeros(flow.shape[1]), np.cumsum(flow, axis=0)])
+        window_counts = np.vstack([np.zeros(flow.shape[1]), np.cumsum(self.valid, axis=0)])
+        with np.errstate(divide='ignore', invalid='ignore'):
+            discharge = ((flow_sums[ends, edges] - flow_sums[starts, edges])
+                         / (window_counts[ends, edges] - window_counts[starts, edges]))
+
+        # 崩溃前若干时间窗的流量
+        before = starts[:, None] - np.arange(1, max(self._windows(pre_window), 1) + 1)
+        previous = np.clip(before, 0, None)
+        usable = (before >= 0) & self.valid[previous, edges[:, None]]
+        previous_flow = self.flow[previous, edges[:, None]]
+        n_previous = usable.sum(axis=1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            pre_flow = np.where(usable, previous_flow, 0.0).sum(axis=1) / n_previous
+        pre_peak = np.where(n_previous > 0, np.where(usable, previous_flow, -np.inf).max(axis=1), np.nan)
+
+        # 拥堵期间的最低速度：各区段在按路段展开的一维数组中互不重叠，用reduceat一次求出
+        flat_speed = np.append(self.speed.T.ravel(), np.nan)
+        bounds = np.column_stack([edges * self.n_bins + starts, edges * self.n_bins + ends]).ravel()
+        min_speed = np.fmin.reduceat(flat_speed, bounds)[::2]
+
+        start_time = self.time_intervals[starts]
+        end_time = self.time_intervals[ends]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            capacity_drop = 1 - discharge / pre_flow
+        return pd.DataFrame({
+            'edge': self.edge_values[edges],
+            'start': start_time,
+            'end': end_time,
+            'duration': end_time - start_time,
+            'recovered': ends < self.n_bins,
+            'min_speed': min_speed,
+            'pre_breakdown_flow': pre_flow,
+            'pre_breakdown_peak': pre_peak,
+            'discharge_flow': discharge,
+            'capacity_drop': capacity_drop,
+        }, columns=BREAKDOWN_COLUMNS)
+
+    def fundamental_diagram(self, state=None):
+        """各路段的基本图参数
+
+        Greenshields模型 v = vf·(1 - k/kj) 对全部时间窗做速度-密度线性回归，通行能力为 vf·kj/4；
+        三角形模型的自由流分支 q = vf·k 以非拥堵时间窗过原点拟合，拥堵分支 q = w·(kj - k) 以拥堵时间窗拟合，
+        通行能力为两分支的交点。没有足够的拥堵时间窗时拥堵分支为NaN，通行能力取非拥堵时间窗的最大流量
+        """
+        if state is None:
+            state = self.congestion_state(min_duration=0)
+        valid = self.valid
+        k = np.where(valid, self.density, 0.0)
+        v = np.where(valid, self.speed, 0.0)
+        q = np.where(valid, self.flow, 0.0)
+
+        # Greenshields：速度-密度线性回归
+        gs_free, gs_slope, n_windows = _least_squares(valid, k, v)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            gs_jam = np.where(gs_slope < 0, -gs_free / gs_slope, np.nan)
+            residuals = v - (gs_free + gs_slope * k)
+            mean_speed = v.sum(axis=0) / n_windows
+            ss_res, ss_tot = _masked_sums(valid, residuals ** 2, (v - mean_speed) ** 2)
+            gs_r2 = 1 - ss_res / ss_tot
+
+        # 三角形：自由流分支过原点，拥堵分支线性回归
+        free = valid & ~state
+        congested = valid & state
+        qk, kk = _masked_sums(free, q * k, k * k)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            free_speed = np.where(kk > 0, qk / kk, np.nan)
+        intercept, slope, n_congested = _least_squares(congested, k, q)
+        wave_speed = np.where(slope < 0, -slope, np.nan)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            jam_density = intercept / wave_speed
+            critical_density = wave_speed * jam_density / (free_speed + wave_speed)
+        capacity = free_speed * critical_density
+        free_max = np.where(free, self.flow, -np.inf).max(axis=0, initial=-np.inf)
+        fallback = ~(capacity > 0)
+        capacity = np.where(fallback, np.where(np.isfinite(free_max), free_max, np.nan), capacity)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            critical_density = np.where(fallback, capacity / free_speed, critical_density)
+        wave_speed = np.where(fallback, np.nan, wave_speed)
+        jam_density = np.where(fallback, np.nan, jam_density)
+        max_flow = np.where(valid, self.flow, -np.inf).max(axis=0, initial=-np.inf)
+
+        return pd.DataFrame({
+            'edge': self.edge_values,
+            'windows': n_windows,
+            'congested_windows': n_congested,
+            'free_flow_speed': self.free_flow_speed(),
+            'greenshields_free_speed': gs_free,
+            'greenshields_jam_density': gs_jam,
+            'greenshields_capacity': gs_free * gs_jam / 4,
+            'greenshields_r2': gs_r2,
+            'triangular_free_speed': free_speed,
+            'wave_speed': wave_speed,
+            'jam_density': jam_density,
+            'critical_density': critical_density,
+            'capacity': capacity,
+            'max_flow': np.where(np.isfinite(max_flow), max_flow, np.nan),
+        }, columns=FUNDAMENTAL_DIAGRAM_COLUMNS)
+
+    def analyze(self, breakdown_ratio=DEFAULT_BREAKDOWN_RATIO, recovery_ratio=DEFAULT_RECOVERY_RATIO,
+                min_duration=DEFAULT_MIN_DURATION, pre_window=DEFAULT_PRE_BREAKDOWN_WINDOW):
+        """返回 (基本图参数表, 崩溃事件表)
+
+        基本图按不过滤持续时间的拥堵状态划分分支（短暂的速度下降不是崩溃，但仍是拥堵分支上的观测），
+        崩溃事件只计持续时间不短于min_duration的拥堵
+        """
+        state = self.congestion_state(breakdown_ratio, recovery_ratio, min_duration=0)
+        return (self.fundamental_diagram(state),
+                self.breakdowns(self._drop_short(state, min_duration), pre_window))
+
+
+def capacity_summary(fundamental_diagram, breakdowns):
+    """各路段的通行能力汇总：基本图通行能力、崩溃次数、崩溃前流量、排队消散流量和通行能力下降"""
+    edges = fundamental_diagram['edge']
+    event_columns = ['pre_breakdown_flow', 'discharge_flow', 'capacity_drop']
+    if len(breakdowns):
+        events = breakdowns.groupby('edge', sort=False)[event_columns].mean().reindex(edges)
+        counts = breakdowns['edge'].value_counts().reindex(edges, fill_value=0)
+    else:
+        events = pd.DataFrame(np.nan, index=edges, columns=event_columns)
+        counts = pd.Series(0, index=edges)
+    summary = {column: fundamental_diagram[column].to_numpy()
+               for column in ('edge', 'free_flow_speed', 'capacity', 'max_flow')}
+    summary['breakdowns'] = counts.to_numpy(dtype=int)
+    summary.update((column, events[column].to_numpy(dtype=float)) for column in event_columns)
+    return pd.DataFrame(summary)
+
+
+def aggregate_files(paths):
+    """展开命令行给出的路径：.npz文件直接使用，目录下查找各层的aggregate.npz"""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(sorted(glob.glob(os.path.join(path, '**', AGGREGATE_FILE), recursive=True)))
+        else:
+            files.extend(sorted(glob.glob(path)) or [path])
+    return files
+
+
+def analyze_runs(paths, network=None, bin_width=None, **options):
+    """对多次运行保存的累积量逐个分析（bin_width为None时使用各累积量的时间窗），
+    返回带run列（文件所在目录名）的 (汇总表, 崩溃事件表)
+    """
+    summaries = []
+    events = []
+    for path in paths:
+        run = os.path.basename(os.path.dirname(os.path.abspath(path))) or path
+        fundamental_diagram, breakdowns = CapacityAnalysis.load(path, network, bin_width).analyze(**options)
+        summary = capacity_summary(fundamental_diagram, breakdowns)
+        summary.insert(0, 'run', run)
+        breakdowns.insert(0, 'run', run)
+        summaries.append(summary)
+        events.append(breakdowns)
+    if not summaries:
+        return pd.DataFrame(), pd.DataFrame()
+    return (pd.concat(summaries, ignore_index=True),
+            pd.concat([frame for frame in events if len(frame)] or [events[0]], ignore_index=True))
+
+
+def print_summary(summary, edges=None):
+    """输出各运行、各路段的通行能力和崩溃情况"""
+    if edges:
+        summary = summary[summary['edge'].isin(edges)]
+    for row in summary.itertuples():
+        line = (f"  {row.run} {row.edge}: 通行能力 {row.capacity:.0f} veh/h，"
+                f"自由流速度 {row.free_flow_speed:.1f} km/h，崩溃 {row.breakdowns} 次")
+        if row.breakdowns:
+            line += (f"，崩溃前流量 {row.pre_breakdown_flow:.0f} veh/h，"
+                     f"排队消散流量 {row.discharge_flow:.0f} veh/h，通行能力下降 {row.capacity_drop:.1%}")
+        print(line)
+
+
+def parse_args(argv=None):
+    """解析命令行参数"""
+    parser = argparse.ArgumentParser(description="通行能力与流量崩溃分析")
+    parser.add_argument('paths', nargs='+',
+                        help="TrafficAggregate累积量(.npz)文件，或包含aggregate.npz的目录（如重复仿真输出目录）")
+    parser.add_argument('--net', default="highway.net.xml", help="路网文件（用于真实路段长度）")
+    parser.add_argument('--bin-width', type=float, default=None,
+                        help="分析时间窗（秒），必须是累积量时间窗的整数倍，默认使用累积量的时间窗")
+    parser.add_argument('--breakdown-ratio', type=float, default=DEFAULT_BREAKDOWN_RATIO,
+                        help="崩溃速度阈值（相对自由流速度）")
+    parser.add_argument('--recovery-ratio', type=float, default=DEFAULT_RECOVERY_RATIO,
+                        help="恢复速度阈值（相对自由流速度）")
+    parser.add_argument('--min-duration', type=float, default=DEFAULT_MIN_DURATION,
+                        help="计为崩溃的最短拥堵时长（秒）")
+    parser.add_argument('--pre-window', type=float, default=DEFAULT_PRE_BREAKDOWN_WINDOW,
+                        help="崩溃前流量的统计时长（秒）")
+    parser.add_argument('--edges', nargs='+', default=None, help="只输出这些路段")
+    parser.add_argument('--output', default=None, help="汇总表CSV文件，崩溃事件写入同名的_events.csv")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """主函数"""
+    args = parse_args(argv)
+    print("=== 通行能力与流量崩溃分析 ===")
+    files = aggregate_files(args.paths)
+    if not files:
+        print("没有找到累积量文件")
+        return 1
+    network = None
+    if os.path.exists(args.net):
+        from network_index import load_network_index
+        network = load_network_index(args.net)
+
+    started = time.perf_counter()
+    summary, events = analyze_runs(files, network, args.bin_width,
+                                   breakdown_ratio=args.breakdown_ratio,
+                                   recovery_ratio=args.recovery_ratio,
+                                   min_duration=args.min_duration, pre_window=args.pre_window)
+    elapsed = time.perf_counter() - started
+    print(f"已分析 {len(files)} 次运行，用时 {elapsed * 1000:.1f}ms，共 {len(events)} 次流量崩溃")
+    print_summary(summary, args.edges)
+
+    if args.output:
+        summary.to_csv(args.output, index=False)
+        events_file = os.path.splitext(args.output)[0] + '_events.csv'
+        events.to_csv(events_file, index=False)
+        print(f"汇总表已保存: {args.output}")
+        print(f"崩溃事件已保存: {events_file}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,239 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+图表渲染
+交通统计按路段只分组一次，整理为各路段的NumPy数组后交给渲染函数；
+各图表由预先定义的图表模板（布局、标题、坐标轴标签）生成，直接使用Agg画布而不经过pyplot的全局状态，
+相互独立的图表可以在多个进程中并行渲染。
+草稿模式使用低分辨率且不计算紧凑边界，适合调试时快速查看；正式报告使用全质量输出
+"""
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import matplotlib
+from matplotlib.figure import Figure
+
+# 输出质量：savefig参数
+CHART_QUALITY = {
+    'full': {'dpi': 300, 'bbox_inches': 'tight'},
+    'draft': {'dpi': 72, 'bbox_inches': None},
+}
+
+# 分路段对比图与效率图的配色
+EDGE_COLORS = ['#1f77b4', '#ff7f0e', '#2ca02c', '#d62728', '#9467bd']
+
+# 按路段整理的交通统计列
+EDGE_SERIES_COLUMNS = ('time_center', 'volume', 'avg_speed', 'density', 'occupancy')
+
+
+def configure_matplotlib():
+    """使用Agg后端和中文字体；工作进程启动时调用一次"""
+    matplotlib.use('Agg')
+    matplotlib.rcParams['font.sans-serif'] = ['SimHei', 'DejaVu Sans']
+    matplotlib.rcParams['axes.unicode_minus'] = False
+
+
+def group_by_edge(traffic_df, columns=EDGE_SERIES_COLUMNS):
+    """按路段一次分组，返回 {路段: {列名: 数组}}（路段按首次出现顺序）"""
+    series = {}
+    for edge, rows in traffic_df.groupby('edge', sort=False, observed=True):
+        series[edge] = {column: rows[column].to_numpy() for column in columns}
+    return series
+
+
+class PanelTemplate:
+    """子图模板：标题和坐标轴标签"""
+
+    def __init__(self, title, xlabel, ylabel, legend=True, grid_axis='both', rotate_xticks=False):
+        self.title = title
+        self.xlabel = xlabel
+        self.ylabel = ylabel
+        self.legend = legend
+        self.grid_axis = grid_axis
+        self.rotate_xticks = rotate_xticks
+
+    def apply(self, ax):
+        ax.set_title(self.title, fontsize=14, fontweight='bold')
+        ax.set_xlabel(self.xlabel)
+        ax.set_ylabel(self.ylabel)
+        if self.legend and ax.get_legend_handles_labels()[0]:
+            ax.legend()
+        if self.rotate_xticks:
+            ax.tick_params(axis='x', labelrotation=45)
+        ax.grid(True, alpha=0.3, axis=self.grid_axis)
+
+
+class FigureTemplate:
+    """图表模板：画布大小、子图布局和各子图模板"""
+
+    def __init__(self, figsize, rows, cols, panels):
+        self.figsize = figsize
+        self.rows = rows
+        self.cols = cols
+        self.panels = panels
+
+    def create(self):
+        """创建图表，返回 (figure, 与panels对应的子图列表)"""
+        figure = Figure(figsize=self.figsize)
+        axes = figure.subplots(self.rows, self.cols).ravel()
+        return figure, list(axes[:len(self.panels)])
+
+    def finish(self, figure, axes, path, quality):
+        """应用子图模板并保存"""
+        for ax, panel in zip(axes, self.panels):
+            panel.apply(ax)
+        options = CHART_QUALITY[quality]
+        if options['bbox_inches'] is not None:
+            figure.tight_layout()
+        else:
+            # 草稿模式用固定间距代替需要额外绘制的自动布局
+            figure.subplots_adjust(left=0.06, right=0.98, top=0.95, bottom=0.1, hspace=0.4, wspace=0.25)
+        figure.savefig(path, **options)
+        return path
+
+
+TRAFFIC_TEMPLATE = FigureTemplate((15, 10), 2, 3, [
+    PanelTemplate('车流量时变图', '时间 (s)', '车流量 (veh/h)'),
+    PanelTemplate('平均速度时变图', '时间 (s)', '速度 (km/h)'),
+    PanelTemplate('密度时变图', '时间 (s)', '密度 (veh/km)'),
+    PanelTemplate('占有率时变图', '时间 (s)', '占有率 (%)'),
+    PanelTemplate('速度-密度关系图', '密度 (veh/km)', '速度 (km/h)'),
+    PanelTemplate('各路段交通效率对比', '路段', '效率 (veh/h)/(veh/km)', legend=False,
+                  grid_axis='y', rotate_xticks=True),
+])
+
+COMPARISON_TEMPLATE = FigureTemplate((15, 8), 2, 2, [
+    PanelTemplate('各路段平均车流量对比', '路段', '车流量 (veh/h)', legend=False, rotate_xticks=True),
+    PanelTemplate('各路段平均速度对比', '路段', '速度 (km/h)', legend=False, rotate_xticks=True),
+    PanelTemplate('各路段平均密度对比', '路段', '密度 (veh/km)', legend=False, rotate_xticks=True),
+    PanelTemplate('各路段平均占有率对比', '路段', '占有率 (%)', legend=False, rotate_xticks=True),
+])
+
+NETWORK_TEMPLATE = FigureTemplate((15, 8), 2, 2, [
+    PanelTemplate('路网车辆数时变图', '时间 (s)', '车辆数'),
+    PanelTemplate('路网平均速度时变图', '时间 (s)', '速度 (km/h)', legend=False),
+    PanelTemplate('平均等待时间', '时间 (s)', '等待时间 (s)', legend=False),
+    PanelTemplate('进入/到达车辆数', '时间 (s)', '车辆数', grid_axis='y'),
+])
+
+CORRIDOR_TEMPLATE = FigureTemplate((15, 6), 1, 2, [
+    PanelTemplate('主线走廊速度时空图', '时间 (s)', '走廊距离 (m)', legend=False, grid_axis='x'),
+    PanelTemplate('主线走廊密度时空图', '时间 (s)', '走廊距离 (m)', legend=False, grid_axis='x'),
+])
+
+
+def render_traffic_figure(edge_series, path, quality='full'):
+    """交通流参数时变图（2x3布局）"""
+    figure, axes = TRAFFIC_TEMPLATE.create()
+    time_axes = (('volume', 'o'), ('avg_speed', 's'), ('density', '^'), ('occupancy', 'd'))
+    for ax, (column, marker) in zip(axes, time_axes):
+        for edge, series in edge_series.items():
+            ax.plot(series['time_center'], series[column], marker=marker, markersize=4,
+                    label=f'{edge}', linewidth=2)
+
+    for edge, series in edge_series.items():
+        axes[4].scatter(series['density'], series['avg_speed'], alpha=0.7, s=50, label=f'{edge}')
+
+    # 各路段平均流量与平均密度之比
+    edges = list(edge_series)
+    efficiencies = [np.mean(series['volume']) / max(np.mean(series['density']), 0.1)
+                    for series in edge_series.values()]
+    bars = axes[5].bar(edges, efficiencies, color=EDGE_COLORS[:len(edges)], alpha=0.7, edgecolor='black')
+    for bar, efficiency in zip(bars, efficiencies):
+        axes[5].text(bar.get_x() + bar.get_width() / 2, bar.get_height() + max(efficiencies) * 0.01,
+                     f'{efficiency:.1f}', ha='center', va='bottom', fontweight='bold')
+
+    return TRAFFIC_TEMPLATE.finish(figure, axes, path, quality)
+
+
+def render_comparison_figure(edge_means, path, quality='full'):
+    """分路段对比图；edge_means为 {列名: {路段: 平均值}}"""
+    figure, axes = COMPARISON_TEMPLATE.create()
+    bar_colors = (('volume', 'lightblue'), ('avg_speed', 'lightgreen'),
+                  ('density', 'lightcoral'), ('occupancy', 'lightyellow'))
+    for ax, (column, color) in zip(axes, bar_colors):
+        values = edge_means[column]
+        ax.bar(list(values), list(values.values()), color=color, alpha=0.8)
+    return COMPARISON_TEMPLATE.finish(figure, axes, path, quality)
+
+
+def render_network_figure(summary_series, network_series, path, quality='full'):
+    """路网时间序列图（summary输出）"""
+    figure, axes = NETWORK_TEMPLATE.create()
+    axes[0].plot(summary_series['time'], summary_series['running'], label='在网车辆', linewidth=1)
+    axes[0].plot(summary_series['time'], summary_series['halting'], label='停驶车辆', linewidth=1)
+    axes[1].plot(network_series['time_center'], network_series['mean_speed'], marker='o', markersize=4,
+                 linewidth=2)
+    axes[2].plot(summary_series['time'], summary_series['meanWaitingTime'], linewidth=1, color='tab:red')
+
+    centers = network_series['time_center']
+    width = (network_series['time_end'][0] - network_series['time_start'][0]) * 0.4
+    axes[3].bar(centers - width / 2, network_series['inserted'], width=width, label='进入')
+    axes[3].bar(centers + width / 2, network_series['arrived'], width=width, label='到达')
+    return NETWORK_TEMPLATE.finish(figure, axes, path, quality)
+
+
+def render_corridor_figure(grid, path, quality='full'):
+    """主线走廊时空图：grid为CorridorHeatmap.chart_data()，虚线标出各路段的起点"""
+    figure, axes = CORRIDOR_TEMPLATE.create()
+    panels = (('speed', 'RdYlGn', '速度 (km/h)'), ('density', 'YlOrRd', '密度 (veh/km)'))
+    for ax, (column, cmap, label) in zip(axes, panels):
+        values = np.ma.masked_invalid(grid[column].T)
+        mesh = ax.pcolormesh(grid['time_edges'], grid['space_edges'], values, cmap=cmap, shading='flat')
+        figure.colorbar(mesh, ax=ax, label=label)
+        for edge, start, end in grid['edges']:
+            ax.axhline(start, color='black', linestyle='--', linewidth=0.8, alpha=0.6)
+            ax.text(grid['time_edges'][0], (start + end) / 2, f' {edge}', va='center', fontweight='bold')
+    return CORRIDOR_TEMPLATE.finish(figure, axes, path, quality)
+
+
+# 可在工作进程中调用的渲染函数
+RENDERERS = {
+    'traffic': render_traffic_figure,
+    'comparison': render_comparison_figure,
+    'network': render_network_figure,
+    'corridor': render_corridor_figure,
+}
+
+
+def _render_job(job):
+    """工作进程：渲染一张图表，返回保存路径"""
+    name, args, path, quality = job
+    return RENDERERS[name](*args, path, quality)
+
+
+class ChartRenderer:
+    """渲染一组相互独立的图表
+
+    quality为'full'（300dpi、紧凑边界）或'draft'（低分辨率、不计算边界）；
+    workers大于1时各图表在独立进程中渲染，传给工作进程的只有按路段整理好的数组
+    """
+
+    def __init__(self, report_dir, quality='full', workers=1):
+        if quality not in CHART_QUALITY:
+            raise ValueError(f"未知的图表质量: {quality}")
+        self.report_dir = report_dir
+        self.quality = quality
+        self.workers = workers
+        self.jobs = []
+
+    def add(self, name, filename, *args):
+        """登记一张图表，返回其保存路径"""
+        path = os.path.join(self.report_dir, filename)
+        self.jobs.append((name, args, path, self.quality))
+        return path
+
+    def render(self):
+        """渲染全部已登记的图表，按登记顺序返回保存路径"""
+        jobs, self.jobs = self.jobs, []
+        if not jobs:
+            return []
+        os.makedirs(self.report_dir, exist_ok=True)
+        workers = min(self.workers or 1, len(jobs))
+        if workers <= 1:
+            configure_matplotlib()
+            return [_render_job(job) for job in jobs]
+        with ProcessPoolExecutor(max_workers=workers, initializer=configure_matplotlib) as executor:
+            return list(executor.map(_render_job, jobs))
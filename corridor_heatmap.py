@@ -0,0 +1,290 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+主线走廊时空图
+按highway.net.xml中的车道线形把M1→M2→M3上的每个轨迹点映射为沿主线的累计距离，
+再以向量化直方图（bincount）累积到 (时间 × 空间) 网格中，
+按Edie广义定义计算各单元的空间平均速度、密度和流量，用于观察匝道汇入处激波的产生和传播。
+网格可以按数据块增量累积，长轨迹文件只需单遍流式读取，内存占用只与网格大小有关
+"""
+
+import numpy as np
+import pandas as pd
+
+from cross_sections import _codes
+from fcd_reader import FCDColumnBuffer, iter_fcd_records, DEFAULT_CHUNK_SIZE
+
+# 主线走廊（按行驶方向排列的路段）
+MAINLINE_CORRIDOR = ('M1', 'M2', 'M3')
+
+# 默认网格：时间窗（秒）和空间单元长度（m）
+DEFAULT_TIME_BIN = 10.0
+DEFAULT_SPACE_BIN = 25.0
+
+HEATMAP_COLUMNS = ['time_start', 'time_end', 'distance_start', 'distance_end', 'edge',
+                   'samples', 'speed', 'density', 'flow']
+
+
+def _polyline_lengths(polyline):
+    """折线各段长度及各段起点的累计长度"""
+    segments = np.diff(polyline, axis=0)
+    lengths = np.hypot(segments[:, 0], segments[:, 1])
+    return segments, lengths, np.concatenate([[0.0], np.cumsum(lengths)[:-1]])
+
+
+def project_onto_polyline(points, polyline):
+    """把点投影到折线上，返回 (沿折线的距离, 到折线的横向距离)"""
+    points = np.asarray(points, dtype=float).reshape(-1, 2)
+    polyline = np.asarray(polyline, dtype=float)
+    segments, lengths, starts = _polyline_lengths(polyline)
+    relative = points[:, None, :] - polyline[None, :-1, :]
+    fraction = np.clip((relative * segments).sum(axis=2) / np.maximum(lengths ** 2, 1e-12), 0.0, 1.0)
+    offset = relative - fraction[..., None] * segments
+    lateral = np.hypot(offset[..., 0], offset[..., 1])
+    nearest = lateral.argmin(axis=1)
+    rows = np.arange(len(points))
+    return starts[nearest] + fraction[rows, nearest] * lengths[nearest], lateral[rows, nearest]
+
+
+def _reference_shape(network, edge):
+    """路段的参考线：各车道线形点数相同时取其平均（路段中心线），否则取中间车道"""
+    shapes = [network.lane_shape(lane) for lane in network.edges[edge]['lanes']]
+    shapes = [np.asarray(shape, dtype=float) for shape in shapes if len(shape) >= 2]
+    if not shapes:
+        raise ValueError(f"路段缺少车道线形: {edge}")
+    if len({len(shape) for shape in shapes}) == 1:
+        return np.mean(shapes, axis=0)
+    return shapes[len(shapes) // 2]
+
+
+class CorridorGeometry:
+    """主线走廊几何：车道位置到走廊累计距离的线性映射
+
+    lanes: {车道ID: (车道起点的走廊距离, 每米车道位置对应的走廊距离)}，
+    edges: {路段ID: (起点距离, 终点距离)}，length为走廊总长（m）。
+    SUMO的车道位置按车道length计量，与线形长度可能不同，映射比例由线形两端的投影得到
+    """
+
+    def __init__(self, lanes, edges, length):
+        self.lanes = lanes
+        self.edges = edges
+        self.length = float(length)
+
+    @classmethod
+    def from_network(cls, network, edges=MAINLINE_CORRIDOR):
+        """由路网几何索引构建；edges为按行驶方向排列的路段，参考线为各路段中心线首尾相连"""
+        missing = [edge for edge in edges if edge not in network.edges]
+        if missing:
+            raise ValueError(f"路网中不存在路段: {', '.join(missing)}")
+
+        reference = np.concatenate([_reference_shape(network, edge) for edge in edges])
+        keep = np.concatenate([[True], np.any(np.diff(reference, axis=0) != 0, axis=1)])
+        reference = reference[keep]
+        length = _polyline_lengths(reference)[1].sum()
+
+        lanes = {}
+        edge_bounds = {}
+        for edge in edges:
+            starts = []
+            ends = []
+            for lane in network.edges[edge]['lanes']:
+                shape = network.lane_shape(lane)
+                lane_length = network.lanes[lane]['length']
+                if len(shape) < 2 or lane_length <= 0:
+                    continue
+                (start, end), _ = project_onto_polyline([shape[0], shape[-1]], reference)
+                lanes[lane] = (float(start), float((end - start) / lane_length))
+                starts.append(start)
+                ends.append(end)
+            edge_bounds[edge] = (float(min(starts)), float(max(ends)))
+        return cls(lanes, edge_bounds, length)
+
+    def lane_lookup(self, lane_values):
+        """与车道取值表对应的 (起点距离, 比例) 数组，末尾附加一项NaN供编码-1（缺失值）使用"""
+        start = np.full(len(lane_values) + 1, np.nan)
+        scale = np.full(len(lane_values) + 1, np.nan)
+        for code, lane in enumerate(lane_values):
+            mapping = self.lanes.get(lane)
+            if mapping is not None:
+                start[code], scale[code] = mapping
+        return start, scale
+
+    def distance(self, lane_codes, lane_values, pos):
+        """轨迹点的走廊累计距离，不在走廊上的点为NaN"""
+        start, scale = self.lane_lookup(lane_values)
+        return start[lane_codes] + scale[lane_codes] * np.asarray(pos, dtype=float)
+
+    def edge_at(self, distance):
+        """走廊距离所在的路段（路段之间的交叉口区域为None）"""
+        for edge, (start, end) in self.edges.items():
+            if start <= distance <= end:
+                return edge
+        return None
+
+
+class CorridorHeatmap:
+    """走廊 (时间 × 空间) 网格的累积量
+
+    samples为各单元的轨迹点数，speed_sums为速度之和（m/s）。
+    每个轨迹点代表一个采样周期（FCD输出间隔，由数据推断）内的行驶，
+    因此单元内总停留时间为 samples × 采样周期、总行驶距离为 speed_sums × 采样周期。
+    时间方向随数据增长，空间方向固定为走廊长度
+    """
+
+    def __init__(self, geometry, time_bin=DEFAULT_TIME_BIN, space_bin=DEFAULT_SPACE_BIN, origin=0.0):
+        if time_bin <= 0 or space_bin <= 0:
+            raise ValueError("时间窗和空间单元长度必须为正数")
+        self.geometry = geometry
+        self.time_bin = float(time_bin)
+        self.space_bin = float(space_bin)
+        self.origin = float(origin)
+        # 走廊长度不是单元长度的整数倍时，余下部分并入最后一个单元
+        self.n_space = max(int(geometry.length // self.space_bin), 1)
+        self.samples = np.zeros((0, self.n_space), dtype=np.int64)
+        self.speed_sums = np.zeros((0, self.n_space), dtype=np.float64)
+        self.sample_period = None
+        self.n_rows = 0
+
+    @property
+    def n_bins(self):
+        return self.samples.shape[0]
+
+    def _grow(self, n_bins):
+        if n_bins <= self.n_bins:
+            return
+        extra = n_bins - self.n_bins
+        self.samples = np.vstack([self.samples, np.zeros((extra, self.n_space), dtype=np.int64)])
+        self.speed_sums = np.vstack([self.speed_sums, np.zeros((extra, self.n_space))])
+
+    def _update_sample_period(self, time):
+        steps = np.diff(np.unique(time))
+        steps = steps[steps > 1e-9]
+        if len(steps):
+            period = round(float(steps.min()), 6)
+            self.sample_period = period if self.sample_period is None else min(self.sample_period, period)
+
+    def add(self, time, lane_codes, lane_values, pos, speed):
+        """累积一批轨迹点（车道为编码数组及其取值表），返回落在走廊上的点数"""
+        time = np.asarray(time, dtype=float)
+        self.n_rows += len(time)
+        if not len(time):
+            return 0
+        self._update_sample_period(time)
+
+        distance = self.geometry.distance(lane_codes, lane_values, pos)
+        time_index = np.floor((time - self.origin) / self.time_bin)
+        valid = (time_index >= 0) & (distance >= 0) & (distance <= self.geometry.length)
+        if not valid.any():
+            return 0
+        time_index = time_index[valid].astype(np.int64)
+        space_index = np.minimum((distance[valid] / self.space_bin).astype(np.int64), self.n_space - 1)
+
+        n_bins = int(time_index.max()) + 1
+        self._grow(n_bins)
+        cells = time_index * self.n_space + space_index
+        size = n_bins * self.n_space
+        counts = np.bincount(cells, minlength=size).reshape(n_bins, self.n_space)
+        speeds = np.bincount(cells, weights=np.asarray(speed, dtype=float)[valid],
+                             minlength=size).reshape(n_bins, self.n_space)
+        self.samples[:n_bins] += counts
+        self.speed_sums[:n_bins] += speeds
+        return int(valid.sum())
+
+    def add_fcd(self, fcd_df):
+        """累积一个FCD数据框（或其中的一块）"""
+        lane_codes, lane_values = _codes(fcd_df['lane'])
+        return self.add(fcd_df['time'].to_numpy(), lane_codes, lane_values,
+                        fcd_df['pos'].to_numpy(), fcd_df['speed'].to_numpy())
+
+    @classmethod
+    def from_fcd(cls, fcd_df, geometry, time_bin=DEFAULT_TIME_BIN, space_bin=DEFAULT_SPACE_BIN, origin=0.0):
+        heatmap = cls(geometry, time_bin=time_bin, space_bin=space_bin, origin=origin)
+        heatmap.add_fcd(fcd_df)
+        return heatmap
+
+    @classmethod
+    def from_fcd_file(cls, fcd_file, geometry, time_bin=DEFAULT_TIME_BIN, space_bin=DEFAULT_SPACE_BIN,
+                      origin=0.0, chunk_size=DEFAULT_CHUNK_SIZE):
+        """单遍流式读取轨迹文件并逐块累积，不保留轨迹数据"""
+        heatmap = cls(geometry, time_bin=time_bin, space_bin=space_bin, origin=origin)
+
+        def sink(chunk):
+            heatmap.add(chunk['time'], chunk['lane'], list(buffer.lane_codes), chunk['pos'], chunk['speed'])
+
+        buffer = FCDColumnBuffer(chunk_size=chunk_size, sink=sink)
+        for record in iter_fcd_records(fcd_file):
+            buffer.append(*record)
+        buffer.flush()
+        return heatmap
+
+    def merge(self, other):
+        """合并另一网格（相同走廊和网格划分，例如分片或增量分析的结果）"""
+        if (other.n_space != self.n_space or other.time_bin != self.time_bin
+                or other.space_bin != self.space_bin or other.origin != self.origin):
+            raise ValueError("只能合并网格划分相同的时空图")
+        self._grow(other.n_bins)
+        self.samples[:other.n_bins] += other.samples
+        self.speed_sums[:other.n_bins] += other.speed_sums
+        if other.sample_period is not None:
+            self.sample_period = (other.sample_period if self.sample_period is None
+                                  else min(self.sample_period, other.sample_period))
+        self.n_rows += other.n_rows
+        return self
+
+    @property
+    def time_edges(self):
+        return self.origin + np.arange(self.n_bins + 1) * self.time_bin
+
+    @property
+    def space_edges(self):
+        edges = np.arange(self.n_space + 1) * self.space_bin
+        edges[-1] = self.geometry.length
+        return edges
+
+    def speed(self):
+        """各单元的空间平均速度（km/h），无数据的单元为NaN"""
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(self.samples > 0, self.speed_sums / self.samples * 3.6, np.nan)
+
+    def _cell_area(self):
+        """各单元的时空面积（h·km），最后一个单元按实际长度计算"""
+        return (self.time_bin / 3600.0) * (np.diff(self.space_edges) / 1000.0)
+
+    def density(self):
+        """各单元的密度（veh/km，走廊全部车道合计）：总停留时间 / 单元面积"""
+        period = self.sample_period or 1.0
+        return self.samples * (period / 3600.0) / self._cell_area()
+
+    def flow(self):
+        """各单元的流量（veh/h，全部车道合计）：总行驶距离 / 单元面积"""
+        period = self.sample_period or 1.0
+        return self.speed_sums * (period / 1000.0) / self._cell_area()
+
+    def chart_data(self):
+        """渲染时空图所需的数组（可传给图表工作进程）"""
+        return {
+            'time_edges': self.time_edges,
+            'space_edges': self.space_edges,
+            'speed': self.speed(),
+            'density': np.where(self.samples > 0, self.density(), np.nan),
+            'edges': [(edge, start, end) for edge, (start, end) in self.geometry.edges.items()],
+        }
+
+    def to_frame(self):
+        """有数据的单元的长表（每个 (时间窗, 空间单元) 一行）"""
+        rows, cols = np.nonzero(self.samples)
+        time_edges = self.time_edges
+        space_edges = self.space_edges
+        centers = (space_edges[:-1] + space_edges[1:]) / 2
+        edge_names = np.array([self.geometry.edge_at(center) for center in centers], dtype=object)
+        return pd.DataFrame({
+            'time_start': time_edges[rows],
+            'time_end': time_edges[rows + 1],
+            'distance_start': space_edges[cols],
+            'distance_end': space_edges[cols + 1],
+            'edge': edge_names[cols],
+            'samples': self.samples[rows, cols],
+            'speed': self.speed()[rows, cols],
+            'density': self.density()[rows, cols],
+            'flow': self.flow()[rows, cols],
+        }, columns=HEATMAP_COLUMNS)
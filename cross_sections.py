@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+虚拟断面车头时距与车间距
+在各路段上设置虚拟断面，把FCD记录按 (车辆, 时间) 排序为轨迹，
+以相邻两条记录跨越断面位置的区间线性插值得到通过时刻和速度；
+再按车道对通过时刻排序求车头时距、车头间距和车间净距。
+全部计算基于排序数组和向量化运算，不对车辆逐个循环
+"""
+
+import pandas as pd
+import numpy as np
+
+CROSSING_COLUMNS = ['section', 'edge', 'lane', 'pos', 'vehicle', 'time', 'speed']
+HEADWAY_COLUMNS = CROSSING_COLUMNS + ['leader', 'headway', 'space_headway', 'gap']
+HEADWAY_SUMMARY_COLUMNS = ['edge', 'lane', 'vehicles', 'mean_headway', 'median_headway',
+                           'min_headway', 'mean_space_headway', 'mean_gap']
+
+# 缺少车型信息时的车长（m）
+DEFAULT_VEHICLE_LENGTH_M = 5.0
+
+
+def _codes(series):
+    """整数编码和取值表；分类列直接复用其编码"""
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        return series.array.codes, np.asarray(series.cat.categories, dtype=object)
+    codes, values = pd.factorize(series)
+    return codes, np.asarray(values, dtype=object)
+
+
+class CrossSection:
+    """虚拟断面：路段edge上距路段起点pos米处；lane为None时覆盖该路段的全部车道"""
+
+    def __init__(self, edge, pos, lane=None, name=None):
+        self.edge = edge
+        self.pos = float(pos)
+        self.lane = lane
+        self.name = name or (f"{lane or edge}@{self.pos:g}")
+
+    def __repr__(self):
+        return f"CrossSection({self.name})"
+
+
+def default_sections(fcd_df, network=None, fraction=0.5):
+    """在每个出现过的路段上按路段长度的fraction处设置一个断面
+
+    network为NetworkIndex时使用真实路段长度，否则使用观测到的最大位置
+    """
+    edges = pd.unique(fcd_df['edge'].dropna())
+    max_pos = fcd_df.groupby('edge', observed=True)['pos'].max()
+    sections = []
+    for edge in edges:
+        length = network.edge_length(edge) if network is not None else None
+        if length is None:
+            length = float(max_pos[edge])
+        sections.append(CrossSection(edge, length * fraction))
+    return sections
+
+
+class TrackIndex:
+    """按 (车辆, 时间) 排序的轨迹索引
+
+    构建时只排序一次，并预先找出同一车辆在同一路段上的相邻记录对；
+    之后对任意多个断面、任意位置偏移计算通过时刻都只需向量化的区间判断和插值。
+    """
+
+    def __init__(self, fcd_df):
+        id_codes, self.id_values = _codes(fcd_df['id'])
+        edge_codes, self.edge_values = _codes(fcd_df['edge'])
+        lane_codes, self.lane_values = _codes(fcd_df['lane'])
+        time = fcd_df['time'].to_numpy(dtype=float)
+
+        # 按 (车辆, 时间) 排序为各车轨迹
+        order = np.lexsort((time, id_codes))
+        self.id_codes = id_codes[order]
+        self.edge_codes = edge_codes[order]
+        self.lane_codes = lane_codes[order]
+        self.time = time[order]
+        self.pos = fcd_df['pos'].to_numpy(dtype=float)[order]
+        self.speed = fcd_df['speed'].to_numpy(dtype=float)[order]
+        self._index_pairs()
+
+    @classmethod
+    def from_trajectories(cls, store):
+        """由已按 (车辆, 时间) 排序的TrajectoryStore构建，不再重新排序"""
+        index = cls.__new__(cls)
+        index.id_codes = store.row_vehicle
+        index.id_values = store.vehicle_ids
+        index.edge_codes = np.asarray(store.columns['edge'])
+        index.edge_values = store.edge_values
+        index.lane_codes = np.asarray(store.columns['lane'])
+        index.lane_values = store.lane_values
+        for name in ('time', 'pos', 'speed'):
+            setattr(index, name, np.asarray(store.columns[name], dtype=float))
+        index._index_pairs()
+        return index
+
+    def _index_pairs(self):
+        # 同一车辆、同一路段上的相邻记录对 (i, i+1)
+        self.pairs = np.flatnonzero((self.id_codes[:-1] == self.id_codes[1:])
+                                    & (self.edge_codes[:-1] == self.edge_codes[1:])
+                                    & (self.edge_codes[:-1] >= 0))
+        self._edge_index = pd.Index(self.edge_values)
+        self._lane_index = pd.Index(self.lane_values)
+
+    def vehicle_codes(self, vehicle_ids):
+        """车辆ID对应的编码，未出现的车辆为-1"""
+        return pd.Index(self.id_values).get_indexer(np.asarray(vehicle_ids, dtype=object))
+
+    def crossing_arrays(self, sections, vehicle_offsets=None, match_lane=True):
+        """计算通过各断面的记录，返回数组字典
+
+        vehicle_offsets为按车辆编码排列的位置偏移（m），断面位置加上该偏移后再判断通过，
+        例如偏移取车长即得到车尾通过断面的时刻。
+        结果包含 section（断面序号）、vehicle（车辆编码）、lane（车道编码）、time、speed。
+        """
+        sections = list(sections)
+        empty = {key: np.empty(0, dtype=np.int64) for key in ('section', 'vehicle', 'lane')}
+        empty.update(time=np.empty(0), speed=np.empty(0))
+        if not sections or len(self.pairs) == 0:
+            return empty
+
+        section_edges = self._edge_index.get_indexer([section.edge for section in sections])
+        section_pos = np.array([section.pos for section in sections])
+        section_lanes = np.array([-2 if section.lane is None or not match_lane
+                                  else self._lane_index.get_indexer([section.lane])[0]
+                                  for section in sections])
+        known = section_edges >= 0
+        if not known.any():
+            return empty
+
+        # 断面按所在路段编码排序，每个记录对与其路段上的每个断面各比较一次
+        section_order = np.flatnonzero(known)[np.argsort(section_edges[known], kind='stable')]
+        sorted_edges = section_edges[section_order]
+        pair_edges = self.edge_codes[self.pairs]
+        starts = np.searchsorted(sorted_edges, pair_edges, side='left')
+        repeats = np.searchsorted(sorted_edges, pair_edges, side='right') - starts
+        pair_index = np.repeat(self.pairs, repeats)
+        offsets = np.arange(len(pair_index)) - np.repeat(np.cumsum(repeats) - repeats, repeats)
+        section_index = section_order[np.repeat(starts, repeats) + offsets]
+
+        x = section_pos[section_index]
+        if vehicle_offsets is not None:
+            x = x + vehicle_offsets[self.id_codes[pair_index]]
+        p0 = self.pos[pair_index]
+        p1 = self.pos[pair_index + 1]
+        hit = (p0 < x) & (p1 >= x)
+        pair_index = pair_index[hit]
+        section_index = section_index[hit]
+        p0 = p0[hit]
+
+        fraction = (x[hit] - p0) / (p1[hit] - p0)
+        t0 = self.time[pair_index]
+        v0 = self.speed[pair_index]
+        time = t0 + fraction * (self.time[pair_index + 1] - t0)
+        speed = v0 + fraction * (self.speed[pair_index + 1] - v0)
+        # 车道取距离通过时刻较近的一条记录的车道
+        lanes = np.where(fraction <= 0.5, self.lane_codes[pair_index], self.lane_codes[pair_index + 1])
+
+        lane_filter = section_lanes[section_index]
+        keep = (lane_filter == -2) | (lane_filter == lanes)
+        return {
+            'section': section_index[keep],
+            'vehicle': self.id_codes[pair_index[keep]],
+            'lane': lanes[keep],
+            'time': time[keep],
+            'speed': speed[keep],
+        }
+
+
+def find_crossings(fcd_df, sections, index=None):
+    """计算每辆车通过各断面的时刻和速度，返回通过记录数据框
+
+    同一车辆相邻两条记录位于同一路段、且位置由断面之前前进到断面处或之后时视为一次通过，
+    通过时刻和速度在两条记录之间线性插值；车道取距离通过时刻较近的一条记录的车道。
+    指定了车道的断面只统计该车道上的通过。index为已构建的TrackIndex时直接复用。
+    """
+    sections = list(sections)
+    if len(fcd_df) < 2 or not sections:
+        return pd.DataFrame(columns=CROSSING_COLUMNS)
+
+    index = index or TrackIndex(fcd_df)
+    arrays = index.crossing_arrays(sections)
+    names = np.array([section.name for section in sections], dtype=object)
+    edges = np.array([section.edge for section in sections], dtype=object)
+    positions = np.array([section.pos for section in sections])
+    crossings = pd.DataFrame({
+        'section': names[arrays['section']],
+        'edge': edges[arrays['section']],
+        'lane': index.lane_values[arrays['lane']],
+        'pos': positions[arrays['section']],
+        'vehicle': index.id_values[arrays['vehicle']],
+        'time': arrays['time'],
+        'speed': arrays['speed'],
+    }, columns=CROSSING_COLUMNS)
+    return crossings.sort_values(['section', 'time'], kind='stable', ignore_index=True)
+
+
+def compute_headways(crossings, vehicle_lengths=None):
+    """按 (断面, 车道) 对通过记录排序，计算与前车的车头时距（s）、车头间距和车间净距（m）
+
+    车头间距按后车通过速度 × 车头时距估计，车间净距为车头间距减去前车车长；
+    vehicle_lengths为车辆ID数组到车长数组（m）的映射函数，为None时使用默认车长。
+    每个车道上的第一辆车没有前车，不出现在结果中。
+    """
+    if crossings.empty:
+        return pd.DataFrame(columns=HEADWAY_COLUMNS)
+
+    group_codes = crossings.groupby(['section', 'lane'], sort=False, observed=True).ngroup().to_numpy()
+    time = crossings['time'].to_numpy(dtype=float)
+    order = np.lexsort((time, group_codes))
+    ordered = crossings.iloc[order].reset_index(drop=True)
+    group_codes = group_codes[order]
+    time = time[order]
+
+    follows = np.flatnonzero(group_codes[1:] == group_codes[:-1]) + 1
+    leaders = follows - 1
+    headways = ordered.iloc[follows].reset_index(drop=True)
+    headways['leader'] = ordered['vehicle'].to_numpy()[leaders]
+    headways['headway'] = time[follows] - time[leaders]
+    headways['space_headway'] = headways['speed'].to_numpy() * headways['headway'].to_numpy()
+
+    if vehicle_lengths is not None:
+        leader_ids, leader_index = np.unique(headways['leader'].to_numpy(dtype=object).astype(str),
+                                             return_inverse=True)
+        leader_lengths = np.asarray(vehicle_lengths(leader_ids), dtype=float)[leader_index]
+    else:
+        leader_lengths = DEFAULT_VEHICLE_LENGTH_M
+    headways['gap'] = headways['space_headway'].to_numpy() - leader_lengths
+    return headways[HEADWAY_COLUMNS]
+
+
+def headway_summary(headways):
+    """各路段、各车道的车头时距和车间距统计"""
+    if headways.empty:
+        return pd.DataFrame(columns=HEADWAY_SUMMARY_COLUMNS)
+    grouped = headways.groupby(['edge', 'lane'], sort=False, observed=True)
+    summary = grouped.agg(vehicles=('headway', 'size'),
+                          mean_headway=('headway', 'mean'),
+                          median_headway=('headway', 'median'),
+                          min_headway=('headway', 'min'),
+                          mean_space_headway=('space_headway', 'mean'),
+                          mean_gap=('gap', 'mean')).reset_index()
+    return summary[HEADWAY_SUMMARY_COLUMNS]
+
+
+def edge_mean_headways(headways):
+    """各路段（所有车道合并）的平均车头时距，返回 {路段: 秒}"""
+    if headways.empty:
+        return {}
+    return headways.groupby('edge', sort=False, observed=True)['headway'].mean().to_dict()
@@ -0,0 +1,391 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+交通需求生成
+以车型构成、起讫点分流比例和时变流量曲线描述需求场景，由预编译的模板生成SUMO路径文件。
+车型定义和路径定义的渲染结果按内容缓存，大量需求变体只需重新生成车流行；
+每个场景按规范化后的参数计算哈希，相同的路径文件只生成一次并在多次运行之间复用
+"""
+
+import os
+import json
+import hashlib
+import functools
+from string import Template
+
+# 生成的路径文件目录
+DEMAND_DIR = "demand_cache"
+
+# 高速公路-匝道路网的起讫点路径（路径ID与原有路径文件一致）
+HIGHWAY_ROUTES = {
+    ('M1', 'M3'): ('r_1', "M1 M2 M3"),      # 主线直行
+    ('onr', 'M3'): ('r_2', "onr M2 M3"),    # 上匝道汇入后直行
+    ('M1', 'offr'): ('r_3', "M1 M2 offr"),  # 主线后下匝道
+    ('onr', 'offr'): ('r_4', "onr M2 offr"),  # 上匝道汇入后下匝道
+}
+
+# 车流的出发方式：uniform为等间隔（vehsPerHour），poisson为泊松到达（period="exp(速率)"）
+DEPARTURE_MODES = ('uniform', 'poisson')
+
+# 默认仿真时段（秒），与highway-ramp.sumocfg一致
+DEFAULT_BEGIN = 0
+DEFAULT_END = 1600
+
+# 流量低于该值（veh/h）的车流不写出
+MIN_VEHS_PER_HOUR = 1e-6
+
+_DOCUMENT_TEMPLATE = Template('''<?xml version="1.0" encoding="UTF-8"?>
+
+<routes xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" xsi:noNamespaceSchemaLocation="http://sumo.dlr.de/xsd/routes_file.xsd">
+
+    <!-- 车辆类型定义 -->
+$vtypes
+
+    <!-- 路径定义 -->
+$routes
+
+    <!-- 交通流定义（$name，由demand_generator生成） -->
+$flows
+
+</routes>
+''')
+_VTYPE_TEMPLATE = Template('    <vType id="$id" $attributes/>')
+_ROUTE_TEMPLATE = Template('    <route id="$id" edges="$edges"/>')
+_FLOW_TEMPLATES = {
+    'uniform': Template('    <flow id="$id" route="$route" begin="$begin" end="$end" '
+                        'vehsPerHour="$vph" type="$vtype"/>'),
+    'poisson': Template('    <flow id="$id" route="$route" begin="$begin" end="$end" '
+                        'period="exp($rate)" type="$vtype"/>'),
+}
+
+
+def _number(value):
+    """数值的规范化文本（去掉多余的小数位）"""
+    return f"{value:.6g}"
+
+
+class VehicleType:
+    """车型定义：SUMO的vType属性"""
+
+    def __init__(self, vtype_id, **attributes):
+        self.id = vtype_id
+        self.attributes = attributes
+
+    def key(self):
+        return (self.id,) + tuple(sorted((name, str(value)) for name, value in self.attributes.items()))
+
+    def to_dict(self):
+        return {'id': self.id, **self.attributes}
+
+
+class TrafficStream:
+    """一个起点的交通需求
+
+    vehs_per_hour为起点的总流量，split为各终点的分流比例，vtype_mix为车型构成比例，
+    begin/end为车流的起止时间（秒）
+    """
+
+    def __init__(self, origin, vehs_per_hour, split, vtype_mix, begin=DEFAULT_BEGIN, end=DEFAULT_END):
+        for destination in split:
+            if (origin, destination) not in HIGHWAY_ROUTES:
+                raise ValueError(f"路网中没有从 {origin} 到 {destination} 的路径")
+        self.origin = origin
+        self.vehs_per_hour = vehs_per_hour
+        self.split = _normalized(split)
+        self.vtype_mix = _normalized(vtype_mix)
+        self.begin = begin
+        self.end = end
+
+    def scaled(self, factor):
+        return TrafficStream(self.origin, self.vehs_per_hour * factor, self.split, self.vtype_mix,
+                             self.begin, self.end)
+
+    def with_split(self, split):
+        return TrafficStream(self.origin, self.vehs_per_hour, split, self.vtype_mix, self.begin, self.end)
+
+    def to_dict(self):
+        return {
+            'origin': self.origin,
+            'vehs_per_hour': _number(self.vehs_per_hour),
+            'split': {destination: _number(share) for destination, share in sorted(self.split.items())},
+            'vtype_mix': {vtype: _number(share) for vtype, share in sorted(self.vtype_mix.items())},
+            'begin': _number(self.begin),
+            'end': _number(self.end),
+        }
+
+
+def _normalized(shares):
+    """比例归一化为和为1"""
+    total = sum(shares.values())
+    if total <= 0:
+        raise ValueError("比例之和必须大于0")
+    return {name: share / total for name, share in shares.items()}
+
+
+class FlowProfile:
+    """时变流量曲线：分段常数的流量倍数
+
+    points为 [(开始时间, 倍数), ...]，每个倍数持续到下一个开始时间
+    """
+
+    def __init__(self, points):
+        self.points = sorted((float(time), float(factor)) for time, factor in points)
+
+    def periods(self, begin, end):
+        """与 [begin, end) 相交的各时段 [(开始, 结束, 倍数)]"""
+        periods = []
+        for i, (start, factor) in enumerate(self.points):
+            stop = self.points[i + 1][0] if i + 1 < len(self.points) else end
+            start, stop = max(start, begin), min(stop, end)
+            if stop > start:
+                periods.append((start, stop, factor))
+        return periods
+
+    def to_list(self):
+        return [[_number(time), _number(factor)] for time, factor in self.points]
+
+
+class DemandScenario:
+    """一个需求场景：车型、各起点的交通需求、时变流量曲线和出发方式
+
+    seed为该场景的仿真随机种子；路径文件内容与随机种子无关，
+    因此route_key()不含seed，多个种子的同一需求共用一个路径文件
+    """
+
+    def __init__(self, vtypes, streams, profile=None, departure='uniform', seed=None, name=None):
+        if departure not in DEPARTURE_MODES:
+            raise ValueError(f"未知的出发方式: {departure}")
+        self.vtypes = list(vtypes)
+        self.streams = list(streams)
+        self.profile = profile
+        self.departure = departure
+        self.seed = seed
+        self.name = name
+        known = {vtype.id for vtype in self.vtypes}
+        for stream in self.streams:
+            for vtype in stream.vtype_mix:
+                if vtype not in known:
+                    raise ValueError(f"车型构成中引用了未定义的车型: {vtype}")
+
+    def _variant(self, **changes):
+        values = {'vtypes': self.vtypes, 'streams': self.streams, 'profile': self.profile,
+                  'departure': self.departure, 'seed': self.seed, 'name': self.name}
+        values.update(changes)
+        return DemandScenario(**values)
+
+    def scaled(self, factor):
+        """全部起点的流量乘以factor"""
+        return self._variant(streams=[stream.scaled(factor) for stream in self.streams])
+
+    def with_split(self, origin, split):
+        """替换某个起点的分流比例"""
+        return self._variant(streams=[stream.with_split(split) if stream.origin == origin else stream
+                                      for stream in self.streams])
+
+    def with_profile(self, profile):
+        return self._variant(profile=profile)
+
+    def with_seed(self, seed):
+        return self._variant(seed=seed)
+
+    def flows(self):
+        """展开为车流 [(flow_id, route_id, vtype, begin, end, veh/h)]"""
+        flows = []
+        for stream in self.streams:
+            periods = (self.profile.periods(stream.begin, stream.end) if self.profile
+                       else [(stream.begin, stream.end, 1.0)])
+            for destination, share in stream.split.items():
+                route_id = HIGHWAY_ROUTES[(stream.origin, destination)][0]
+                for vtype, vtype_share in stream.vtype_mix.items():
+                    for k, (begin, end, factor) in enumerate(periods):
+                        vph = stream.vehs_per_hour * share * vtype_share * factor
+                        if vph < MIN_VEHS_PER_HOUR:
+                            continue
+                        suffix = f"_p{k}" if len(periods) > 1 else ""
+                        flow_id = f"f_{stream.origin}_{destination}_{vtype}{suffix}"
+                        flows.append((flow_id, route_id, vtype, begin, end, vph))
+        return flows
+
+    def route_dict(self):
+        """决定路径文件内容的参数（不含名称和随机种子）"""
+        return {
+            'vtypes': [vtype.to_dict() for vtype in self.vtypes],
+            'streams': [stream.to_dict() for stream in self.streams],
+            'profile': self.profile.to_list() if self.profile else None,
+            'departure': self.departure,
+        }
+
+    def to_dict(self):
+        return {'name': self.name, 'seed': self.seed, **self.route_dict()}
+
+    def route_key(self):
+        """路径文件内容的哈希"""
+        return _hash(self.route_dict())
+
+    def key(self):
+        """场景（含随机种子）的哈希"""
+        return _hash({'seed': self.seed, **self.route_dict()})
+
+    def render(self):
+        """生成路径文件内容"""
+        return render_routes(self)
+
+    def __repr__(self):
+        return f"DemandScenario({self.name or self.route_key()[:10]})"
+
+
+def _hash(data):
+    text = json.dumps(data, sort_keys=True, ensure_ascii=False, separators=(',', ':'))
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+@functools.lru_cache(maxsize=64)
+def _render_vtypes(vtype_keys):
+    lines = []
+    for vtype_id, *attributes in vtype_keys:
+        text = " ".join(f'{name}="{value}"' for name, value in attributes)
+        lines.append(_VTYPE_TEMPLATE.substitute(id=vtype_id, attributes=text))
+    return "\n".join(lines)
+
+
+@functools.lru_cache(maxsize=64)
+def _render_routes(route_pairs):
+    return "\n".join(_ROUTE_TEMPLATE.substitute(id=HIGHWAY_ROUTES[pair][0], edges=HIGHWAY_ROUTES[pair][1])
+                     for pair in route_pairs)
+
+
+def render_routes(scenario):
+    """由模板生成路径文件；车型和路径部分按内容缓存，只有车流行每次生成"""
+    vtype_block = _render_vtypes(tuple(vtype.key() for vtype in scenario.vtypes))
+    pairs = sorted({(stream.origin, destination) for stream in scenario.streams
+                    for destination in stream.split},
+                   key=lambda pair: HIGHWAY_ROUTES[pair][0])
+    route_block = _render_routes(tuple(pairs))
+    template = _FLOW_TEMPLATES[scenario.departure]
+    flow_block = "\n".join(
+        template.substitute(id=flow_id, route=route_id, vtype=vtype, begin=_number(begin),
+                            end=_number(end), vph=_number(vph), rate=_number(vph / 3600))
+        for flow_id, route_id, vtype, begin, end, vph in scenario.flows())
+    return _DOCUMENT_TEMPLATE.substitute(vtypes=vtype_block, routes=route_block, flows=flow_block,
+                                         name=scenario.name or scenario.route_key()[:10])
+
+
+class DemandLibrary:
+    """按内容哈希保存生成的路径文件
+
+    相同需求（route_key相同）的路径文件只写出一次；index.json记录各文件对应的需求参数，
+    之后的运行直接复用已有文件
+    """
+
+    def __init__(self, directory=DEMAND_DIR):
+        self.directory = directory
+        self._index = None
+
+    def path(self, scenario):
+        return os.path.join(self.directory, f"{scenario.route_key()}.rou.xml")
+
+    def _load_index(self):
+        if self._index is None:
+            try:
+                with open(os.path.join(self.directory, "index.json"), 'r', encoding='utf-8') as f:
+                    self._index = json.load(f)
+            except (OSError, ValueError):
+                self._index = {}
+        return self._index
+
+    def _save_index(self):
+        index_file = os.path.join(self.directory, "index.json")
+        tmp_file = index_file + ".tmp"
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump(self._index, f, ensure_ascii=False, indent=1)
+        os.replace(tmp_file, index_file)
+
+    def _write(self, scenario):
+        path = self.path(scenario)
+        if not os.path.exists(path):
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.write(scenario.render())
+            os.replace(tmp_path, path)
+        self._load_index()[scenario.route_key()] = {'name': scenario.name, **scenario.route_dict()}
+        return path
+
+    def route_file(self, scenario):
+        """场景的路径文件路径，不存在时生成"""
+        return self.route_files([scenario])[0]
+
+    def route_files(self, scenarios):
+        """一组场景的路径文件路径（与scenarios顺序一致），相同需求只生成一次"""
+        os.makedirs(self.directory, exist_ok=True)
+        index = self._load_index()
+        paths = {}
+        result = []
+        changed = False
+        for scenario in scenarios:
+            key = scenario.route_key()
+            if key not in paths:
+                if key not in index or not os.path.exists(self.path(scenario)):
+                    self._write(scenario)
+                    changed = True
+                paths[key] = self.path(scenario)
+            result.append(paths[key])
+        if changed:
+            self._save_index()
+        return result
+
+
+def demand_sweep(base, scales=(1.0,), seeds=(None,), profiles=(None,)):
+    """需求倍数 × 时变曲线 × 随机种子的场景组合"""
+    scenarios = []
+    for scale in scales:
+        scaled = base.scaled(scale)
+        for profile in profiles:
+            variant = scaled.with_profile(profile) if profile is not None else scaled
+            for seed in seeds:
+                scenarios.append(variant.with_seed(seed))
+    return scenarios
+
+
+# 基础配置：单一乘用车，主线600veh/h全部直行，上匝道400veh/h（200~1400s）全部直行
+BASIC_DEMAND = DemandScenario(
+    vtypes=[VehicleType('passenger', accel="2.6", decel="4.5", sigma="0.5", length="4.5", minGap="2.5",
+                        maxSpeed="36.11", guiShape="passenger", color="1,0,0")],
+    streams=[
+        TrafficStream('M1', 600, {'M3': 1.0}, {'passenger': 1.0}),
+        TrafficStream('onr', 400, {'M3': 1.0}, {'passenger': 1.0}, begin=200, end=1400),
+    ],
+    name="basic",
+)
+
+# 混合配置：6种车型；主线600veh/h（80%直行，20%下匝道），上匝道400veh/h（70%直行，30%下匝道）
+MIXED_DEMAND = DemandScenario(
+    vtypes=[
+        VehicleType('passenger', accel="2.8", decel="4.5", sigma="0.4", length="4.5", minGap="2.5",
+                    maxSpeed="36.11", guiShape="passenger", color="0,100,255"),
+        VehicleType('truck', accel="2.2", decel="3.5", sigma="0.3", length="10.0", minGap="2.5",
+                    maxSpeed="30.00", guiShape="truck", color="255,165,0"),
+        VehicleType('bus', accel="2.4", decel="4.0", sigma="0.3", length="11.0", minGap="2.5",
+                    maxSpeed="28.00", guiShape="bus", color="0,128,0"),
+        VehicleType('motorcycle', accel="4.0", decel="6.5", sigma="0.5", length="2.2", minGap="1.2",
+                    maxSpeed="36.11", guiShape="motorcycle", color="255,0,0"),
+        VehicleType('emergency', accel="3.2", decel="5.5", sigma="0.2", length="5.5", minGap="2.0",
+                    maxSpeed="36.11", guiShape="emergency", color="255,255,0"),
+        VehicleType('delivery', accel="2.6", decel="4.2", sigma="0.3", length="6.0", minGap="2.0",
+                    maxSpeed="32.00", guiShape="delivery", color="139,69,19"),
+    ],
+    streams=[
+        TrafficStream('M1', 600, {'M3': 0.8, 'offr': 0.2},
+                      {'passenger': 0.70, 'truck': 0.15, 'bus': 0.05, 'motorcycle': 0.06,
+                       'emergency': 0.01, 'delivery': 0.03}),
+        TrafficStream('onr', 400, {'M3': 0.7, 'offr': 0.3},
+                      {'passenger': 0.75, 'truck': 0.075, 'bus': 0.025, 'motorcycle': 0.0875,
+                       'emergency': 0.0125, 'delivery': 0.05}),
+    ],
+    name="mixed",
+)
+
+# 车型配置名称 -> 需求场景
+DEMAND_PRESETS = {
+    "basic": BASIC_DEMAND,
+    "mixed": MIXED_DEMAND,
+}
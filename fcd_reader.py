@@ -0,0 +1,296 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+FCD流式读取器
+基于增量解析逐个处理<timestep>，边读边释放XML元素，
+并将轨迹记录按块写入类型化的NumPy列缓冲区，峰值内存与文件大小无关
+"""
+
+import os
+import xml.etree.ElementTree as ET
+import pandas as pd
+import numpy as np
+
+from analysis_defaults import DEFAULT_CHUNK_SIZE
+
+# FCD数据框的列顺序（与TrafficFlowAnalyzer.data['fcd_data']一致）
+FCD_COLUMNS = ['time', 'id', 'lane', 'edge', 'pos', 'speed', 'x', 'y']
+
+# 按字节区间解析时的读取块大小及包裹时间步的临时根元素
+_READ_BLOCK_SIZE = 1024 * 1024
+_TIMESTEP_TAG = b'<timestep'
+_TIMESTEP_CLOSE = b'</timestep>'
+_SHARD_ROOT_OPEN = b'<fcd-export>'
+_SHARD_ROOT_CLOSE = b'</fcd-export>'
+
+
+def lane_to_edge(lane):
+    """由车道ID推出路段ID（M2_1 -> M2）"""
+    if lane is None:
+        return None
+    return lane.split('_')[0] if '_' in lane else lane
+
+
+def _factorize_values(values):
+    """对编码表中的取值做分类编码（None编码为-1）"""
+    values = list(values)
+    array = np.empty(len(values), dtype=object)
+    array[:] = values
+    return pd.factorize(array)
+
+
+class FCDColumnBuffer:
+    """按块累积FCD记录的列缓冲区
+
+    车辆ID和车道ID在读取时即进行字典编码，只保存整数编码；
+    数值列每满一块就转换为紧凑的NumPy数组，当前块之外不再保留Python对象。
+    指定sink时，每个写满的块交给sink(chunk)处理（例如写入磁盘），不在内存中保留。
+    """
+
+    def __init__(self, chunk_size=DEFAULT_CHUNK_SIZE, sink=None):
+        self.chunk_size = chunk_size
+        self.sink = sink
+        self.id_codes = {}
+        self.lane_codes = {}
+        self._chunks = []
+        self._reset_current()
+
+    def _reset_current(self):
+        self._time = []
+        self._id = []
+        self._lane = []
+        self._pos = []
+        self._speed = []
+        self._x = []
+        self._y = []
+
+    def __len__(self):
+        return sum(len(chunk['time']) for chunk in self._chunks) + len(self._time)
+
+    def _encode(self, table, value):
+        code = table.get(value)
+        if code is None:
+            code = table[value] = len(table)
+        return code
+
+    def append(self, time, vehicle_id, lane, pos, speed, x, y):
+        """追加一条轨迹记录"""
+        self._time.append(time)
+        self._id.append(self._encode(self.id_codes, vehicle_id))
+        self._lane.append(self._encode(self.lane_codes, lane))
+        self._pos.append(pos)
+        self._speed.append(speed)
+        self._x.append(x)
+        self._y.append(y)
+
+        if len(self._time) >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        """将当前块转换为类型化数组"""
+        if not self._time:
+            return
+        chunk = {
+            'time': np.array(self._time, dtype=np.float64),
+            'id': np.array(self._id, dtype=np.int32),
+            'lane': np.array(self._lane, dtype=np.int32),
+            'pos': np.array(self._pos, dtype=np.float64),
+            'speed': np.array(self._speed, dtype=np.float64),
+            'x': np.array(self._x, dtype=np.float64),
+            'y': np.array(self._y, dtype=np.float64),
+        }
+        if self.sink is not None:
+            self.sink(chunk)
+        else:
+            self._chunks.append(chunk)
+        self._reset_current()
+
+    def columns(self):
+        """合并所有块，返回列名到NumPy数组的映射（id/lane为整数编码）"""
+        self.flush()
+        if self._chunks:
+            merged = {name: np.concatenate([chunk[name] for chunk in self._chunks])
+                      for name in self._chunks[0]}
+        else:
+            merged = {
+                'time': np.empty(0, dtype=np.float64),
+                'id': np.empty(0, dtype=np.int32),
+                'lane': np.empty(0, dtype=np.int32),
+                'pos': np.empty(0, dtype=np.float64),
+                'speed': np.empty(0, dtype=np.float64),
+                'x': np.empty(0, dtype=np.float64),
+                'y': np.empty(0, dtype=np.float64),
+            }
+        self._chunks = []
+        return merged
+
+    def to_dataframe(self):
+        """构建fcd_data数据框
+
+        id/lane/edge列直接由读取时的字典编码构造为分类列，取值与逐行解析一致，
+        下游聚合可以直接使用其整数编码而无需再对字符串做哈希。
+        这三列的dtype为category而不是object：按这些列分组时须传observed=True，否则会产生空分组
+        """
+        columns = self.columns()
+
+        id_codes, id_categories = _factorize_values(self.id_codes)
+        lane_codes, lane_categories = _factorize_values(self.lane_codes)
+        edge_codes, edge_categories = _factorize_values(lane_to_edge(lane) for lane in self.lane_codes)
+
+        return pd.DataFrame({
+            'time': columns['time'],
+            'id': pd.Categorical.from_codes(id_codes[columns['id']], id_categories),
+            'lane': pd.Categorical.from_codes(lane_codes[columns['lane']], lane_categories),
+            'edge': pd.Categorical.from_codes(edge_codes[columns['lane']], edge_categories),
+            'pos': columns['pos'],
+            'speed': columns['speed'],
+            'x': columns['x'],
+            'y': columns['y'],
+        }, columns=FCD_COLUMNS)
+
+
+def _iter_records(events):
+    """从 (event, elem) 解析事件中提取轨迹记录"""
+    root = None
+    time = None
+
+    for event, elem in events:
+        if root is None:
+            root = elem
+        if event == 'start':
+            if elem.tag == 'timestep':
+                time = float(elem.get('time'))
+            continue
+
+        if elem.tag == 'vehicle':
+            yield (time,
+                   elem.get('id'),
+                   elem.get('lane'),
+                   float(elem.get('pos', 0)),
+                   float(elem.get('speed', 0)),
+                   float(elem.get('x', 0)),
+                   float(elem.get('y', 0)))
+            elem.clear()
+        elif elem.tag == 'timestep':
+            # 释放已处理的时间步，避免根节点累积子元素
+            root.clear()
+
+
+def _iter_range_events(file_path, start, end):
+    """解析文件中 [start, end) 字节区间内的若干完整<timestep>元素"""
+    parser = ET.XMLPullParser(events=('start', 'end'))
+    parser.feed(_SHARD_ROOT_OPEN)
+    with open(file_path, 'rb') as f:
+        f.seek(start)
+        remaining = end - start
+        while remaining > 0:
+            block = f.read(min(_READ_BLOCK_SIZE, remaining))
+            if not block:
+                break
+            remaining -= len(block)
+            parser.feed(block)
+            yield from parser.read_events()
+    parser.feed(_SHARD_ROOT_CLOSE)
+    yield from parser.read_events()
+    parser.close()
+
+
+def iter_fcd_records(file_path, start=None, end=None):
+    """增量解析FCD文件，逐条产出 (time, id, lane, pos, speed, x, y)
+
+    指定start/end时只解析该字节区间，区间边界须位于<timestep>元素之间（见find_timestep_offsets）
+    """
+    if start is None and end is None:
+        return _iter_records(ET.iterparse(file_path, events=('start', 'end')))
+    if start is None or end is None:
+        raise ValueError("start和end须同时指定")
+    return _iter_records(_iter_range_events(file_path, start, end))
+
+
+def _find_forward(f, offset, pattern):
+    """从offset开始查找pattern首次出现的位置，未找到时返回None"""
+    f.seek(offset)
+    carry = b''
+    position = offset
+    while True:
+        block = f.read(_READ_BLOCK_SIZE)
+        if not block:
+            return None
+        data = carry + block
+        index = data.find(pattern)
+        if index >= 0:
+            return position - len(carry) + index
+        carry = data[-(len(pattern) - 1):]
+        position += len(block)
+
+
+def _content_end(f, size):
+    """最后一个完整<timestep>元素之后的位置（不含根元素的结束标签）"""
+    window = _READ_BLOCK_SIZE
+    while True:
+        tail_start = max(size - window, 0)
+        f.seek(tail_start)
+        tail = f.read(size - tail_start)
+
+        close = tail.rfind(_TIMESTEP_CLOSE)
+        root_close = tail.rfind(b'</', close + 1 if close >= 0 else 0)
+        if (root_close >= 0 and not tail.startswith(b'</timestep', root_close)
+                and tail.find(b'>', root_close) >= 0):
+            # 文件已写完：到根元素的结束标签为止
+            return tail_start + root_close
+        if close >= 0:
+            # 文件仍在写入：到最后一个已结束的时间步为止
+            return tail_start + close + len(_TIMESTEP_CLOSE)
+        # 尾部只有自闭合的空时间步或尚未写完的时间步，只取到其中第一个时间步之前
+        first = tail.find(_TIMESTEP_TAG)
+        if first >= 0:
+            return tail_start + first
+        if tail_start == 0:
+            return size
+        # 正在写入的时间步比尾部窗口还大：向前扩大窗口，直到找到时间步的开始或结束标签
+        window *= 2
+
+
+def find_content_end(file_path):
+    """FCD文件中最后一个完整<timestep>元素之后的字节偏移
+
+    文件仍在写入时不包含尚未结束的时间步，可用于增量读取
+    """
+    with open(file_path, 'rb') as f:
+        return _content_end(f, os.path.getsize(file_path))
+
+
+def find_timestep_offsets(file_path, n_shards):
+    """把FCD文件按字节大致均分为n_shards段，边界对齐到<timestep>开始标签
+
+    返回边界偏移列表 [b0, b1, ..., bk]，第i段为 [b[i], b[i+1])；
+    各段只包含完整的时间步，可以独立解析。文件中没有时间步时返回空列表
+    """
+    size = os.path.getsize(file_path)
+    with open(file_path, 'rb') as f:
+        first = _find_forward(f, 0, _TIMESTEP_TAG)
+        if first is None:
+            return []
+        end = _content_end(f, size)
+        if end <= first:
+            return []
+
+        offsets = [first]
+        for i in range(1, max(n_shards, 1)):
+            target = first + (end - first) * i // n_shards
+            offset = _find_forward(f, max(target, offsets[-1] + 1), _TIMESTEP_TAG)
+            if offset is None or offset >= end:
+                break
+            if offset > offsets[-1]:
+                offsets.append(offset)
+        offsets.append(end)
+    return offsets
+
+
+def read_fcd(file_path, chunk_size=DEFAULT_CHUNK_SIZE, sink=None, start=None, end=None):
+    """流式读取FCD文件（或其中的字节区间），返回填充完毕的列缓冲区"""
+    buffer = FCDColumnBuffer(chunk_size=chunk_size, sink=sink)
+    for record in iter_fcd_records(file_path, start, end):
+        buffer.append(*record)
+    buffer.flush()
+    return buffer
@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+紧凑FCD列存储
+车辆ID、车道和路段做字典编码并以最小整数类型保存，time/pos/speed/x/y保存为float32；
+各列以原始二进制文件存放在磁盘上，分析时以只读内存映射方式打开，
+构建数据框和按时间切片都直接引用映射数组而不复制数据
+"""
+
+import os
+import json
+import pandas as pd
+import numpy as np
+
+from fcd_reader import (FCDColumnBuffer, iter_fcd_records, lane_to_edge,
+                        DEFAULT_CHUNK_SIZE, FCD_COLUMNS)
+from output_cache import OutputCache, CACHE_VERSION, source_signature
+
+# 缓存条目类型
+STORE_KIND = 'fcd-store'
+
+# 数值列及其存储类型
+VALUE_COLUMNS = ('time', 'pos', 'speed', 'x', 'y')
+VALUE_DTYPE = np.float32
+
+# 字典编码列
+CODE_COLUMNS = ('id', 'lane', 'edge')
+
+# 编码列类型转换时每次处理的记录数
+_REWRITE_CHUNK = 4 * 1024 * 1024
+
+
+def code_dtype(n_categories):
+    """与pandas分类列一致的最小编码类型，构建分类列时无需转换编码"""
+    for dtype in (np.int8, np.int16, np.int32):
+        if n_categories < np.iinfo(dtype).max:
+            return np.dtype(dtype)
+    return np.dtype(np.int64)
+
+
+def _column_path(directory, name):
+    return os.path.join(directory, f"{name}.bin")
+
+
+class _StoreWriter:
+    """列缓冲区的sink：把每个块转换为紧凑类型后追加写入各列文件"""
+
+    def __init__(self, directory, chunk_size):
+        self.directory = directory
+        self.buffer = FCDColumnBuffer(chunk_size=chunk_size, sink=self)
+        self.rows = 0
+        # 缓冲区车道编码 -> 存储中的车道编码/路段编码（车道为空时为-1）
+        self.lane_map = []
+        self.lane_edges = []
+        self.lanes = {}
+        self.edges = {}
+        self.files = {name: open(_column_path(directory, name), 'wb')
+                      for name in VALUE_COLUMNS + CODE_COLUMNS}
+
+    def _update_lane_tables(self):
+        for lane in list(self.buffer.lane_codes)[len(self.lane_map):]:
+            edge = lane_to_edge(lane)
+            self.lane_map.append(-1 if lane is None else self.lanes.setdefault(lane, len(self.lanes)))
+            self.lane_edges.append(-1 if edge is None else self.edges.setdefault(edge, len(self.edges)))
+
+    def __call__(self, chunk):
+        self._update_lane_tables()
+        for name in VALUE_COLUMNS:
+            chunk[name].astype(VALUE_DTYPE).tofile(self.files[name])
+        chunk['id'].astype(np.int32).tofile(self.files['id'])
+        lanes = chunk['lane']
+        np.asarray(self.lane_map, dtype=np.int32)[lanes].tofile(self.files['lane'])
+        np.asarray(self.lane_edges, dtype=np.int32)[lanes].tofile(self.files['edge'])
+        self.rows += len(lanes)
+
+    def close(self):
+        for f in self.files.values():
+            f.close()
+
+    def finish(self):
+        """写入剩余记录并关闭文件，返回各编码列的取值表和各列存储类型"""
+        self.buffer.flush()
+        self.close()
+
+        categories = {
+            'id': list(self.buffer.id_codes),
+            'lane': list(self.lanes),
+            'edge': list(self.edges),
+        }
+        dtypes = {name: np.dtype(VALUE_DTYPE).str for name in VALUE_COLUMNS}
+
+        # 编码列写入时统一为int32，类别数确定后转换为最小编码类型
+        for name in CODE_COLUMNS:
+            dtype = code_dtype(len(categories[name]))
+            if dtype != np.int32 and self.rows:
+                path = _column_path(self.directory, name)
+                source = np.memmap(path, dtype=np.int32, mode='r', shape=(self.rows,))
+                with open(f"{path}.tmp", 'wb') as f:
+                    for start in range(0, self.rows, _REWRITE_CHUNK):
+                        source[start:start + _REWRITE_CHUNK].astype(dtype).tofile(f)
+                del source
+                os.replace(f"{path}.tmp", path)
+            dtypes[name] = dtype.str
+
+        return categories, dtypes
+
+
+class FCDColumnStore:
+    """磁盘上的紧凑FCD列存储（只读内存映射）"""
+
+    def __init__(self, directory, manifest):
+        self.directory = directory
+        self.manifest = manifest
+        self._columns = {}
+        self._categories = {}
+
+    @classmethod
+    def open(cls, directory):
+        """打开已构建的列存储"""
+        with open(os.path.join(directory, 'manifest.json'), 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+        return cls(directory, manifest)
+
+    @classmethod
+    def build(cls, fcd_file, directory, chunk_size=DEFAULT_CHUNK_SIZE):
+        """流式解析FCD文件并写入列存储，内存占用与文件大小无关"""
+        os.makedirs(directory, exist_ok=True)
+        writer = _StoreWriter(directory, chunk_size)
+        try:
+            for record in iter_fcd_records(fcd_file):
+                writer.buffer.append(*record)
+        except BaseException:
+            writer.close()
+            raise
+        categories, dtypes = writer.finish()
+
+        manifest = {
+            'version': CACHE_VERSION,
+            'kind': STORE_KIND,
+            'rows': writer.rows,
+            'source': source_signature(fcd_file),
+            'dtypes': dtypes,
+            'categories': categories,
+        }
+        with open(os.path.join(directory, 'manifest.json'), 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False)
+        return cls(directory, manifest)
+
+    @classmethod
+    def open_or_build(cls, fcd_file, cache=None, chunk_size=DEFAULT_CHUNK_SIZE):
+        """打开与FCD文件对应的缓存列存储，不存在或源文件已变化时重新构建"""
+        cache = cache or OutputCache()
+        entry = cache.entry_dir(fcd_file, STORE_KIND)
+        if cache.is_valid(fcd_file, STORE_KIND) is not None:
+            print(f"打开紧凑列存储 {entry}")
+            return cls.open(entry)
+
+        print(f"正在构建紧凑列存储 {entry} ...")
+        tmp_entry = cache.temp_entry_dir(entry)
+        try:
+            cls.build(fcd_file, tmp_entry, chunk_size=chunk_size)
+            cache.commit_entry(tmp_entry, entry)
+        except BaseException:
+            cache.discard_entry(entry)
+            raise
+        return cls.open(entry)
+
+    def __len__(self):
+        return self.manifest['rows']
+
+    @property
+    def nbytes(self):
+        """各列占用的字节数之和"""
+        return sum(len(self) * np.dtype(dtype).itemsize for dtype in self.manifest['dtypes'].values())
+
+    def column(self, name):
+        """列数组（只读内存映射）；编码列返回整数编码"""
+        array = self._columns.get(name)
+        if array is None:
+            dtype = np.dtype(self.manifest['dtypes'][name])
+            if len(self):
+                array = np.memmap(_column_path(self.directory, name), dtype=dtype,
+                                  mode='r', shape=(len(self),))
+            else:
+                array = np.empty(0, dtype=dtype)
+            self._columns[name] = array
+        return array
+
+    def categories(self, name):
+        """编码列的取值表"""
+        index = self._categories.get(name)
+        if index is None:
+            values = self.manifest['categories'][name]
+            array = np.empty(len(values), dtype=object)
+            array[:] = values
+            index = self._categories[name] = pd.Index(array)
+        return index
+
+    def rows_between(self, t_start, t_end):
+        """[t_start, t_end) 时间范围对应的记录行区间（FCD按时间排序）"""
+        time = self.column('time')
+        start = int(np.searchsorted(time, VALUE_DTYPE(t_start), side='left'))
+        stop = int(np.searchsorted(time, VALUE_DTYPE(t_end), side='left'))
+        return slice(start, stop)
+
+    def to_dataframe(self, rows=slice(None)):
+        """以映射数组（或其切片视图）构建fcd_data数据框，不复制列数据"""
+        data = {}
+        for name in FCD_COLUMNS:
+            if name in CODE_COLUMNS:
+                data[name] = pd.Categorical.from_codes(self.column(name)[rows], self.categories(name))
+            else:
+                data[name] = self.column(name)[rows]
+        return pd.DataFrame(data, columns=FCD_COLUMNS, copy=False)
+
+    def slice_time(self, t_start, t_end):
+        """[t_start, t_end) 时间范围内的fcd_data视图"""
+        return self.to_dataframe(self.rows_between(t_start, t_end))
+
+    def head(self, n=5):
+        return self.to_dataframe(slice(0, n))
@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+增量（断点续算）FCD分析
+在报告目录中为每个轨迹文件保存检查点：已处理到的字节偏移、最后一个时间步和时间窗累积量；
+再次分析时只解析新追加的时间步并合并到已有累积量，
+也可以持续跟踪仍在写入的轨迹文件，近实时地更新统计结果
+"""
+
+import os
+import json
+import time
+import hashlib
+
+from fcd_reader import read_fcd, find_timestep_offsets, DEFAULT_CHUNK_SIZE
+from traffic_aggregator import TrafficAggregate, DEFAULT_BIN_WIDTH
+
+# 检查点格式版本，结构变化时递增
+CHECKPOINT_VERSION = 1
+
+# 检查点保存在报告目录下
+REPORT_DIR = "traffic_flow_reports"
+CHECKPOINT_SUBDIR = "checkpoints"
+
+# 校验源文件时比较的文件头和检查点偏移之前的字节数
+_VERIFY_BLOCK_SIZE = 64 * 1024
+
+# 跟踪模式下判断文件是否写完时读取的文件尾字节数
+_TAIL_PROBE_SIZE = 256
+
+
+def checkpoint_dir(fcd_file, report_dir=REPORT_DIR):
+    """轨迹文件对应的检查点目录"""
+    path_key = hashlib.blake2b(os.path.abspath(fcd_file).encode('utf-8'), digest_size=8).hexdigest()
+    name = os.path.splitext(os.path.basename(fcd_file))[0]
+    return os.path.join(report_dir, CHECKPOINT_SUBDIR, f"{name}-{path_key}")
+
+
+def _range_hash(file_path, start, stop):
+    """文件 [start, stop) 字节区间的哈希"""
+    with open(file_path, 'rb') as f:
+        f.seek(start)
+        return hashlib.blake2b(f.read(max(stop - start, 0)), digest_size=16).hexdigest()
+
+
+def _is_complete(file_path):
+    """轨迹文件是否已写完（以根元素的结束标签结尾）"""
+    size = os.path.getsize(file_path)
+    with open(file_path, 'rb') as f:
+        f.seek(max(size - _TAIL_PROBE_SIZE, 0))
+        tail = f.read().rstrip()
+    return tail.endswith(b'>') and tail.rfind(b'</') > tail.rfind(b'</timestep>')
+
+
+class AnalysisCheckpoint:
+    """已处理数据的检查点
+
+    state中记录源文件路径、时间窗参数、已处理的字节数和最后一个时间步，
+    以及已处理数据开头和末尾各一段字节的哈希，用于判断源文件是否只是在末尾追加了数据。
+    字节数从第一个<timestep>算起：SUMO重新运行时文件头注释中的生成时间和配置会变化，
+    但只要时间步数据相同，检查点仍然有效。
+    """
+
+    def __init__(self, directory, state=None, aggregate=None):
+        self.directory = directory
+        self.state = state or {}
+        self.aggregate = aggregate
+
+    @property
+    def offset(self):
+        """已处理的字节数（从第一个时间步开始计）"""
+        return self.state.get('offset', 0)
+
+    @property
+    def last_time(self):
+        return self.state.get('last_time')
+
+    @classmethod
+    def load(cls, directory):
+        """读取检查点，不存在或已损坏时返回None"""
+        try:
+            with open(os.path.join(directory, 'state.json'), 'r', encoding='utf-8') as f:
+                state = json.load(f)
+            if state.get('version') != CHECKPOINT_VERSION:
+                return None
+            aggregate = TrafficAggregate.load(os.path.join(directory, 'aggregate.npz'))
+        except (OSError, ValueError, KeyError):
+            return None
+        return cls(directory, state, aggregate)
+
+    @staticmethod
+    def _hashes(fcd_file, first, offset):
+        """已处理数据开头和末尾各一段字节的哈希"""
+        end = first + offset
+        return (_range_hash(fcd_file, first, min(first + _VERIFY_BLOCK_SIZE, end)),
+                _range_hash(fcd_file, max(end - _VERIFY_BLOCK_SIZE, first), end))
+
+    def matches(self, fcd_file, first, bin_width, origin):
+        """检查点是否可以在该轨迹文件上继续使用；first为文件中第一个时间步的偏移"""
+        state = self.state
+        if (state.get('source') != os.path.abspath(fcd_file)
+                or state.get('bin_width') != bin_width or state.get('origin') != origin):
+            return False
+        if os.path.getsize(fcd_file) < first + self.offset:
+            return False
+        return self._hashes(fcd_file, first, self.offset) == (state.get('head_hash'),
+                                                              state.get('tail_hash'))
+
+    def save(self, fcd_file, first, aggregate, offset, last_time, bin_width, origin):
+        """写入检查点（先写临时文件再替换，中断时保留旧检查点）"""
+        os.makedirs(self.directory, exist_ok=True)
+        aggregate_path = os.path.join(self.directory, 'aggregate.npz')
+        aggregate.save(f"{aggregate_path}.tmp.npz")
+        os.replace(f"{aggregate_path}.tmp.npz", aggregate_path)
+
+        self.state = {
+            'version': CHECKPOINT_VERSION,
+            'source': os.path.abspath(fcd_file),
+            'bin_width': bin_width,
+            'origin': origin,
+            'offset': offset,
+            'last_time': last_time,
+            'rows': aggregate.n_rows,
+            'updated_at': time.strftime('%Y-%m-%d %H:%M:%S'),
+        }
+        self.state['head_hash'], self.state['tail_hash'] = self._hashes(fcd_file, first, offset)
+        state_path = os.path.join(self.directory, 'state.json')
+        with open(f"{state_path}.tmp", 'w', encoding='utf-8') as f:
+            json.dump(self.state, f, ensure_ascii=False, indent=2)
+        os.replace(f"{state_path}.tmp", state_path)
+        self.aggregate = aggregate
+
+
+class IncrementalFCDAnalyzer:
+    """基于检查点的增量FCD分析
+
+    update()只解析检查点之后新增的完整时间步，并与已有累积量合并；
+    文件被重新生成且前面的内容发生变化时自动从头分析。
+    """
+
+    def __init__(self, fcd_file, bin_width=DEFAULT_BIN_WIDTH, origin=0, vehicle_lengths=None,
+                 report_dir=REPORT_DIR, chunk_size=DEFAULT_CHUNK_SIZE):
+        self.fcd_file = fcd_file
+        self.bin_width = bin_width
+        self.origin = origin
+        self.vehicle_lengths = vehicle_lengths
+        self.chunk_size = chunk_size
+        self.report_dir = report_dir
+
+        self.checkpoint = AnalysisCheckpoint.load(checkpoint_dir(fcd_file, report_dir))
+        self._checked = False
+
+    @property
+    def aggregate(self):
+        return self.checkpoint.aggregate if self.checkpoint else None
+
+    def _resume(self, first):
+        """首次读取时确认检查点与当前文件一致，否则从头分析"""
+        if self._checked:
+            return
+        self._checked = True
+        checkpoint = self.checkpoint
+        if checkpoint is not None and checkpoint.matches(self.fcd_file, first, self.bin_width, self.origin):
+            print(f"从检查点继续: 已处理至 {checkpoint.last_time}s（{checkpoint.aggregate.n_rows} 条记录）")
+            return
+        self.checkpoint = AnalysisCheckpoint(checkpoint_dir(self.fcd_file, self.report_dir))
+
+    def update(self):
+        """处理新追加的时间步，返回本次新增的记录数据框（没有新数据时为None）"""
+        offsets = find_timestep_offsets(self.fcd_file, 1)
+        if not offsets:
+            return None
+        first, end = offsets[0], offsets[-1]
+        self._resume(first)
+        start = first + self.checkpoint.offset
+        if end <= start:
+            return None
+
+        df = read_fcd(self.fcd_file, chunk_size=self.chunk_size, start=start, end=end).to_dataframe()
+        part = TrafficAggregate.from_fcd(df, bin_width=self.bin_width, origin=self.origin,
+                                         vehicle_lengths=self.vehicle_lengths)
+        aggregate = part if self.aggregate is None else self.aggregate.merge(part)
+        last_time = float(df['time'].max()) if len(df) else self.checkpoint.last_time
+        self.checkpoint.save(self.fcd_file, first, aggregate, end - first, last_time,
+                             self.bin_width, self.origin)
+        return df
+
+    def follow(self, is_running=None, poll_interval=1.0, on_update=None):
+        """持续跟踪仍在写入的轨迹文件
+
+        每隔poll_interval秒处理一次新增数据并调用on_update(aggregate, new_df)；
+        is_running()返回False（例如仿真进程已退出）或文件已写完时，处理完剩余数据后返回累积量
+        """
+        while True:
+            finished = (is_running is not None and not is_running()) or (
+                os.path.exists(self.fcd_file) and _is_complete(self.fcd_file))
+            if os.path.exists(self.fcd_file):
+                df = self.update()
+                if df is not None and on_update is not None:
+                    on_update(self.aggregate, df)
+            if finished:
+                return self.aggregate
+            time.sleep(poll_interval)
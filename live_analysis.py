@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+TraCI实时流式分析
+通过TraCI逐步推进仿真，订阅车辆的车道、位置和速度，按时间窗增量累积路段统计；
+不写出FCD轨迹文件，每个时间窗结束时立即得到该时间窗的交通流参数。
+仿真对象只需提供与traci模块相同的step/subscribe接口，便于用模拟仿真器替代SUMO
+（FCDReplaySimulation按仿真步回放已有的轨迹数据）
+"""
+
+import numpy as np
+
+from fcd_reader import FCDColumnBuffer
+from traffic_aggregator import TrafficAggregate, make_time_intervals, DEFAULT_BIN_WIDTH
+
+# TraCI变量编号（与traci.constants一致，避免未安装traci时无法导入）
+VAR_SPEED = 0x40
+VAR_POSITION = 0x42
+VAR_LANE_ID = 0x51
+VAR_LANEPOSITION = 0x56
+
+# 每辆车订阅的变量，对应FCD记录中的 lane/pos/speed/x/y
+SUBSCRIBED_VARIABLES = (VAR_LANE_ID, VAR_LANEPOSITION, VAR_SPEED, VAR_POSITION)
+
+# 与highway-ramp-analysis.sumocfg一致的仿真参数（不含输出文件）
+DEFAULT_NET_FILE = "highway.net.xml"
+DEFAULT_ROUTE_FILE = "highway-ramp.rou.xml"
+DEFAULT_END_TIME = 1600
+DEFAULT_STEP_LENGTH = 0.1
+
+
+def sumo_command(sumo_binary="sumo", net_file=DEFAULT_NET_FILE, route_file=DEFAULT_ROUTE_FILE,
+                 begin=0, end=DEFAULT_END_TIME, step_length=DEFAULT_STEP_LENGTH):
+    """构建不写任何输出文件的SUMO启动命令"""
+    return [sumo_binary,
+            "-n", net_file,
+            "-r", route_file,
+            "--begin", str(begin),
+            "--end", str(end),
+            "--step-length", str(step_length),
+            "--ignore-route-errors", "true",
+            "--collision.action", "warn",
+            "--no-step-log", "true",
+            "--no-warnings", "true"]
+
+
+def start_traci(command=None):
+    """启动SUMO并建立TraCI连接，返回traci模块"""
+    import traci
+    traci.start(command or sumo_command())
+    return traci
+
+
+class StreamingTrafficAnalyzer:
+    """按仿真步增量累积时间窗统计
+
+    sim为traci模块或提供相同接口的对象，需要：
+    simulationStep()、simulation.getTime()、simulation.getDeltaT()、
+    simulation.getMinExpectedNumber()、simulation.getDepartedIDList()、
+    vehicle.subscribe(vehID, varIDs)、vehicle.getAllSubscriptionResults()。
+    on_window(time_start, time_end, traffic_stats) 在每个时间窗结束时调用。
+    """
+
+    def __init__(self, sim, bin_width=DEFAULT_BIN_WIDTH, origin=0, network=None,
+                 vehicle_lengths=None, on_window=None):
+        if bin_width <= 0:
+            raise ValueError(f"时间窗宽度必须为正数: {bin_width}")
+        self.sim = sim
+        self.bin_width = bin_width
+        self.origin = origin
+        self.network = network
+        self.vehicle_lengths = vehicle_lengths
+        self.on_window = on_window
+        self.window_index = 0
+        self.window_stats = []
+        self.n_rows = 0
+        self._parts = []
+        self._buffer = FCDColumnBuffer()
+
+    @property
+    def window_start(self):
+        return self.origin + self.window_index * self.bin_width
+
+    @property
+    def window_end(self):
+        return self.window_start + self.bin_width
+
+    def process_step(self):
+        """读取当前仿真步的车辆状态（在simulationStep()之后调用）
+
+        simulationStep()之后仿真时间已前进一步，记录的时间取该步开始时刻，与FCD输出的时间标记一致
+        """
+        # SUMO的时间以毫秒为单位，取整消除浮点误差，保证时间窗边界上的记录归属正确
+        now = self.sim.simulation.getTime()
+        time = round(now - self.sim.simulation.getDeltaT(), 3)
+        while time >= self.window_end:
+            self.close_window()
+
+        # 新出发的车辆订阅后即可取得当前步的结果，离开路网的车辆自动取消订阅
+        for vehicle_id in self.sim.simulation.getDepartedIDList():
+            self.sim.vehicle.subscribe(vehicle_id, SUBSCRIBED_VARIABLES)
+
+        if time < self.origin:
+            return
+        append = self._buffer.append
+        for vehicle_id, values in self.sim.vehicle.getAllSubscriptionResults().items():
+            x, y = values[VAR_POSITION]
+            append(time, vehicle_id, values[VAR_LANE_ID], values[VAR_LANEPOSITION],
+                   values[VAR_SPEED], x, y)
+
+        # 下一步的记录已属于下一个时间窗，当前时间窗立即结束
+        if round(now, 3) >= self.window_end:
+            self.close_window()
+
+    def close_window(self):
+        """结束当前时间窗，计算并发布其统计结果"""
+        time_intervals = self.origin + np.arange(self.window_index + 2) * self.bin_width
+        df = self._buffer.to_dataframe()
+        self._buffer = FCDColumnBuffer()
+        self.n_rows += len(df)
+
+        part = TrafficAggregate.from_fcd(df, time_intervals=time_intervals,
+                                         vehicle_lengths=self.vehicle_lengths)
+        if len(df):
+            self._parts.append(part)
+        stats = part.to_traffic_stats(self.network)
+        self.window_stats.append(stats)
+        if self.on_window is not None:
+            self.on_window(self.window_start, self.window_end, stats)
+        self.window_index += 1
+        return stats
+
+    def finish(self):
+        """结束仍有记录的最后一个时间窗，返回全部时间窗的累积量"""
+        if len(self._buffer):
+            self.close_window()
+        return self.aggregate
+
+    @property
+    def aggregate(self):
+        """已结束各时间窗合并后的累积量"""
+        if not self._parts:
+            return TrafficAggregate.empty(make_time_intervals(np.empty(0), self.bin_width, self.origin))
+        # 相邻两两合并，避免逐个合并时重复复制已累积的出现记录
+        parts = self._parts
+        while len(parts) > 1:
+            parts = [parts[i].merge(parts[i + 1]) if i + 1 < len(parts) else parts[i]
+                     for i in range(0, len(parts), 2)]
+        self._parts = parts
+        return parts[0]
+
+    def run(self, until=None):
+        """推进仿真直到没有待运行车辆（或到达until时刻），返回累积量"""
+        sim = self.sim
+        while sim.simulation.getMinExpectedNumber() > 0:
+            if until is not None and sim.simulation.getTime() >= until:
+                break
+            sim.simulationStep()
+            self.process_step()
+        return self.finish()
+
+
+class FCDReplaySimulation:
+    """按仿真步回放fcd_data的模拟仿真器（提供StreamingTrafficAnalyzer所需的traci接口子集）
+
+    从第一条记录的时刻起每次simulationStep()推进step_length（包括没有车辆的仿真步），
+    之后getTime()为该步结束时刻，与SUMO一致；本步首次出现的车辆列入getDepartedIDList()，
+    上一步有记录而本步没有的车辆列入getArrivedIDList()并自动取消订阅。
+    订阅结果只包含已订阅且本步有记录的车辆，用于在不运行SUMO的情况下驱动实时分析
+    """
+
+    def __init__(self, fcd_df, step_length=DEFAULT_STEP_LENGTH):
+        time = fcd_df['time'].to_numpy(dtype=float)
+        self.step_length = step_length
+        self.begin = float(time.min()) if len(time) else 0.0
+        steps = np.rint((time - self.begin) / step_length).astype(np.int64)
+        order = np.argsort(steps, kind='stable')
+        self._steps = steps[order]
+        self._ids = np.asarray(fcd_df['id'], dtype=object)[order]
+        self._lanes = np.asarray(fcd_df['lane'], dtype=object)[order]
+        self._pos = fcd_df['pos'].to_numpy(dtype=float)[order]
+        self._speed = fcd_df['speed'].to_numpy(dtype=float)[order]
+        self._x = fcd_df['x'].to_numpy(dtype=float)[order]
+        self._y = fcd_df['y'].to_numpy(dtype=float)[order]
+        self.n_steps = int(self._steps[-1]) + 1 if len(steps) else 0
+        self.step_index = 0
+        self.time = self.begin
+        self.present = {}
+        self.seen = set()
+        self.departed = []
+        self.arrived = []
+        self.subscriptions = set()
+        # 与traci模块相同的子模块访问方式
+        self.simulation = self
+        self.vehicle = _ReplayVehicleDomain(self)
+
+    # simulation
+    def getTime(self):
+        return self.time
+
+    def getDeltaT(self):
+        return self.step_length
+
+    def getMinExpectedNumber(self):
+        return len(self.present) + 1 if self.step_index < self.n_steps else 0
+
+    def getDepartedIDList(self):
+        return self.departed
+
+    def getArrivedIDList(self):
+        return self.arrived
+
+    def close(self):
+        pass
+
+    def simulationStep(self):
+        first, last = np.searchsorted(self._steps, [self.step_index, self.step_index + 1])
+        present = {}
+        for row in range(first, last):
+            present[self._ids[row]] = {
+                VAR_LANE_ID: self._lanes[row],
+                VAR_LANEPOSITION: self._pos[row],
+                VAR_SPEED: self._speed[row],
+                VAR_POSITION: (self._x[row], self._y[row]),
+            }
+        self.departed = [vehicle_id for vehicle_id in present if vehicle_id not in self.seen]
+        self.arrived = [vehicle_id for vehicle_id in self.present if vehicle_id not in present]
+        self.seen.update(self.departed)
+        self.subscriptions.difference_update(self.arrived)
+        self.present = present
+        self.step_index += 1
+        self.time = round(self.begin + self.step_index * self.step_length, 6)
+
+
+class _ReplayVehicleDomain:
+    def __init__(self, sim):
+        self.sim = sim
+
+    def subscribe(self, vehicle_id, variables):
+        self.sim.subscriptions.add(vehicle_id)
+
+    def getAllSubscriptionResults(self):
+        return {vehicle_id: values for vehicle_id, values in self.sim.present.items()
+                if vehicle_id in self.sim.subscriptions}
+
+    def getIDCount(self):
+        return len(self.sim.present)
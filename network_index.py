@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+路网几何索引
+从highway.net.xml中提取路段/车道长度、车道数、限速和线形，按ID建立索引；
+索引序列化保存在路网文件旁，重复分析时直接加载而无需再解析XML。
+同时从路径文件的vType定义中提取车型长度，供占有率计算使用
+"""
+
+import os
+import json
+import xml.etree.ElementTree as ET
+import numpy as np
+
+# 索引文件格式版本，结构变化时递增
+INDEX_VERSION = 1
+
+# SUMO默认车型长度（m）
+DEFAULT_VEHICLE_LENGTH_M = 5.0
+DEFAULT_VTYPE = 'DEFAULT_VEHTYPE'
+
+_network_cache = {}
+_vtype_cache = {}
+
+
+def _file_signature(file_path):
+    stat = os.stat(file_path)
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+
+def _parse_shape(shape):
+    """解析 "x1,y1 x2,y2 ..." 形式的线形坐标"""
+    if not shape:
+        return []
+    return [[float(v) for v in point.split(',')[:2]] for point in shape.split()]
+
+
+class NetworkIndex:
+    """路网几何索引
+
+    edges: {路段ID: {'length', 'lane_count', 'speed', 'function', 'lanes'}}
+    lanes: {车道ID: {'edge', 'index', 'length', 'speed', 'shape'}}
+    长度单位为m，速度单位为m/s
+    """
+
+    def __init__(self, edges, lanes):
+        self.edges = edges
+        self.lanes = lanes
+
+    @classmethod
+    def from_net_file(cls, net_file):
+        """解析SUMO路网文件"""
+        edges = {}
+        lanes = {}
+
+        for _, elem in ET.iterparse(net_file, events=('end',)):
+            if elem.tag != 'edge':
+                continue
+
+            edge_id = elem.get('id')
+            lane_ids = []
+            for lane in elem.findall('lane'):
+                lane_id = lane.get('id')
+                lanes[lane_id] = {
+                    'edge': edge_id,
+                    'index': int(lane.get('index', len(lane_ids))),
+                    'length': float(lane.get('length', 0)),
+                    'speed': float(lane.get('speed', 0)),
+                    'shape': _parse_shape(lane.get('shape')),
+                }
+                lane_ids.append(lane_id)
+
+            lane_info = [lanes[lane_id] for lane_id in lane_ids]
+            edges[edge_id] = {
+                'length': float(np.mean([lane['length'] for lane in lane_info])) if lane_info else 0.0,
+                'lane_count': len(lane_ids),
+                'speed': max((lane['speed'] for lane in lane_info), default=0.0),
+                'function': elem.get('function', 'normal'),
+                'lanes': lane_ids,
+            }
+            elem.clear()
+
+        return cls(edges, lanes)
+
+    def to_dict(self):
+        return {'version': INDEX_VERSION, 'edges': self.edges, 'lanes': self.lanes}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data['edges'], data['lanes'])
+
+    def edge_length(self, edge_id, default=None):
+        """路段长度（m）"""
+        edge = self.edges.get(edge_id)
+        return edge['length'] if edge else default
+
+    def lane_length(self, lane_id, default=None):
+        """车道长度（m）"""
+        lane = self.lanes.get(lane_id)
+        return lane['length'] if lane else default
+
+    def lane_count(self, edge_id, default=None):
+        """路段车道数"""
+        edge = self.edges.get(edge_id)
+        return edge['lane_count'] if edge else default
+
+    def lane_shape(self, lane_id):
+        """车道线形，返回 (n, 2) 坐标数组"""
+        return np.asarray(self.lanes[lane_id]['shape'], dtype=float).reshape(-1, 2)
+
+    def edge_arrays(self, edge_ids, default_length, default_lanes):
+        """按给定路段顺序返回长度（m）和车道数数组，未知路段使用默认值"""
+        lengths = np.array([self.edge_length(edge, default_length) for edge in edge_ids], dtype=float)
+        lane_counts = np.array([self.lane_count(edge, default_lanes) for edge in edge_ids], dtype=float)
+        return lengths, lane_counts
+
+
+def network_index_path(net_file):
+    """索引文件路径（与路网文件同目录）"""
+    return f"{net_file}.index.json"
+
+
+def load_network_index(net_file="highway.net.xml"):
+    """加载路网索引
+
+    进程内按路径缓存；索引文件与路网文件的大小和修改时间一致时直接读取索引文件，
+    否则重新解析路网并写回索引文件
+    """
+    net_file = os.path.abspath(net_file)
+    signature = _file_signature(net_file)
+
+    cached = _network_cache.get(net_file)
+    if cached and cached[0] == signature:
+        return cached[1]
+
+    index_file = network_index_path(net_file)
+    index = None
+    if os.path.exists(index_file):
+        try:
+            with open(index_file, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get('version') == INDEX_VERSION and data.get('source') == signature:
+                index = NetworkIndex.from_dict(data)
+        except (OSError, ValueError, KeyError):
+            index = None
+
+    if index is None:
+        index = NetworkIndex.from_net_file(net_file)
+        data = index.to_dict()
+        data['source'] = signature
+        try:
+            with open(index_file, 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False)
+        except OSError as e:
+            print(f"警告: 无法写入路网索引文件 {index_file}: {e}")
+
+    _network_cache[net_file] = (signature, index)
+    return index
+
+
+class VehicleTypeIndex:
+    """路径文件中的车型定义及车辆/车流所属车型
+
+    vtypes: {车型ID: {'length', 'maxSpeed', ...}}
+    vehicle_types: {车辆ID或车流ID: 车型ID}
+    """
+
+    def __init__(self, vtypes, vehicle_types):
+        self.vtypes = vtypes
+        self.vehicle_types = vehicle_types
+
+    @classmethod
+    def from_route_file(cls, route_file):
+        """解析SUMO路径文件中的vType、vehicle和flow定义"""
+        vtypes = {}
+        vehicle_types = {}
+
+        for _, elem in ET.iterparse(route_file, events=('end',)):
+            if elem.tag == 'vType':
+                attrs = {key: float(value) for key, value in elem.attrib.items()
+                         if key in ('length', 'minGap', 'maxSpeed', 'accel', 'decel', 'sigma')}
+                attrs.setdefault('length', DEFAULT_VEHICLE_LENGTH_M)
+                vtypes[elem.get('id')] = attrs
+            elif elem.tag in ('vehicle', 'flow', 'trip'):
+                vehicle_types[elem.get('id')] = elem.get('type', DEFAULT_VTYPE)
+
+        return cls(vtypes, vehicle_types)
+
+    def type_of(self, vehicle_id):
+        """车辆所属车型；车流生成的车辆ID形如 "<flow>.<n>" """
+        vtype = self.vehicle_types.get(vehicle_id)
+        if vtype is None and '.' in vehicle_id:
+            vtype = self.vehicle_types.get(vehicle_id.rsplit('.', 1)[0])
+        return vtype or DEFAULT_VTYPE
+
+    def length_of(self, vehicle_id):
+        """车辆长度（m）"""
+        vtype = self.vtypes.get(self.type_of(vehicle_id))
+        return vtype['length'] if vtype else DEFAULT_VEHICLE_LENGTH_M
+
+    def lengths(self, vehicle_ids):
+        """一组车辆ID对应的车长数组（m）"""
+        return np.array([self.length_of(vehicle_id) for vehicle_id in vehicle_ids], dtype=float)
+
+
+def load_vehicle_types(route_file="highway-ramp.rou.xml"):
+    """加载车型索引，进程内按路径和修改时间缓存"""
+    route_file = os.path.abspath(route_file)
+    signature = _file_signature(route_file)
+
+    cached = _vtype_cache.get(route_file)
+    if cached and cached[0] == signature:
+        return cached[1]
+
+    index = VehicleTypeIndex.from_route_file(route_file)
+    _vtype_cache[route_file] = (signature, index)
+    return index
@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+仿真输出列式缓存
+将解析后的FCD、行程等数据框按列保存为.npy文件（字符串列做字典编码），
+以源文件路径、大小、修改时间和内容哈希作为缓存键；
+源文件未变化时直接以内存映射方式加载，跳过XML解析
+"""
+
+import os
+import json
+import shutil
+import hashlib
+import pandas as pd
+import numpy as np
+
+from analysis_defaults import CACHE_DIR
+
+# 缓存格式版本，结构变化时递增
+CACHE_VERSION = 1
+
+_HASH_BLOCK_SIZE = 1024 * 1024
+
+
+def file_content_hash(file_path):
+    """计算文件内容哈希"""
+    digest = hashlib.blake2b(digest_size=20)
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(_HASH_BLOCK_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def source_signature(file_path):
+    """源文件的缓存键：绝对路径、大小、修改时间和内容哈希"""
+    stat = os.stat(file_path)
+    return {
+        'path': os.path.abspath(file_path),
+        'size': stat.st_size,
+        'mtime_ns': stat.st_mtime_ns,
+        'content_hash': file_content_hash(file_path),
+    }
+
+
+def _object_array(values):
+    array = np.empty(len(values), dtype=object)
+    array[:] = list(values)
+    return array
+
+
+def save_frame_columns(df, directory):
+    """将数据框按列写入目录，返回列描述信息"""
+    os.makedirs(directory, exist_ok=True)
+    columns = []
+
+    for name in df.columns:
+        series = df[name]
+        column = {'name': name}
+
+        if isinstance(series.dtype, pd.CategoricalDtype):
+            codes = series.cat.codes.to_numpy()
+            column.update(kind='category', categories=list(series.cat.categories))
+        elif pd.api.types.is_numeric_dtype(series.dtype) or pd.api.types.is_bool_dtype(series.dtype):
+            codes = series.to_numpy()
+            column.update(kind='numeric')
+        else:
+            # 字符串列做字典编码保存，加载时还原为字符串
+            codes, categories = pd.factorize(series.to_numpy(dtype=object), use_na_sentinel=True)
+            column.update(kind='string', categories=list(categories))
+
+        np.save(os.path.join(directory, f"{len(columns)}.npy"), np.ascontiguousarray(codes))
+        columns.append(column)
+
+    return columns
+
+
+def load_frame_columns(directory, columns, mmap=True):
+    """按列描述信息从目录加载数据框；mmap为True时数值列以只读内存映射方式打开"""
+    data = {}
+    for i, column in enumerate(columns):
+        values = np.load(os.path.join(directory, f"{i}.npy"), mmap_mode='r' if mmap else None)
+
+        if column['kind'] == 'category':
+            data[column['name']] = pd.Categorical.from_codes(
+                np.asarray(values), pd.Index(_object_array(column['categories'])))
+        elif column['kind'] == 'string':
+            categories = _object_array(column['categories'] + [None])
+            data[column['name']] = categories[np.asarray(values)]
+        else:
+            data[column['name']] = values
+
+    return pd.DataFrame(data, columns=[column['name'] for column in columns])
+
+
+class OutputCache:
+    """仿真输出文件的列式缓存
+
+    每个 (数据类型, 源文件) 对应缓存目录下的一个条目，条目中保存各列.npy文件和manifest.json。
+    源文件大小和修改时间未变时直接命中；修改时间变化但大小相同时比较内容哈希，
+    内容一致则继续使用缓存并更新记录的修改时间。
+    """
+
+    def __init__(self, cache_dir=CACHE_DIR, mmap=True):
+        self.cache_dir = cache_dir
+        self.mmap = mmap
+
+    def entry_dir(self, source_path, kind):
+        """缓存条目目录"""
+        path_key = hashlib.blake2b(os.path.abspath(source_path).encode('utf-8'),
+                                   digest_size=8).hexdigest()
+        return os.path.join(self.cache_dir, f"{kind}-{path_key}")
+
+    def temp_entry_dir(self, entry):
+        """条目写入时使用的临时目录（创建为空目录），写完后通过commit_entry替换正式条目"""
+        tmp_entry = f"{entry}.tmp-{os.getpid()}"
+        shutil.rmtree(tmp_entry, ignore_errors=True)
+        os.makedirs(tmp_entry)
+        return tmp_entry
+
+    def discard_entry(self, entry):
+        """删除写入失败的临时目录"""
+        shutil.rmtree(f"{entry}.tmp-{os.getpid()}", ignore_errors=True)
+
+    def commit_entry(self, tmp_entry, entry):
+        """用写好的临时目录替换缓存条目"""
+        shutil.rmtree(entry, ignore_errors=True)
+        os.replace(tmp_entry, entry)
+
+    def _read_manifest(self, entry):
+        try:
+            with open(os.path.join(entry, 'manifest.json'), 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if manifest.get('version') != CACHE_VERSION:
+            return None
+        return manifest
+
+    def write_manifest(self, entry, manifest):
+        with open(os.path.join(entry, 'manifest.json'), 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False)
+
+    def is_valid(self, source_path, kind):
+        """检查缓存条目是否与源文件一致，返回manifest或None"""
+        entry = self.entry_dir(source_path, kind)
+        manifest = self._read_manifest(entry)
+        if manifest is None or not os.path.exists(source_path):
+            return None
+
+        stat = os.stat(source_path)
+        source = manifest['source']
+        if source['path'] != os.path.abspath(source_path) or source['size'] != stat.st_size:
+            return None
+        if source['mtime_ns'] == stat.st_mtime_ns:
+            return manifest
+
+        # 修改时间变化（例如重新生成了相同的输出），比较内容哈希
+        if file_content_hash(source_path) != source['content_hash']:
+            return None
+        source['mtime_ns'] = stat.st_mtime_ns
+        try:
+            self.write_manifest(entry, manifest)
+        except OSError:
+            pass
+        return manifest
+
+    def load(self, source_path, kind):
+        """加载缓存的数据框，缓存不存在或已失效时返回None"""
+        manifest = self.is_valid(source_path, kind)
+        if manifest is None:
+            return None
+        try:
+            return load_frame_columns(self.entry_dir(source_path, kind),
+                                      manifest['columns'], mmap=self.mmap)
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def store(self, source_path, kind, df):
+        """将数据框写入缓存；写入失败时仅给出警告"""
+        entry = self.entry_dir(source_path, kind)
+        try:
+            tmp_entry = self.temp_entry_dir(entry)
+            columns = save_frame_columns(df, tmp_entry)
+            self.write_manifest(tmp_entry, {
+                'version': CACHE_VERSION,
+                'kind': kind,
+                'rows': len(df),
+                'source': source_signature(source_path),
+                'columns': columns,
+            })
+            self.commit_entry(tmp_entry, entry)
+        except OSError as e:
+            self.discard_entry(entry)
+            print(f"警告: 无法写入缓存 {entry}: {e}")
+
+    def get_or_parse(self, source_path, kind, parser):
+        """优先从缓存加载，否则调用parser(source_path)解析并写入缓存"""
+        df = self.load(source_path, kind)
+        if df is not None:
+            print(f"从缓存加载 {source_path} ({len(df)} 条记录)")
+            return df
+
+        df = parser(source_path)
+        self.store(source_path, kind, df)
+        return df
+
+    def clear(self):
+        """删除全部缓存"""
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
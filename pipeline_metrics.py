@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+分析流程的性能计量
+记录各分析阶段的用时、常驻内存（开始、结束和采样峰值）和处理的记录数；
+可选地对各顶层阶段运行cProfile或tracemalloc，结果与计时一起写入JSON报告。
+每个阶段结束时把计量结果传给已注册的回调函数，便于接入外部监控
+"""
+
+import os
+import sys
+import json
+import time
+import threading
+import functools
+import contextlib
+
+# 可选的剖析工具
+PROFILERS = ('cprofile', 'tracemalloc')
+
+# 报告中保留的热点函数和内存分配位置数
+PROFILE_TOP_N = 20
+
+# 内存采样间隔（秒）
+_RSS_SAMPLE_INTERVAL = 0.005
+
+_MB = 2 ** 20
+
+
+def current_rss():
+    """当前进程的常驻内存（字节）；无法读取/proc时返回历史峰值"""
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # macOS以字节为单位，Linux以KB为单位
+        return peak if sys.platform == 'darwin' else peak * 1024
+
+
+class PeakMemorySampler:
+    """在后台线程中采样常驻内存，记录with块执行期间的峰值"""
+
+    def __init__(self, interval=_RSS_SAMPLE_INTERVAL):
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, current_rss())
+
+    def __enter__(self):
+        self.peak = current_rss()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, current_rss())
+
+
+def _cprofile_top(profile, limit=PROFILE_TOP_N):
+    """cProfile结果中累计用时最长的函数"""
+    import pstats
+    stats = pstats.Stats(profile)
+    entries = sorted(stats.stats.items(), key=lambda item: item[1][3], reverse=True)
+    top = []
+    for (filename, line, function), (_, calls, total, cumulative, _) in entries[:limit]:
+        top.append({
+            'function': f"{os.path.basename(filename)}:{line}({function})",
+            'calls': calls,
+            'total_seconds': total,
+            'cumulative_seconds': cumulative,
+        })
+    return top
+
+
+def _tracemalloc_top(snapshot, limit=PROFILE_TOP_N):
+    """tracemalloc快照中分配内存最多的代码位置"""
+    top = []
+    for stat in snapshot.statistics('lineno')[:limit]:
+        frame = stat.traceback[0]
+        top.append({
+            'location': f"{os.path.basename(frame.filename)}:{frame.lineno}",
+            'size_mb': stat.size / _MB,
+            'count': stat.count,
+        })
+    return top
+
+
+class PipelineInstrumentation:
+    """分析阶段的计时、内存计量和可选剖析
+
+    stage(name)为上下文管理器，阶段可以嵌套（如计算交通流参数时调用的车头时距计算），
+    记录中的parent为外层阶段名。profile为PROFILERS中的若干项：
+    cprofile对每个顶层阶段单独剖析并保存.prof文件，tracemalloc记录阶段内Python对象分配的峰值和热点位置
+    """
+
+    def __init__(self, profile=None, sample_memory=True):
+        profile = tuple(profile or ())
+        for name in profile:
+            if name not in PROFILERS:
+                raise ValueError(f"未知的剖析工具: {name}")
+        self.profile = profile
+        self.sample_memory = sample_memory
+        self.records = []
+        self.callbacks = []
+        self._stack = []
+        self._profiles = {}
+        self._started_at = time.strftime('%Y-%m-%d %H:%M:%S')
+
+    def add_callback(self, callback):
+        """注册回调：每个阶段结束时调用callback(record)，record为该阶段的计量字典"""
+        self.callbacks.append(callback)
+        return callback
+
+    def remove_callback(self, callback):
+        self.callbacks.remove(callback)
+
+    def reset(self):
+        """清除已有的计量记录（保留回调）"""
+        self.records = []
+        self._profiles = {}
+        self._started_at = time.strftime('%Y-%m-%d %H:%M:%S')
+
+    def annotate(self, **values):
+        """为当前阶段附加计量值（如rows记录数），不在任何阶段内时忽略"""
+        if self._stack:
+            self._stack[-1].update(values)
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """计量一个分析阶段"""
+        record = {
+            'stage': name,
+            'parent': self._stack[-1]['stage'] if self._stack else None,
+            'started_at': time.time(),
+        }
+        top_level = not self._stack
+        self._stack.append(record)
+
+        profiler = None
+        if top_level and 'cprofile' in self.profile:
+            import cProfile
+            profiler = cProfile.Profile()
+        tracing = top_level and 'tracemalloc' in self.profile
+        if tracing:
+            import tracemalloc
+            started_tracing = not tracemalloc.is_tracing()
+            if started_tracing:
+                tracemalloc.start()
+            elif hasattr(tracemalloc, 'reset_peak'):
+                tracemalloc.reset_peak()
+            traced_start = tracemalloc.get_traced_memory()[0]
+
+        sampler = PeakMemorySampler() if self.sample_memory else contextlib.nullcontext()
+        rss_start = current_rss()
+        failed = True
+        try:
+            with sampler:
+                started = time.perf_counter()
+                if profiler is not None:
+                    profiler.enable()
+                try:
+                    yield record
+                finally:
+                    if profiler is not None:
+                        profiler.disable()
+                    seconds = time.perf_counter() - started
+            failed = False
+        finally:
+            self._stack.pop()
+            rss_end = current_rss()
+            record.update(
+                seconds=seconds,
+                rss_start_mb=rss_start / _MB,
+                rss_end_mb=rss_end / _MB,
+                rss_delta_mb=(rss_end - rss_start) / _MB,
+                peak_rss_mb=(sampler.peak if self.sample_memory else max(rss_start, rss_end)) / _MB,
+                failed=failed,
+            )
+            rows = record.get('rows')
+            if rows and seconds > 0:
+                record['rows_per_second'] = rows / seconds
+            if tracing:
+                current, peak = tracemalloc.get_traced_memory()
+                record['traced_peak_mb'] = (peak - traced_start) / _MB
+                record['traced_delta_mb'] = (current - traced_start) / _MB
+                record['allocations'] = _tracemalloc_top(tracemalloc.take_snapshot())
+                if started_tracing:
+                    tracemalloc.stop()
+            if profiler is not None:
+                record['hotspots'] = _cprofile_top(profiler)
+                self._profiles[len(self.records)] = profiler
+            self.records.append(record)
+            self._notify(record)
+
+    def _notify(self, record):
+        for callback in list(self.callbacks):
+            try:
+                callback(record)
+            except Exception as e:
+                # 监控回调出错不影响分析本身
+                print(f"警告: 计量回调出错: {type(e).__name__}: {e}")
+
+    def summary(self):
+        """各顶层阶段的用时和峰值内存"""
+        return {record['stage']: {'seconds': record['seconds'], 'peak_rss_mb': record['peak_rss_mb']}
+                for record in self.records if record['parent'] is None}
+
+    def report(self):
+        """计时报告（可直接写出为JSON）"""
+        top_level = [record for record in self.records if record['parent'] is None]
+        return {
+            'started_at': self._started_at,
+            'total_seconds': sum(record['seconds'] for record in top_level),
+            'peak_rss_mb': max((record['peak_rss_mb'] for record in self.records), default=0.0),
+            'profile': list(self.profile),
+            'stages': self.records,
+        }
+
+    def save(self, report_dir, timestamp=None):
+        """写出JSON计时报告和各阶段的cProfile结果，返回报告路径"""
+        timestamp = timestamp or time.strftime("%Y%m%d_%H%M%S")
+        os.makedirs(report_dir, exist_ok=True)
+        report = self.report()
+        for position, profiler in self._profiles.items():
+            record = report['stages'][position]
+            profile_file = os.path.join(report_dir, f"profile_{record['stage']}_{timestamp}.prof")
+            profiler.dump_stats(profile_file)
+            record['profile_file'] = profile_file
+        report_file = os.path.join(report_dir, f"pipeline_timing_{timestamp}.json")
+        with open(report_file, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        return report_file
+
+
+def instrumented(name=None):
+    """方法装饰器：在self.instrumentation中计量该方法的执行，阶段名默认为方法名"""
+    def decorator(method):
+        stage_name = name or method.__name__
+
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            instrumentation = getattr(self, 'instrumentation', None)
+            if instrumentation is None:
+                return method(self, *args, **kwargs)
+            with instrumentation.stage(stage_name):
+                return method(self, *args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+流式报表导出
+Excel报表以openpyxl的只写模式按块追加行，工作表数据不在内存中构建单元格对象；
+完整的FCD轨迹按块写入gzip压缩的CSV或Parquet文件，不再只保存前若干行样本。
+JSON结果中的NumPy数值转换为Python数值后写出
+"""
+
+import gzip
+import json
+import numpy as np
+import pandas as pd
+
+from analysis_defaults import FCD_EXPORT_FORMATS
+
+# 每次转换和写出的行数
+DEFAULT_CHUNK_ROWS = 65536
+
+# Excel工作表的行数上限（含表头）和名称长度上限
+EXCEL_MAX_ROWS = 1048576
+EXCEL_MAX_SHEET_NAME = 31
+
+
+def json_default(value):
+    """json.dump的default：NumPy标量和数组转换为Python对象"""
+    if isinstance(value, np.integer):
+        return int(value)
+    if isinstance(value, np.floating):
+        return float(value)
+    if isinstance(value, np.bool_):
+        return bool(value)
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def save_json(data, path):
+    """写出JSON文件（支持NumPy数值）"""
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, indent=2, ensure_ascii=False, default=json_default)
+
+
+def _chunk_rows(df, start, stop):
+    """数据框的一段行转换为Python值列表，缺失值写为空单元格"""
+    chunk = df.iloc[start:stop]
+    values = chunk.astype(object).where(chunk.notna(), None)
+    return values.to_numpy().tolist()
+
+
+class StreamingWorkbook:
+    """只写模式的Excel工作簿
+
+    write_frame()按块把数据框追加到工作表，超过Excel行数上限的数据自动续写到后续工作表；
+    close()时写出文件
+    """
+
+    def __init__(self, path, chunk_rows=DEFAULT_CHUNK_ROWS):
+        from openpyxl import Workbook
+        self.path = path
+        self.chunk_rows = chunk_rows
+        self.workbook = Workbook(write_only=True)
+        self.sheet_names = []
+
+    def _create_sheet(self, name):
+        name = name[:EXCEL_MAX_SHEET_NAME]
+        sheet = self.workbook.create_sheet(title=name)
+        self.sheet_names.append(sheet.title)
+        return sheet
+
+    def write_frame(self, df, sheet_name, index=False):
+        """把数据框写入工作表；index为True时第一列写出行索引"""
+        header = [str(column) for column in df.columns]
+        if index:
+            header = [str(df.index.name or '')] + header
+            df = pd.concat([df.index.to_frame(index=False), df.reset_index(drop=True)], axis=1)
+        sheet_rows = EXCEL_MAX_ROWS - 1
+        n_sheets = max((len(df) + sheet_rows - 1) // sheet_rows, 1)
+
+        for part in range(n_sheets):
+            name = sheet_name if part == 0 else f"{sheet_name[:EXCEL_MAX_SHEET_NAME - 4]}_{part + 1}"
+            sheet = self._create_sheet(name)
+            sheet.append(header)
+            stop = min((part + 1) * sheet_rows, len(df))
+            for start in range(part * sheet_rows, stop, self.chunk_rows):
+                for row in _chunk_rows(df, start, min(start + self.chunk_rows, stop)):
+                    sheet.append(row)
+
+    def close(self):
+        if not self.sheet_names:
+            # 空工作簿也需要一个工作表才能保存
+            self._create_sheet('Sheet')
+        self.workbook.save(self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        if exc_type is None:
+            self.close()
+
+
+def fcd_export_path(base_path, fmt):
+    """完整FCD导出文件路径（base_path不含扩展名）"""
+    if fmt not in FCD_EXPORT_FORMATS:
+        raise ValueError(f"未知的FCD导出格式: {fmt}")
+    return base_path + FCD_EXPORT_FORMATS[fmt]
+
+
+def export_csv(df, path, chunk_rows=DEFAULT_CHUNK_ROWS):
+    """按块写出gzip压缩的CSV"""
+    with gzip.open(path, 'wt', encoding='utf-8', newline='') as f:
+        for start in range(0, max(len(df), 1), chunk_rows):
+            df.iloc[start:start + chunk_rows].to_csv(f, header=(start == 0), index=False)
+    return path
+
+
+def export_parquet(df, path, chunk_rows=DEFAULT_CHUNK_ROWS):
+    """按块写出Parquet，每块一个行组（需要pyarrow）"""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    writer = None
+    try:
+        for start in range(0, max(len(df), 1), chunk_rows):
+            table = pa.Table.from_pandas(df.iloc[start:start + chunk_rows], preserve_index=False)
+            if writer is None:
+                writer = pq.ParquetWriter(path, table.schema, compression='zstd')
+            writer.write_table(table)
+    finally:
+        if writer is not None:
+            writer.close()
+    return path
+
+
+def export_fcd(fcd_df, base_path, fmt='csv', chunk_rows=DEFAULT_CHUNK_ROWS):
+    """导出完整FCD数据，返回文件路径
+
+    按块转换和写出，内存映射的紧凑列存储也只会逐块读入内存
+    """
+    path = fcd_export_path(base_path, fmt)
+    if fmt == 'parquet':
+        return export_parquet(fcd_df, path, chunk_rows)
+    return export_csv(fcd_df, path, chunk_rows)
@@ -0,0 +1,367 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+多随机种子重复仿真
+同一场景以不同的随机种子重复运行（各车型的sigma驾驶不完美性使各次仿真结果不同），
+每个种子在独立的工作进程中运行sumo并把轨迹聚合为traffic_stats，只把各路段的平均指标传回主进程；
+主进程以Welford算法流式累积均值和方差（内存占用与重复次数无关），给出各路段指标的置信区间。
+置信区间相对半宽达到目标精度后不再启动新的种子
+"""
+
+import os
+import sys
+import json
+import math
+import time
+import argparse
+from statistics import NormalDist
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+from batch_runner import Scenario, BatchRunner, DEFAULT_NET_FILE
+from demand_generator import DEMAND_PRESETS
+from analysis_defaults import DEFAULT_BIN_WIDTH
+
+# 重复仿真输出目录
+REPLICATION_DIR = "replication_runs"
+
+# 各路段累积的指标（traffic_stats的列）
+REPLICATION_METRICS = ('volume', 'avg_speed', 'density', 'occupancy')
+
+# 默认停止条件：检查的指标、置信水平、相对半宽和重复次数范围
+DEFAULT_STOP_METRICS = ('avg_speed', 'volume')
+DEFAULT_CONFIDENCE = 0.95
+DEFAULT_PRECISION = 0.05
+DEFAULT_MIN_REPLICATIONS = 3
+DEFAULT_MAX_REPLICATIONS = 20
+
+
+def _t_coverage(t, dof):
+    """t分布的双侧概率 P(|T| <= t)，整数自由度的精确有限级数（Abramowitz & Stegun 26.7.3、26.7.4）"""
+    theta = math.atan(t / math.sqrt(dof))
+    cos2 = math.cos(theta) ** 2
+    if dof % 2:
+        term = total = 0.0
+        if dof > 1:
+            term = total = math.cos(theta)
+            for k in range(3, dof - 1, 2):
+                term *= cos2 * (k - 1) / k
+                total += term
+        return 2 / math.pi * (theta + math.sin(theta) * total)
+    term = total = 1.0
+    for k in range(2, dof - 1, 2):
+        term *= cos2 * (k - 1) / k
+        total += term
+    return math.sin(theta) * total
+
+
+def t_quantile(confidence, dof):
+    """双侧置信水平confidence、自由度dof的t分布分位数
+
+    自由度1、2使用精确公式；其余以Cornish-Fisher展开（Abramowitz & Stegun 26.7.5）为初值，
+    再用精确的分布函数做牛顿迭代，任意置信水平下都精确到1e-10
+    """
+    p = 0.5 + confidence / 2
+    if dof == 1:
+        return math.tan(math.pi * (p - 0.5))
+    if dof == 2:
+        return (2 * p - 1) / math.sqrt(2 * p * (1 - p))
+    z = NormalDist().inv_cdf(p)
+    g1 = (z ** 3 + z) / 4
+    g2 = (5 * z ** 5 + 16 * z ** 3 + 3 * z) / 96
+    g3 = (3 * z ** 7 + 19 * z ** 5 + 17 * z ** 3 - 15 * z) / 384
+    g4 = (79 * z ** 9 + 776 * z ** 7 + 1482 * z ** 5 - 1920 * z ** 3 - 945 * z) / 92160
+    t = z + g1 / dof + g2 / dof ** 2 + g3 / dof ** 3 + g4 / dof ** 4
+    # 牛顿迭代：双侧概率对t的导数为两倍的概率密度
+    log_norm = math.lgamma((dof + 1) / 2) - math.lgamma(dof / 2) - 0.5 * math.log(dof * math.pi)
+    for _ in range(20):
+        density = math.exp(log_norm - (dof + 1) / 2 * math.log1p(t * t / dof))
+        step = (_t_coverage(t, dof) - confidence) / (2 * density)
+        t -= step
+        if abs(step) < 1e-12 * max(t, 1.0):
+            break
+    return t
+
+
+class RunningStats:
+    """Welford算法的流式均值和方差，只保存计数、均值和离差平方和"""
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self._m2 = 0.0
+
+    def update(self, value):
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self._m2 += delta * (value - self.mean)
+
+    @property
+    def variance(self):
+        """样本方差，少于两个样本时为NaN"""
+        return self._m2 / (self.count - 1) if self.count > 1 else math.nan
+
+    @property
+    def std(self):
+        return math.sqrt(self.variance)
+
+    def half_width(self, confidence=DEFAULT_CONFIDENCE):
+        """均值置信区间的半宽"""
+        if self.count < 2:
+            return math.nan
+        return t_quantile(confidence, self.count - 1) * self.std / math.sqrt(self.count)
+
+    def relative_half_width(self, confidence=DEFAULT_CONFIDENCE):
+        """半宽与均值绝对值之比；均值为0时半宽为0则为0，否则为无穷大"""
+        half_width = self.half_width(confidence)
+        if self.mean == 0:
+            return 0.0 if half_width == 0 else math.inf
+        return half_width / abs(self.mean)
+
+    def to_dict(self, confidence=DEFAULT_CONFIDENCE):
+        half_width = self.half_width(confidence)
+        return {
+            'n': self.count,
+            'mean': self.mean,
+            'std': self.std if self.count > 1 else None,
+            'ci_low': self.mean - half_width if self.count > 1 else None,
+            'ci_high': self.mean + half_width if self.count > 1 else None,
+            'half_width': half_width if self.count > 1 else None,
+        }
+
+
+class ReplicationStats:
+    """各路段各指标的流式统计 {路段: {指标: RunningStats}}"""
+
+    def __init__(self, metrics=REPLICATION_METRICS):
+        self.metrics = tuple(metrics)
+        self.edges = {}
+
+    def update(self, edge_metrics):
+        """加入一次重复的结果：{路段: {指标: 值}}"""
+        for edge, values in edge_metrics.items():
+            stats = self.edges.setdefault(edge, {metric: RunningStats() for metric in self.metrics})
+            for metric in self.metrics:
+                value = values.get(metric)
+                if value is not None and math.isfinite(value):
+                    stats[metric].update(value)
+
+    def converged(self, metrics=DEFAULT_STOP_METRICS, confidence=DEFAULT_CONFIDENCE,
+                  precision=DEFAULT_PRECISION, min_replications=DEFAULT_MIN_REPLICATIONS):
+        """所有路段的指定指标都已有至少min_replications个样本且相对半宽不超过precision"""
+        if not self.edges:
+            return False
+        for stats in self.edges.values():
+            for metric in metrics:
+                if stats[metric].count < max(min_replications, 2):
+                    return False
+                if stats[metric].relative_half_width(confidence) > precision:
+                    return False
+        return True
+
+    def worst_precision(self, metrics=DEFAULT_STOP_METRICS, confidence=DEFAULT_CONFIDENCE):
+        """指定指标中最大的相对半宽（用于报告进度）"""
+        widths = [stats[metric].relative_half_width(confidence)
+                  for stats in self.edges.values() for metric in metrics if stats[metric].count > 1]
+        return max(widths, default=math.nan)
+
+    def to_dict(self, confidence=DEFAULT_CONFIDENCE):
+        return {edge: {metric: stats[metric].to_dict(confidence) for metric in self.metrics}
+                for edge, stats in self.edges.items()}
+
+
+def edge_means(traffic_stats, metrics=REPLICATION_METRICS):
+    """traffic_stats中各路段指标的时间平均（与分析报告中的"平均车流量"等一致）"""
+    if traffic_stats.empty:
+        return {}
+    means = traffic_stats.groupby('edge', sort=False, observed=True)[list(metrics)].mean()
+    return {edge: {metric: float(row[metric]) for metric in metrics} for edge, row in means.iterrows()}
+
+
+def _replicate(task):
+    """工作进程：运行一个种子的仿真并聚合其轨迹，返回运行结果和各路段的平均指标"""
+    runner, scenario, route_file, bin_width = task
+    from fcd_reader import read_fcd
+    from network_index import load_network_index, load_vehicle_types
+    from traffic_aggregator import TrafficAggregate
+    from capacity_analysis import AGGREGATE_FILE
+
+    result = runner.run_scenario(scenario)
+    fcd_file = result['outputs'].get('fcd')
+    if not result['ok'] or fcd_file is None:
+        result['ok'] = False
+        return result, None
+
+    started = time.perf_counter()
+    network = load_network_index(runner.net_file) if os.path.exists(runner.net_file) else None
+    vehicle_types = load_vehicle_types(route_file)
+    fcd_df = read_fcd(fcd_file).to_dataframe()
+    aggregate = TrafficAggregate.from_fcd(fcd_df, bin_width=bin_width, vehicle_lengths=vehicle_types.lengths)
+    traffic_stats = aggregate.to_traffic_stats(network)
+    # 保存累积量，之后的通行能力分析等可以直接读取，无需重新解析轨迹
+    result['aggregate'] = os.path.join(os.path.dirname(fcd_file), AGGREGATE_FILE)
+    aggregate.save(result['aggregate'])
+    result['rows'] = len(fcd_df)
+    result['analysis_duration'] = time.perf_counter() - started
+    return result, edge_means(traffic_stats)
+
+
+class ReplicationRunner:
+    """以多个随机种子重复运行同一场景并累积置信区间
+
+    种子按顺序提交，最多jobs个同时运行；完成的结果按种子顺序并入统计，
+    因此在第几个种子后达到停止条件与进程调度无关。达到停止条件后不再提交新种子，
+    已在运行的种子仍计入结果
+    """
+
+    def __init__(self, runner, bin_width=DEFAULT_BIN_WIDTH, confidence=DEFAULT_CONFIDENCE,
+                 precision=DEFAULT_PRECISION, stop_metrics=DEFAULT_STOP_METRICS,
+                 min_replications=DEFAULT_MIN_REPLICATIONS):
+        for metric in stop_metrics:
+            if metric not in REPLICATION_METRICS:
+                raise ValueError(f"未知的指标: {metric}")
+        self.runner = runner
+        self.bin_width = bin_width
+        self.confidence = confidence
+        self.precision = precision
+        self.stop_metrics = tuple(stop_metrics)
+        self.min_replications = min_replications
+
+    def _converged(self, stats):
+        if self.precision <= 0:
+            return False
+        return stats.converged(self.stop_metrics, self.confidence, self.precision, self.min_replications)
+
+    def run(self, demand=1.0, vehicle_config="mixed", seeds=range(1, DEFAULT_MAX_REPLICATIONS + 1)):
+        """依次运行各种子直到达到停止条件或种子用完，返回汇总字典并写入replication_results.json"""
+        scenarios = [Scenario(demand, vehicle_config, seed) for seed in seeds]
+        if not scenarios:
+            raise ValueError("至少需要一个随机种子")
+        os.makedirs(self.runner.batch_dir, exist_ok=True)
+        # 各种子的需求相同，路径文件只生成一次
+        route_file = os.path.abspath(self.runner.library.route_file(scenarios[0].demand_scenario()))
+        jobs = min(self.runner.jobs, len(scenarios))
+        print(f"场景 d{demand:g}_{vehicle_config}: 最多 {len(scenarios)} 个随机种子，"
+              f"同时运行 {jobs} 个，目标相对半宽 {self.precision:.1%}（置信水平 {self.confidence:.0%}）")
+
+        stats = ReplicationStats()
+        runs = []
+        finished = {}
+        next_submit = 0
+        next_merge = 0
+        stopped = False
+        started = time.perf_counter()
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            running = {}
+            while True:
+                while not stopped and next_submit < len(scenarios) and len(running) < jobs:
+                    task = (self.runner, scenarios[next_submit], route_file, self.bin_width)
+                    running[executor.submit(_replicate, task)] = next_submit
+                    next_submit += 1
+                if not running:
+                    break
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    index = running.pop(future)
+                    try:
+                        finished[index] = future.result()
+                    except Exception as e:
+                        # 单个种子的仿真或分析出错（如被终止的SUMO留下不完整的轨迹文件）时记为失败，不中断其余种子
+                        scenario = scenarios[index]
+                        failed = {'scenario': scenario.name, **scenario.to_dict(), 'ok': False,
+                                  'returncode': None, 'error': f"{type(e).__name__}: {e}"}
+                        finished[index] = (failed, None)
+
+                # 按种子顺序并入统计
+                while next_merge in finished:
+                    result, edge_metrics = finished.pop(next_merge)
+                    next_merge += 1
+                    runs.append(result)
+                    if edge_metrics is None:
+                        print(f"  种子 {result['seed']}: 失败 ({result.get('error', result['returncode'])})")
+                        continue
+                    stats.update(edge_metrics)
+                    worst = stats.worst_precision(self.stop_metrics, self.confidence)
+                    precision = "样本不足" if math.isnan(worst) else f"{worst:.1%}"
+                    print(f"  种子 {result['seed']}: 完成，用时 {result['duration']:.1f}s，"
+                          f"当前最大相对半宽 {precision}")
+                    if not stopped and self._converged(stats):
+                        stopped = True
+                        print(f"  已达到目标精度，不再运行其余 {len(scenarios) - next_submit} 个种子")
+        elapsed = time.perf_counter() - started
+
+        n_ok = sum(run['ok'] for run in runs)
+        summary = {
+            'created_at': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'scenario': {'demand': demand, 'vehicle_config': vehicle_config},
+            'bin_width': self.bin_width,
+            'confidence': self.confidence,
+            'precision': self.precision,
+            'stop_metrics': list(self.stop_metrics),
+            'converged': self._converged(stats),
+            'replications': n_ok,
+            'elapsed': elapsed,
+            'edges': stats.to_dict(self.confidence),
+            'runs': runs,
+        }
+        with open(os.path.join(self.runner.batch_dir, 'replication_results.json'), 'w', encoding='utf-8') as f:
+            json.dump(summary, f, ensure_ascii=False, indent=2)
+        print_summary(summary)
+        return summary
+
+
+def print_summary(summary):
+    """输出各路段指标的均值和置信区间"""
+    status = "已达到目标精度" if summary['converged'] else "未达到目标精度"
+    print(f"\n{summary['replications']} 次有效重复，{status}，总用时 {summary['elapsed']:.1f}s")
+    labels = {'volume': '车流量 (veh/h)', 'avg_speed': '平均速度 (km/h)',
+              'density': '密度 (veh/km)', 'occupancy': '占有率 (%)'}
+    for edge, metrics in summary['edges'].items():
+        print(f"路段: {edge}")
+        for metric, values in metrics.items():
+            if values['half_width'] is None:
+                print(f"  {labels[metric]}: {values['mean']:.2f}（样本不足，无置信区间）")
+            else:
+                print(f"  {labels[metric]}: {values['mean']:.2f} ± {values['half_width']:.2f} "
+                      f"[{values['ci_low']:.2f}, {values['ci_high']:.2f}]")
+
+
+def parse_args(argv=None):
+    """解析命令行参数"""
+    parser = argparse.ArgumentParser(description="多随机种子重复仿真与置信区间")
+    parser.add_argument('--demand', type=float, default=1.0, help="需求水平（流量倍数）")
+    parser.add_argument('--vehicle-config', default="mixed", choices=sorted(DEMAND_PRESETS), help="车型配置")
+    parser.add_argument('--max-replications', type=int, default=DEFAULT_MAX_REPLICATIONS,
+                        help="最多运行的随机种子数")
+    parser.add_argument('--first-seed', type=int, default=1, help="第一个随机种子")
+    parser.add_argument('--min-replications', type=int, default=DEFAULT_MIN_REPLICATIONS,
+                        help="判断是否停止前至少完成的重复次数")
+    parser.add_argument('--precision', type=float, default=DEFAULT_PRECISION,
+                        help="目标相对半宽（置信区间半宽/均值），0表示运行全部种子")
+    parser.add_argument('--confidence', type=float, default=DEFAULT_CONFIDENCE, help="置信水平")
+    parser.add_argument('--metrics', nargs='+', default=list(DEFAULT_STOP_METRICS),
+                        choices=list(REPLICATION_METRICS), help="停止条件检查的指标")
+    parser.add_argument('--bin-width', type=float, default=DEFAULT_BIN_WIDTH, help="统计时间窗（秒）")
+    parser.add_argument('--jobs', type=int, default=None, help="同时运行的种子数，默认为CPU核数")
+    parser.add_argument('--sumo', nargs='+', default=["sumo"],
+                        help="SUMO程序路径或命令前缀（如 python stub_sumo.py）")
+    parser.add_argument('--output-dir', default=REPLICATION_DIR, help="重复仿真输出目录")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """主函数"""
+    args = parse_args(argv)
+    print("=== 多随机种子重复仿真 ===")
+    runner = BatchRunner(batch_dir=args.output_dir, sumo_binary=args.sumo, jobs=args.jobs,
+                         net_file=DEFAULT_NET_FILE, outputs=('fcd',))
+    replication = ReplicationRunner(runner, bin_width=args.bin_width, confidence=args.confidence,
+                                    precision=args.precision, stop_metrics=args.metrics,
+                                    min_replications=args.min_replications)
+    seeds = range(args.first_seed, args.first_seed + args.max_replications)
+    summary = replication.run(args.demand, args.vehicle_config, seeds)
+    return 0 if summary['replications'] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
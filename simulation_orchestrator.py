@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+仿真与分析的异步编排
+在一个asyncio事件循环中运行SUMO仿真和交通流分析：仿真进程由asyncio子进程启动，
+运行期间根据轨迹文件中最新的时间步报告进度；仿真直接写出分析所需的输出文件，
+分析在同一进程内逐阶段执行（在线程中运行，不阻塞事件循环），不再启动第二个Python解释器重新仿真。
+取消时终止仿真进程，分析在当前阶段结束后停止
+"""
+
+import os
+import re
+import time
+import asyncio
+import xml.etree.ElementTree as ET
+
+# 仿真写出的输出文件（与highway-ramp-analysis.sumocfg一致）
+SIMULATION_OUTPUTS = {
+    'tripinfo': "trip_info.xml",
+    'fcd': "vehicle_traces.xml",
+    'summary': "summary.xml",
+}
+
+# 进度轮询间隔（秒）
+PROGRESS_INTERVAL = 1.0
+
+# 终止仿真进程时等待其退出的时间（秒）
+TERMINATE_TIMEOUT = 5.0
+
+# 读取轨迹文件末尾以查找最新时间步的字节数
+_TAIL_BYTES = 64 * 1024
+_TIMESTEP_PATTERN = re.compile(rb'<timestep time="([^"]+)"')
+
+
+def config_end_time(config_file):
+    """SUMO配置文件中的仿真结束时间，未设置时返回None"""
+    try:
+        end = ET.parse(config_file).getroot().find('time/end')
+    except (OSError, ET.ParseError):
+        return None
+    return float(end.get('value')) if end is not None else None
+
+
+def latest_timestep(fcd_file):
+    """正在写入的轨迹文件中最新的时间步，文件不存在或尚无时间步时返回None"""
+    try:
+        with open(fcd_file, 'rb') as f:
+            f.seek(0, os.SEEK_END)
+            f.seek(max(f.tell() - _TAIL_BYTES, 0))
+            tail = f.read()
+    except OSError:
+        return None
+    matches = _TIMESTEP_PATTERN.findall(tail)
+    return float(matches[-1]) if matches else None
+
+
+class SimulationOrchestrator:
+    """异步运行仿真和交通流分析
+
+    on_progress(event)在各进度节点被调用，event为字典：
+    phase（'simulation'/'analysis'）、message、fraction（0~1，未知时为None）。
+    base_width为细粒度统计时间窗（秒），与traffic_flow_analyzer的命令行流程一致。
+    analyzer为可复用的TrafficFlowAnalyzer实例，为None时在首次分析时创建
+    """
+
+    def __init__(self, on_progress=None, base_width=10, chart_quality='full', chart_workers=1,
+                 progress_interval=PROGRESS_INTERVAL, analyzer=None):
+        self.on_progress = on_progress
+        self.base_width = base_width
+        self.chart_quality = chart_quality
+        self.chart_workers = chart_workers
+        self.progress_interval = progress_interval
+        self.analyzer = analyzer
+
+    def _emit(self, phase, message, fraction=None):
+        if self.on_progress is not None:
+            self.on_progress({'phase': phase, 'message': message, 'fraction': fraction})
+
+    @staticmethod
+    def simulation_command(gui=True, config_file="highway-ramp.sumocfg", delay=50):
+        """仿真命令：在命令行中指定输出文件，GUI仿真同样写出分析所需的数据"""
+        command = ["sumo-gui" if gui else "sumo", "-c", config_file, "--step-length", "0.1"]
+        if gui:
+            command += ["--delay", str(delay)]
+        command += ["--tripinfo-output", SIMULATION_OUTPUTS['tripinfo'],
+                    "--fcd-output", SIMULATION_OUTPUTS['fcd'],
+                    "--summary-output", SIMULATION_OUTPUTS['summary']]
+        return command
+
+    async def _report_simulation(self, end_time):
+        """仿真运行期间定期报告已仿真到的时间"""
+        last = None
+        while True:
+            await asyncio.sleep(self.progress_interval)
+            current = latest_timestep(SIMULATION_OUTPUTS['fcd'])
+            if current is None or current == last:
+                continue
+            last = current
+            fraction = min(current / end_time, 1.0) if end_time else None
+            self._emit('simulation', f"已仿真至 {current:g}s", fraction)
+
+    async def run_simulation(self, gui=True, config_file="highway-ramp.sumocfg"):
+        """运行仿真直到结束，返回进程退出码；任务被取消时终止仿真进程"""
+        command = self.simulation_command(gui, config_file)
+        end_time = config_end_time(config_file)
+        self._emit('simulation', "启动SUMO仿真", 0.0)
+        process = await asyncio.create_subprocess_exec(
+            *command, stdout=asyncio.subprocess.DEVNULL,
+            stderr=None if gui else asyncio.subprocess.PIPE)
+        reporter = asyncio.ensure_future(self._report_simulation(end_time))
+        try:
+            if process.stderr is not None:
+                stderr = (await process.stderr.read()).decode(errors='replace')
+            else:
+                stderr = ''
+            returncode = await process.wait()
+        except asyncio.CancelledError:
+            await self._terminate(process)
+            self._emit('simulation', "仿真已取消")
+            raise
+        finally:
+            reporter.cancel()
+
+        if returncode != 0:
+            self._emit('simulation', f"仿真运行失败（退出码 {returncode}）{stderr[-500:]}")
+        else:
+            self._emit('simulation', "仿真运行完成", 1.0)
+        return returncode
+
+    @staticmethod
+    async def _terminate(process):
+        if process.returncode is not None:
+            return
+        process.terminate()
+        try:
+            await asyncio.wait_for(process.wait(), TERMINATE_TIMEOUT)
+        except asyncio.TimeoutError:
+            process.kill()
+            await process.wait()
+
+    def analysis_steps(self, analyzer):
+        """分析阶段列表 [(说明, 无参函数)]，与traffic_flow_analyzer的命令行流程一致"""
+        return [
+            ("加载路网", analyzer.load_network),
+            ("解析车辆轨迹", lambda: analyzer.analyze_fcd_data(SIMULATION_OUTPUTS['fcd'])),
+            ("解析行程数据", lambda: analyzer.analyze_trip_data(SIMULATION_OUTPUTS['tripinfo'])),
+            ("解析路网汇总", lambda: analyzer.analyze_summary_data(SIMULATION_OUTPUTS['summary'],
+                                                                bin_width=self.base_width)),
+            ("计算交通流参数", lambda: analyzer.calculate_traffic_parameters(base_width=self.base_width)),
+            ("汇总统计间隔", analyzer.calculate_rollups),
+            ("通行能力分析", analyzer.analyze_capacity),
+            ("生成走廊时空图", lambda: analyzer.analyze_corridor(SIMULATION_OUTPUTS['fcd'])),
+            ("生成图表", lambda: analyzer.generate_charts(quality=self.chart_quality,
+                                                        workers=self.chart_workers)),
+            ("保存结果", analyzer.save_results),
+            ("保存计时报告", analyzer.save_timing_report),
+        ]
+
+    async def run_analysis(self):
+        """在本进程内分析已有的仿真输出，返回分析器
+
+        各阶段依次在线程中运行；任务被取消时当前阶段结束后不再开始新的阶段
+        """
+        loop = asyncio.get_running_loop()
+        if self.analyzer is None:
+            # 分析器的重量级依赖在各阶段首次调用时导入
+            from traffic_flow_analyzer import TrafficFlowAnalyzer
+            self.analyzer = TrafficFlowAnalyzer()
+        analyzer = self.analyzer
+        analyzer.reset()
+        steps = self.analysis_steps(analyzer)
+        for position, (description, step) in enumerate(steps):
+            self._emit('analysis', description, position / len(steps))
+            await loop.run_in_executor(None, step)
+        self._emit('analysis', "数据分析完成", 1.0)
+        return analyzer
+
+    def outputs_ready(self, since=None):
+        """分析所需的输出文件是否都已存在（且在since之后写出）"""
+        for path in SIMULATION_OUTPUTS.values():
+            if not os.path.exists(path) or os.path.getsize(path) == 0:
+                return False
+            if since is not None and os.path.getmtime(path) < since:
+                return False
+        return True
+
+    async def run(self, gui=True, config_file="highway-ramp.sumocfg", simulate=True):
+        """运行仿真并分析其输出；simulate为False时直接分析已有的输出文件
+
+        返回分析器，仿真失败或缺少输出文件时返回None
+        """
+        started = time.time()
+        if simulate:
+            returncode = await self.run_simulation(gui, config_file)
+            if returncode != 0:
+                return None
+        if not self.outputs_ready(since=started if simulate else None):
+            missing = [path for path in SIMULATION_OUTPUTS.values() if not os.path.exists(path)]
+            self._emit('analysis', f"缺少仿真输出文件: {', '.join(missing) or '输出文件未更新'}")
+            return None
+        return await self.run_analysis()
@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+SUMO替身程序
+与 "sumo -c <配置文件>" 的调用方式相同：读取配置文件中的路网、路径文件、随机种子和仿真步长，
+用synthetic_outputs按需求生成配置中指定的fcd/tripinfo输出（summary输出只写出空文件），不运行仿真。
+用于在没有安装SUMO的环境中测试批量仿真和重复仿真，例如：
+    python batch_runner.py --sumo python stub_sumo.py
+"""
+
+import os
+import sys
+import argparse
+import xml.etree.ElementTree as ET
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from synthetic_outputs import SyntheticOutputGenerator, DEFAULT_STEP_LENGTH
+
+# 每次运行生成的轨迹记录数
+DEFAULT_ROWS = 20000
+
+_SUMMARY_CONTENT = '<?xml version="1.0" encoding="UTF-8"?>\n\n<summary>\n</summary>\n'
+
+
+def read_config(config_file):
+    """读取SUMO配置文件中的取值，返回 {选项名: 值}；文件路径按配置文件所在目录解析"""
+    directory = os.path.dirname(os.path.abspath(config_file))
+    options = {}
+    for elem in ET.parse(config_file).getroot().iter():
+        value = elem.get('value')
+        if value is None:
+            continue
+        if elem.tag in ('net-file', 'route-files') or elem.tag.endswith('-output'):
+            value = ','.join(os.path.join(directory, path) for path in value.split(','))
+        options[elem.tag] = value
+    return options
+
+
+def parse_args(argv=None):
+    """解析命令行参数（只支持-c，其余SUMO参数忽略）"""
+    parser = argparse.ArgumentParser(description="SUMO替身程序：按配置文件生成合成输出")
+    parser.add_argument('-c', '--configuration-file', dest='config', required=True, help="SUMO配置文件")
+    parser.add_argument('--stub-rows', type=int, default=DEFAULT_ROWS, help="生成的轨迹记录数")
+    args, _ = parser.parse_known_args(argv)
+    return args
+
+
+def main(argv=None):
+    """主函数"""
+    args = parse_args(argv)
+    options = read_config(args.config)
+    fcd_file = options.get('fcd-output')
+    trip_file = options.get('tripinfo-output')
+    generator = SyntheticOutputGenerator(options['net-file'], options['route-files'].split(',')[0],
+                                         step_length=float(options.get('step-length', DEFAULT_STEP_LENGTH)),
+                                         seed=int(options.get('seed', 1)))
+    if fcd_file or trip_file:
+        generator.write(fcd_file or os.devnull, trip_file, target_rows=args.stub_rows)
+    if 'summary-output' in options:
+        with open(options['summary-output'], 'w', encoding='utf-8') as f:
+            f.write(_SUMMARY_CONTENT)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,314 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+合成仿真输出
+按路径文件中的车流（路径、车型、小时流量）在highway.net.xml路网上生成车辆，
+每辆车在各路段上以车型最高速度与车道限速中的较小值乘以速度因子匀速行驶，部分车辆在路段内换道；
+按时间步顺序分块写出与SUMO格式一致的vehicle_traces.xml和trip_info.xml。
+不需要运行SUMO即可得到任意规模（数万到数千万条轨迹记录）的测试数据
+"""
+
+import xml.etree.ElementTree as ET
+import numpy as np
+
+from network_index import load_network_index
+
+# 与highway-ramp-analysis.sumocfg一致的仿真步长（每步写出一次FCD）
+DEFAULT_STEP_LENGTH = 0.1
+
+# 每次生成和写出的时间步数
+DEFAULT_CHUNK_STEPS = 2000
+
+# 在路段内换道的车辆比例
+LANE_CHANGE_PROBABILITY = 0.3
+
+# 速度因子（SUMO speedFactor）的均值、标准差和截断范围
+SPEED_FACTOR_MEAN = 1.0
+SPEED_FACTOR_DEV = 0.1
+SPEED_FACTOR_RANGE = (0.8, 1.2)
+
+# 路径文件中缺少最高速度时使用的车型最高速度（m/s）
+DEFAULT_MAX_SPEED = 36.11
+
+_FCD_HEADER = ('<?xml version="1.0" encoding="UTF-8"?>\n\n'
+               '<fcd-export xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" '
+               'xsi:noNamespaceSchemaLocation="http://sumo.dlr.de/xsd/fcd_file.xsd">\n')
+_FCD_FOOTER = '</fcd-export>\n'
+_TRIP_HEADER = ('<?xml version="1.0" encoding="UTF-8"?>\n\n'
+                '<tripinfos xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" '
+                'xsi:noNamespaceSchemaLocation="http://sumo.dlr.de/xsd/tripinfo_file.xsd">\n')
+_TRIP_FOOTER = '</tripinfos>\n'
+
+
+def load_demand(route_file):
+    """读取路径文件中的车型、路径和车流定义
+
+    返回 (vtypes, flows)：vtypes为 {车型ID: {'length', 'maxSpeed'}}，
+    flows为 [{'id', 'edges', 'type', 'vehsPerHour'}]
+    """
+    vtypes = {}
+    routes = {}
+    flows = []
+    for _, elem in ET.iterparse(route_file, events=('end',)):
+        if elem.tag == 'vType':
+            vtypes[elem.get('id')] = {
+                'length': float(elem.get('length', 5.0)),
+                'maxSpeed': float(elem.get('maxSpeed', DEFAULT_MAX_SPEED)),
+            }
+        elif elem.tag == 'route' and elem.get('id'):
+            routes[elem.get('id')] = elem.get('edges').split()
+        elif elem.tag == 'flow' and elem.get('vehsPerHour'):
+            flows.append({
+                'id': elem.get('id'),
+                'edges': routes[elem.get('route')],
+                'type': elem.get('type', 'DEFAULT_VEHTYPE'),
+                'vehsPerHour': float(elem.get('vehsPerHour')),
+            })
+    return vtypes, flows
+
+
+class _LaneGeometry:
+    """车道形状：按位置比例插值得到坐标和方向角"""
+
+    def __init__(self, network, lane_ids):
+        self.lane_ids = list(lane_ids)
+        self.shapes = []
+        for lane_id in self.lane_ids:
+            shape = network.lane_shape(lane_id)
+            if len(shape) < 2:
+                shape = np.array([[0.0, 0.0], [network.lanes[lane_id]['length'], 0.0]])
+            segments = np.hypot(*np.diff(shape, axis=0).T)
+            cumulative = np.concatenate([[0.0], np.cumsum(segments)])
+            angles = (90 - np.degrees(np.arctan2(*np.diff(shape, axis=0).T[::-1]))) % 360
+            self.shapes.append((shape, cumulative, angles, network.lanes[lane_id]['length']))
+
+    def locate(self, lane_codes, pos):
+        """车道编码和车道位置对应的 (x, y, angle)"""
+        x = np.empty(len(pos))
+        y = np.empty(len(pos))
+        angle = np.empty(len(pos))
+        for code, (shape, cumulative, angles, length) in enumerate(self.shapes):
+            rows = np.flatnonzero(lane_codes == code)
+            if not len(rows):
+                continue
+            # SUMO的车道长度与几何长度可能不同，按位置比例映射到几何形状上
+            s = np.clip(pos[rows] / max(length, 1e-9), 0, 1) * cumulative[-1]
+            x[rows] = np.interp(s, cumulative, shape[:, 0])
+            y[rows] = np.interp(s, cumulative, shape[:, 1])
+            segment = np.clip(np.searchsorted(cumulative, s, side='right') - 1, 0, len(angles) - 1)
+            angle[rows] = angles[segment]
+        return x, y, angle
+
+
+class SyntheticOutputGenerator:
+    """合成FCD和tripinfo输出
+
+    demand为流量倍数，seed为随机种子；step_length为仿真步长（秒）。
+    """
+
+    def __init__(self, net_file="highway.net.xml", route_file="highway-ramp.rou.xml",
+                 step_length=DEFAULT_STEP_LENGTH, demand=1.0, seed=1):
+        self.network = load_network_index(net_file)
+        self.vtypes, self.flows = load_demand(route_file)
+        if not self.flows:
+            raise ValueError(f"路径文件中没有车流定义: {route_file}")
+        self.step_length = step_length
+        self.demand = demand
+        self.rng = np.random.default_rng(seed)
+
+        lane_ids = [lane for flow in self.flows for edge in flow['edges']
+                    for lane in self.network.edges[edge]['lanes']]
+        self.geometry = _LaneGeometry(self.network, dict.fromkeys(lane_ids))
+        self._lane_code = {lane_id: code for code, lane_id in enumerate(self.geometry.lane_ids)}
+
+    def _rows_per_second(self):
+        """平均每秒仿真时间产生的FCD记录数（用于估计达到目标记录数所需的仿真时长）"""
+        total = 0.0
+        for flow in self.flows:
+            vtype = self.vtypes.get(flow['type'], {'maxSpeed': DEFAULT_MAX_SPEED})
+            travel_time = sum(self.network.edges[edge]['length']
+                              / min(vtype['maxSpeed'], self.network.edges[edge]['speed'])
+                              for edge in flow['edges'])
+            total += flow['vehsPerHour'] * self.demand / 3600 * travel_time / self.step_length
+        return total
+
+    def _vehicles(self, horizon):
+        """生成在 [0, horizon) 内出发的全部车辆，按出发时刻排序"""
+        max_edges = max(len(flow['edges']) for flow in self.flows)
+        columns = {key: [] for key in ('flow', 'index', 'depart')}
+        for code, flow in enumerate(self.flows):
+            # SUMO按vehsPerHour等间隔插入车辆
+            period = 3600 / (flow['vehsPerHour'] * self.demand)
+            departs = np.arange(self.rng.uniform(0, period), horizon, period)
+            columns['flow'].append(np.full(len(departs), code))
+            columns['index'].append(np.arange(len(departs)))
+            columns['depart'].append(departs)
+        flow_codes = np.concatenate(columns['flow'])
+        order = np.argsort(np.concatenate(columns['depart']), kind='stable')
+        flow_codes = flow_codes[order]
+        n = len(flow_codes)
+
+        # 出发时刻对齐到仿真步
+        depart_step = np.ceil(np.concatenate(columns['depart'])[order] / self.step_length).astype(np.int64)
+        speed_factor = np.clip(self.rng.normal(SPEED_FACTOR_MEAN, SPEED_FACTOR_DEV, n), *SPEED_FACTOR_RANGE)
+
+        # 各车在路径各路段上的长度、速度、进入时刻和车道
+        lengths = np.zeros((n, max_edges))
+        speeds = np.ones((n, max_edges))
+        lane_a = np.full((n, max_edges), -1)
+        lane_b = np.full((n, max_edges), -1)
+        for code, flow in enumerate(self.flows):
+            rows = np.flatnonzero(flow_codes == code)
+            vtype = self.vtypes.get(flow['type'], {'maxSpeed': DEFAULT_MAX_SPEED})
+            for k, edge in enumerate(flow['edges']):
+                info = self.network.edges[edge]
+                lengths[rows, k] = info['length']
+                speeds[rows, k] = np.minimum(vtype['maxSpeed'], info['speed']) * speed_factor[rows]
+                lanes = np.array([self._lane_code[lane] for lane in info['lanes']])
+                first = self.rng.integers(0, len(lanes), len(rows))
+                # 部分车辆换到相邻车道
+                change = (self.rng.random(len(rows)) < LANE_CHANGE_PROBABILITY) & (len(lanes) > 1)
+                second = np.where(change, np.clip(first + self.rng.choice([-1, 1], len(rows)), 0, len(lanes) - 1),
+                                  first)
+                lane_a[rows, k] = lanes[first]
+                lane_b[rows, k] = lanes[second]
+        travel = lengths / speeds
+        entry = depart_step[:, None] * self.step_length + np.concatenate(
+            [np.zeros((n, 1)), np.cumsum(travel, axis=1)[:, :-1]], axis=1)
+        arrival = depart_step * self.step_length + travel.sum(axis=1)
+
+        return {
+            'flow': flow_codes,
+            'index': np.concatenate(columns['index'])[order],
+            'depart_step': depart_step,
+            # 最后一条记录所在的仿真步（不含到达时刻）
+            'end_step': np.ceil(arrival / self.step_length - 1e-9).astype(np.int64),
+            'arrival': arrival,
+            'speed_factor': speed_factor,
+            'lengths': lengths,
+            'speeds': speeds,
+            'entry': entry,
+            'lane_a': lane_a,
+            'lane_b': lane_b,
+            'change_at': self.rng.uniform(0.2, 0.8, (n, max_edges)),
+            'n_edges': np.array([len(self.flows[code]['edges']) for code in flow_codes]),
+        }
+
+    def _states(self, vehicles, rows, steps):
+        """车辆在各仿真步的路段序号、车道编码、位置和速度"""
+        time = steps * self.step_length
+        entry = vehicles['entry'][rows]
+        n_edges = vehicles['n_edges'][rows]
+        edge = np.minimum((time[:, None] >= entry).sum(axis=1) - 1, n_edges - 1)
+        pick = (rows, edge)
+        length = vehicles['lengths'][pick]
+        pos = np.minimum((time - vehicles['entry'][pick]) * vehicles['speeds'][pick], length)
+        lane = np.where(pos < vehicles['change_at'][pick] * length, vehicles['lane_a'][pick],
+                        vehicles['lane_b'][pick])
+        return edge, lane, pos, vehicles['speeds'][pick]
+
+    def _vehicle_ids(self, vehicles, rows):
+        return [f"{self.flows[code]['id']}.{index}"
+                for code, index in zip(vehicles['flow'][rows], vehicles['index'][rows])]
+
+    def write(self, fcd_file, trip_file=None, target_rows=100000, chunk_steps=DEFAULT_CHUNK_STEPS):
+        """写出约target_rows条FCD记录（在时间步边界处截止）及截止前到达车辆的tripinfo
+
+        返回 {'rows', 'vehicles', 'trips', 'end_time'}
+        """
+        horizon = target_rows / max(self._rows_per_second(), 1e-9) * 1.2 + 60
+        vehicles = self._vehicles(horizon)
+        type_names = np.array([self.flows[code]['type'] for code in range(len(self.flows))], dtype=object)
+        lane_names = np.array(self.geometry.lane_ids, dtype=object)
+        depart_step = vehicles['depart_step']
+        end_step = vehicles['end_step']
+
+        rows_written = 0
+        step = 0
+        started = set()
+        with open(fcd_file, 'w', encoding='utf-8', newline='\n') as f:
+            f.write(_FCD_HEADER)
+            while rows_written < target_rows and step <= end_step.max():
+                last = step + chunk_steps
+                # 本块内在路网上的车辆
+                candidates = np.arange(np.searchsorted(depart_step, last, side='left'))
+                active = candidates[end_step[candidates] > step]
+                first_step = np.maximum(depart_step[active], step)
+                counts = np.maximum(np.minimum(end_step[active], last) - first_step, 0)
+                rows = np.repeat(active, counts)
+                steps = np.repeat(first_step, counts) + (
+                    np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts))
+                order = np.lexsort((rows, steps))
+                rows = rows[order]
+                steps = steps[order]
+
+                # 达到目标记录数时在时间步边界处截止
+                remaining = target_rows - rows_written
+                if len(rows) > remaining:
+                    cut_step = steps[remaining - 1]
+                    keep = steps <= cut_step
+                    rows, steps = rows[keep], steps[keep]
+                    last = cut_step + 1
+
+                self._write_chunk(f, vehicles, rows, steps, type_names, lane_names)
+                started.update(np.unique(rows).tolist())
+                rows_written += len(rows)
+                step = last
+            f.write(_FCD_FOOTER)
+
+        end_time = float(step * self.step_length)
+        trips = 0
+        if trip_file:
+            trips = self._write_trips(trip_file, vehicles, end_time, type_names, lane_names)
+        return {'rows': rows_written, 'vehicles': len(started), 'trips': trips, 'end_time': end_time}
+
+    def _write_chunk(self, f, vehicles, rows, steps, type_names, lane_names):
+        """按时间步写出一块FCD记录"""
+        if not len(rows):
+            return
+        edge, lane, pos, speed = self._states(vehicles, rows, steps)
+        x, y, angle = self.geometry.locate(lane, pos)
+        ids = self._vehicle_ids(vehicles, rows)
+        types = type_names[vehicles['flow'][rows]]
+        lanes = lane_names[lane]
+        lines = [f'        <vehicle id="{vid}" x="{xv:.2f}" y="{yv:.2f}" angle="{av:.2f}" type="{tv}" '
+                 f'speed="{sv:.2f}" pos="{pv:.2f}" lane="{lv}" slope="0.00"/>\n'
+                 for vid, xv, yv, av, tv, sv, pv, lv
+                 in zip(ids, x.tolist(), y.tolist(), angle.tolist(), types, speed.tolist(), pos.tolist(), lanes)]
+
+        boundaries = np.flatnonzero(np.diff(steps)) + 1
+        starts = np.concatenate([[0], boundaries])
+        stops = np.concatenate([boundaries, [len(steps)]])
+        for start, stop in zip(starts.tolist(), stops.tolist()):
+            f.write(f'    <timestep time="{steps[start] * self.step_length:.2f}">\n')
+            f.write(''.join(lines[start:stop]))
+            f.write('    </timestep>\n')
+
+    def _write_trips(self, trip_file, vehicles, end_time, type_names, lane_names):
+        """写出在end_time之前到达的车辆的tripinfo（按到达时刻排序）"""
+        arrived = np.flatnonzero(vehicles['arrival'] <= end_time)
+        arrived = arrived[np.argsort(vehicles['arrival'][arrived], kind='stable')]
+        ids = self._vehicle_ids(vehicles, arrived)
+        with open(trip_file, 'w', encoding='utf-8', newline='\n') as f:
+            f.write(_TRIP_HEADER)
+            for vid, row in zip(ids, arrived.tolist()):
+                n_edges = vehicles['n_edges'][row]
+                depart = vehicles['depart_step'][row] * self.step_length
+                arrival = vehicles['arrival'][row]
+                lengths = vehicles['lengths'][row, :n_edges]
+                speeds = vehicles['speeds'][row, :n_edges]
+                flow = self.flows[vehicles['flow'][row]]
+                limits = np.array([self.network.edges[edge]['speed'] for edge in flow['edges']])
+                duration = arrival - depart
+                time_loss = max(duration - float((lengths / limits).sum()), 0.0)
+                f.write(f'    <tripinfo id="{vid}" depart="{depart:.2f}" '
+                        f'departLane="{lane_names[vehicles["lane_a"][row, 0]]}" departPos="0.00" '
+                        f'departSpeed="{speeds[0]:.2f}" departDelay="0.00" arrival="{arrival:.2f}" '
+                        f'arrivalLane="{lane_names[vehicles["lane_b"][row, n_edges - 1]]}" '
+                        f'arrivalPos="{lengths[-1]:.2f}" arrivalSpeed="{speeds[-1]:.2f}" '
+                        f'duration="{duration:.2f}" routeLength="{lengths.sum():.2f}" waitingTime="0.00" '
+                        f'waitingCount="0" stopTime="0.00" timeLoss="{time_loss:.2f}" rerouteNo="0" '
+                        f'devices="tripinfo_{vid} fcd_{vid}" vType="{flow["type"]}" '
+                        f'speedFactor="{vehicles["speed_factor"][row]:.2f}" vaporized=""/>\n')
+            f.write(_TRIP_FOOTER)
+        return len(arrived)
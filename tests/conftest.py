@@ -0,0 +1,8 @@
+# -*- coding: utf-8 -*-
+"""测试公用设置：各模块位于仓库根目录"""
+
+import os
+import sys
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+"""用SUMO替身程序运行批量场景网格"""
+
+import json
+import os
+import sys
+import xml.etree.ElementTree as ET
+
+from batch_runner import BatchRunner, CONFIG_FILE, OUTPUT_FILES, scenario_grid
+from fcd_reader import read_fcd
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STUB_SUMO = os.path.join(REPO_DIR, "stub_sumo.py")
+
+
+def _route_file(directory):
+    config = ET.parse(os.path.join(directory, CONFIG_FILE)).getroot()
+    return config.find('input/route-files').get('value')
+
+
+def test_batch_grid_with_stub_sumo(tmp_path):
+    batch_dir = str(tmp_path / "batch_runs")
+    runner = BatchRunner(batch_dir=batch_dir, sumo_binary=[sys.executable, STUB_SUMO, "--stub-rows", "2000"],
+                         jobs=2, net_file=os.path.join(REPO_DIR, "highway.net.xml"),
+                         outputs=('fcd', 'tripinfo'), demand_dir=str(tmp_path / "demand_cache"))
+    scenarios = scenario_grid(demand_levels=(0.8, 1.2), seeds=(1, 2))
+    results = runner.run(scenarios)
+
+    assert [result['scenario'] for result in results] == [scenario.name for scenario in scenarios]
+    assert all(result['ok'] for result in results), [result['stderr'] for result in results]
+
+    # 每个场景在独立目录中运行，输出写在各自目录下
+    directories = {result['directory'] for result in results}
+    assert len(directories) == 4
+    for result in results:
+        assert os.path.dirname(result['directory']) == batch_dir
+        for kind in ('fcd', 'tripinfo'):
+            path = result['outputs'][kind]
+            assert path == os.path.join(result['directory'], OUTPUT_FILES[kind])
+            assert os.path.getsize(path) > 0
+    assert len(read_fcd(results[0]['outputs']['fcd']).to_dataframe()) > 0
+
+    # 同一需求的不同随机种子共用一个路径文件
+    route_files = {result['demand']: set() for result in results}
+    for result in results:
+        route_files[result['demand']].add(_route_file(result['directory']))
+    assert all(len(files) == 1 for files in route_files.values())
+    shared = [files.pop() for files in route_files.values()]
+    assert len(set(shared)) == 2
+    assert all(os.path.exists(path) and path.startswith(str(tmp_path / "demand_cache")) for path in shared)
+
+    with open(os.path.join(batch_dir, 'batch_results.json'), encoding='utf-8') as f:
+        summary = json.load(f)
+    assert summary['jobs'] == 2
+    assert [result['scenario'] for result in summary['results']] == [scenario.name for scenario in scenarios]
+    assert all(result['ok'] for result in summary['results'])
@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+"""FCD文件仍在写入时的内容结束位置"""
+
+import fcd_reader
+from fcd_reader import find_content_end, find_timestep_offsets, read_fcd
+
+_HEADER = b'<?xml version="1.0" encoding="UTF-8"?>\n<fcd-export>\n'
+_VEHICLE = b'        <vehicle id="v%d" x="0.00" y="0.00" angle="90.00" type="car" speed="20.00" pos="%d.00" lane="M1_0" slope="0.00"/>\n'
+
+
+def _timestep(time, n_vehicles, closed=True):
+    body = b''.join(_VEHICLE % (i, i) for i in range(n_vehicles))
+    return b'    <timestep time="%d.00">\n' % time + body + (b'    </timestep>\n' if closed else b'')
+
+
+def test_content_end_skips_timestep_larger_than_read_block(tmp_path, monkeypatch):
+    monkeypatch.setattr(fcd_reader, '_READ_BLOCK_SIZE', 1024)
+    complete = _HEADER + _timestep(0, 3)
+    path = tmp_path / "fcd.xml"
+    # 正在写入的时间步远大于读取块，尾部窗口内既没有开始标签也没有结束标签
+    path.write_bytes(complete + _timestep(1, 200, closed=False))
+
+    end = find_content_end(str(path))
+    assert end == complete.rindex(b'</timestep>') + len(b'</timestep>')
+    start, end = find_timestep_offsets(str(path), 1)
+    assert len(read_fcd(str(path), start=start, end=end).to_dataframe()) == 3
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+"""实时流式分析与批量分析的一致性"""
+
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from live_analysis import FCDReplaySimulation, StreamingTrafficAnalyzer
+from synthetic_outputs import SyntheticOutputGenerator
+from traffic_flow_analyzer import TrafficFlowAnalyzer
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+NET_FILE = os.path.join(REPO_DIR, "highway.net.xml")
+ROUTE_FILE = os.path.join(REPO_DIR, "highway-ramp.rou.xml")
+BIN_WIDTH = 10
+
+
+@pytest.fixture(scope="module")
+def batch_analyzer(tmp_path_factory):
+    """由合成轨迹文件批量计算交通流参数"""
+    fcd_file = str(tmp_path_factory.mktemp("live") / "vehicle_traces.xml")
+    SyntheticOutputGenerator(NET_FILE, ROUTE_FILE, seed=3).write(fcd_file, target_rows=20000)
+    analyzer = TrafficFlowAnalyzer(cache_dir=None)
+    analyzer.load_network(NET_FILE, ROUTE_FILE)
+    analyzer.analyze_fcd_data(fcd_file)
+    analyzer.calculate_traffic_parameters(bin_width=BIN_WIDTH)
+    return analyzer
+
+
+def _sorted(stats):
+    return stats.sort_values(['time_start', 'edge']).reset_index(drop=True)
+
+
+def test_replay_subscriptions(batch_analyzer):
+    fcd_df = batch_analyzer.data['fcd_data']
+    sim = FCDReplaySimulation(fcd_df)
+    sim.simulationStep()
+    first = set(fcd_df.loc[fcd_df['time'] == fcd_df['time'].min(), 'id'])
+    assert set(sim.simulation.getDepartedIDList()) == first
+    assert sim.vehicle.getAllSubscriptionResults() == {}
+    for vehicle_id in sim.simulation.getDepartedIDList():
+        sim.vehicle.subscribe(vehicle_id, ())
+    assert set(sim.vehicle.getAllSubscriptionResults()) == first
+
+    arrived = set()
+    while sim.simulation.getMinExpectedNumber() > 0:
+        sim.simulationStep()
+        arrived.update(sim.simulation.getArrivedIDList())
+    # 最后一步仍在路网上的车辆之外，其余车辆都已离开并取消订阅
+    assert arrived | set(sim.present) == set(fcd_df['id'])
+    assert not (sim.subscriptions & arrived)
+
+
+def test_live_windows_match_batch(batch_analyzer):
+    fcd_df = batch_analyzer.data['fcd_data']
+    live = TrafficFlowAnalyzer(cache_dir=None)
+    live.network = batch_analyzer.network
+    live.vehicle_types = batch_analyzer.vehicle_types
+    windows = []
+    live.analyze_live(sim=FCDReplaySimulation(fcd_df), bin_width=BIN_WIDTH,
+                      on_window=lambda start, end, stats: windows.append((start, end)))
+
+    assert windows == [(start, start + BIN_WIDTH) for start, _ in windows]
+    streamed = _sorted(pd.concat([stats for stats in live.data['window_stats'] if len(stats)]))
+    batch = _sorted(batch_analyzer.data['traffic_stats'])
+    assert len(streamed) == len(batch)
+    np.testing.assert_array_equal(streamed['time_start'], batch['time_start'])
+    assert (streamed['edge'].astype(str) == batch['edge'].astype(str)).all()
+    for column in ('volume', 'avg_speed', 'density'):
+        np.testing.assert_allclose(streamed[column].to_numpy(dtype=float),
+                                   batch[column].to_numpy(dtype=float), rtol=1e-9, err_msg=column)
+
+
+def test_streaming_aggregate_matches_batch(batch_analyzer):
+    sim = FCDReplaySimulation(batch_analyzer.data['fcd_data'])
+    stream = StreamingTrafficAnalyzer(sim, bin_width=BIN_WIDTH, network=batch_analyzer.network,
+                                      vehicle_lengths=batch_analyzer.vehicle_types.lengths)
+    aggregate = stream.run()
+    assert stream.n_rows == len(batch_analyzer.data['fcd_data'])
+    streamed = _sorted(aggregate.to_traffic_stats(batch_analyzer.network))
+    batch = _sorted(batch_analyzer.data['traffic_stats'])
+    for column in ('volume', 'avg_speed', 'density', 'occupancy'):
+        np.testing.assert_allclose(streamed[column].to_numpy(dtype=float),
+                                   batch[column].to_numpy(dtype=float), rtol=1e-9, err_msg=column)
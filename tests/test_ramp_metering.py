@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+"""匝道控制器、放行间隔和模拟仿真器的确定性"""
+
+import pytest
+
+from ramp_metering import (AlineaController, FixedRateController, MockMergeSimulation, RampMeter,
+                           compare_metering)
+
+STEP_LENGTH = 0.1
+
+
+def test_alinea_clamps_rate():
+    controller = AlineaController(target_occupancy=20.0, gain=70.0, min_rate=240.0, max_rate=1800.0,
+                                  initial_rate=900.0)
+    assert controller.update(25.0) == pytest.approx(900.0 - 70.0 * 5)
+    assert controller.update(100.0) == 240.0
+    assert controller.update(0.0) == pytest.approx(240.0 + 70.0 * 20)
+    assert controller.update(0.0) == 1800.0
+    assert controller.rate == 1800.0
+
+
+def test_alinea_without_occupancy_falls_back():
+    controller = AlineaController(initial_rate=600.0)
+    assert controller.update(None) is None
+    assert controller.rate == 600.0
+
+    # 没有检测器时每个控制周期都没有占有率，放行率取fallback
+    sim = MockMergeSimulation(end=300, seed=1)
+    meter = RampMeter(sim, controller, detectors=(), fallback=FixedRateController(500.0))
+    summary = meter.run()
+    assert summary['intervals'] > 0
+    assert summary['fallback_intervals'] == summary['intervals']
+    assert all(row['mode'] == 'fallback' and row['rate'] == 500.0 for row in meter.history)
+
+
+def _record_releases(meter):
+    """记录每次放行的时刻和放行前的排队车辆数"""
+    releases = []
+    vehicle = meter.sim.vehicle
+    resume, set_stop = vehicle.resume, vehicle.setStop
+
+    def record():
+        releases.append((meter.sim.simulation.getTime(), len(meter.queue) + 1))
+
+    def logged_resume(vehicle_id):
+        record()
+        resume(vehicle_id)
+
+    def logged_set_stop(vehicle_id, *args, duration=None, **kwargs):
+        if duration == 0:
+            record()
+        set_stop(vehicle_id, *args, duration=duration, **kwargs)
+
+    vehicle.resume = logged_resume
+    vehicle.setStop = logged_set_stop
+    return releases
+
+
+@pytest.mark.parametrize('ramp_rate', [120.0, 1500.0])
+def test_release_spacing_and_queue_override(ramp_rate):
+    rate, max_rate, max_queue = 240.0, 1800.0, 5
+    sim = MockMergeSimulation(ramp_rate=ramp_rate, end=600, seed=4)
+    meter = RampMeter(sim, FixedRateController(rate), max_queue=max_queue, max_rate=max_rate)
+    releases = _record_releases(meter)
+    meter.run()
+
+    assert len(releases) == meter.released > 1
+    gaps = []
+    for (time, queue), (next_time, _) in zip(releases, releases[1:]):
+        expected = 3600.0 / (max_rate if queue > max_queue else rate)
+        assert next_time - time >= expected - 1e-6
+        gaps.append((queue > max_queue, next_time - time))
+    overflowed = [gap for override, gap in gaps if override]
+    if ramp_rate > rate:
+        # 匝道需求超过放行率时排队超过上限，改按最大放行率放行
+        assert overflowed
+        assert min(overflowed) == pytest.approx(3600.0 / max_rate, abs=STEP_LENGTH + 1e-6)
+        assert meter.max_queue_seen > max_queue
+    else:
+        assert not overflowed
+
+
+def _deterministic(results):
+    """去掉与运行耗时有关的开销字段"""
+    return {mode: ({key: value for key, value in result['summary'].items() if not key.startswith('overhead')},
+                   result['history'])
+            for mode, result in results.items()}
+
+
+def test_compare_metering_is_deterministic():
+    first = compare_metering(sim_factory=lambda: MockMergeSimulation(seed=2))
+    second = compare_metering(sim_factory=lambda: MockMergeSimulation(seed=2))
+    assert set(first) == {'none', 'fixed', 'alinea'}
+    assert _deterministic(first) == _deterministic(second)
+    assert first['alinea']['summary']['released'] > 0
@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+"""用SUMO替身程序重复运行同一场景"""
+
+import json
+import os
+import sys
+
+from batch_runner import BatchRunner
+from seed_replication import ReplicationRunner
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 先运行替身程序，再把种子2的轨迹文件截断，模拟写到一半被终止的SUMO（退出码仍为0）
+_TRUNCATING_SUMO = '''
+import sys
+sys.path.insert(0, {repo_dir!r})
+import stub_sumo
+
+stub_sumo.main()
+options = stub_sumo.read_config(sys.argv[sys.argv.index("-c") + 1])
+if options.get("seed") == "2":
+    with open(options["fcd-output"], "r+b") as f:
+        f.truncate(f.seek(0, 2) // 2)
+'''
+
+
+def test_failed_seed_does_not_abort_replication(tmp_path):
+    sumo = tmp_path / "truncating_sumo.py"
+    sumo.write_text(_TRUNCATING_SUMO.format(repo_dir=REPO_DIR), encoding='utf-8')
+    batch_dir = str(tmp_path / "replication_runs")
+    runner = BatchRunner(batch_dir=batch_dir, sumo_binary=[sys.executable, str(sumo), "--stub-rows", "2000"],
+                         jobs=2, net_file=os.path.join(REPO_DIR, "highway.net.xml"),
+                         outputs=('fcd',), demand_dir=str(tmp_path / "demand_cache"))
+    summary = ReplicationRunner(runner, precision=0).run(seeds=(1, 2, 3))
+
+    with open(os.path.join(batch_dir, 'replication_results.json'), encoding='utf-8') as f:
+        assert json.load(f)['runs'] == summary['runs']
+    assert [run['seed'] for run in summary['runs']] == [1, 2, 3]
+    assert [run['ok'] for run in summary['runs']] == [True, False, True]
+    assert summary['runs'][1]['error']
+    assert summary['replications'] == 2
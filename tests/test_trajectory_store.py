@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+"""驶出路网的路段（主线末段和出口匝道）上的行程时间"""
+
+import os
+
+import numpy as np
+import pytest
+
+from synthetic_outputs import SyntheticOutputGenerator, DEFAULT_STEP_LENGTH
+from traffic_flow_analyzer import TrafficFlowAnalyzer
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+NET_FILE = os.path.join(REPO_DIR, "highway.net.xml")
+ROUTE_FILE = os.path.join(REPO_DIR, "highway-ramp.rou.xml")
+SINK_EDGES = ('M3', 'offr')
+
+
+@pytest.fixture(scope="module")
+def analyzer(tmp_path_factory):
+    directory = tmp_path_factory.mktemp("trajectories")
+    fcd_file, trip_file = str(directory / "vehicle_traces.xml"), str(directory / "trip_info.xml")
+    SyntheticOutputGenerator(NET_FILE, ROUTE_FILE, seed=5).write(fcd_file, trip_file, target_rows=30000)
+    analyzer = TrafficFlowAnalyzer(cache_dir=None)
+    analyzer.load_network(NET_FILE, ROUTE_FILE)
+    analyzer.analyze_fcd_data(fcd_file)
+    analyzer.analyze_trip_data(trip_file)
+    return analyzer
+
+
+def _complete(travel_times, edge):
+    runs = travel_times[travel_times['edge'] == edge]
+    return runs[runs['complete']].set_index('vehicle')
+
+
+def test_sink_edges_complete_at_lane_end(analyzer):
+    store = analyzer._trajectories()
+    arrivals = analyzer.data['trip_data'].set_index('id')['arrival']
+    by_lane_end = store.edge_travel_times(analyzer.network)
+    by_arrival = store.edge_travel_times(arrivals=arrivals)
+    for edge in SINK_EDGES:
+        runs = by_lane_end[by_lane_end['edge'] == edge]
+        assert len(runs) > 0
+        # 只有仿真结束时仍在路段上的车辆没有完整的行程时间
+        assert runs['complete'].mean() > 0.9, edge
+
+        # 驶过车道末端的估计与tripinfo到达时刻相差不到一个记录间隔
+        lane_end, arrived = _complete(by_lane_end, edge), _complete(by_arrival, edge)
+        assert set(lane_end.index) == set(arrived.index)
+        difference = lane_end['exit_time'] - arrived.loc[lane_end.index, 'exit_time']
+        assert np.all(np.abs(difference) <= DEFAULT_STEP_LENGTH + 1e-6)
+        speed = analyzer.network.edge_length(edge) / lane_end['travel_time']
+        assert 5 < speed.median() < 40
+
+
+def test_trajectory_summary_covers_sink_edges(analyzer):
+    summary = analyzer.analyze_trajectories()
+    for edge in SINK_EDGES:
+        assert summary[edge]['平均行程时间 (s)'] > 0
+        assert '换道次数' in summary[edge]
+    changes = analyzer.data['lane_changes']['edge'].unique()
+    assert set(changes) <= set(summary)
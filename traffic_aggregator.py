@@ -0,0 +1,440 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+交通流参数聚合引擎
+一次性将FCD记录映射为整数时间窗编码和路段编码，
+在单次分组计算中得到各时间窗、各路段的车流量、平均速度、密度和占有率；
+细粒度时间窗的累积结果可以直接汇总为更粗的统计间隔，无需重新扫描FCD
+"""
+
+import pandas as pd
+import numpy as np
+
+from analysis_defaults import DEFAULT_BIN_WIDTH, STANDARD_ROLLUP_WIDTHS
+
+# 缺少路网/车型信息时的简化计算参数：路段长度500m，单车道，车长5m
+DEFAULT_SEGMENT_LENGTH = 0.5  # km
+DEFAULT_LANE_COUNT = 1
+DEFAULT_VEHICLE_LENGTH = 0.005  # km
+
+TRAFFIC_STATS_COLUMNS = ['time_start', 'time_end', 'time_center', 'edge',
+                         'volume', 'avg_speed', 'density', 'occupancy']
+
+# 分块聚合时每块的最大记录数（块边界对齐到时间步）
+DEFAULT_AGGREGATION_CHUNK = 4 * 1024 * 1024
+
+# 去重位图的最大元素数，超过后改用哈希去重
+_BITMAP_LIMIT = 64 * 1024 * 1024
+
+_NEVER_SEEN = np.iinfo(np.int64).max
+
+
+def _factorize(values):
+    """返回整数编码和取值表；分类列直接复用其编码（不复制）"""
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        return values.array.codes, values.cat.categories
+    return pd.factorize(values)
+
+
+def _union_values(left, right):
+    """合并两个取值表，返回合并后的取值表及两侧编码到新编码的映射"""
+    identity = np.arange(len(left))
+    if left is right:
+        return left, identity, identity
+
+    right_array = np.asarray(right, dtype=object)
+    right_map = pd.Index(np.asarray(left, dtype=object)).get_indexer(right_array)
+    missing = right_map < 0
+    if not missing.any():
+        return left, identity, right_map
+
+    values = np.concatenate([np.asarray(left, dtype=object), right_array[missing]])
+    right_map[missing] = len(left) + np.arange(np.count_nonzero(missing))
+    return values, identity, right_map
+
+
+def _timestep_chunks(time, chunk_rows):
+    """将按时间排序的记录划分为不超过chunk_rows行的块，块边界对齐到时间步
+
+    同一时间步的记录总在同一块中，因此各块的时间步计数可以直接相加；
+    时间未排序时整体作为一块
+    """
+    n = len(time)
+    if not chunk_rows or n <= chunk_rows:
+        return [(0, n)]
+
+    bounds = [0]
+    while bounds[-1] < n:
+        start = bounds[-1]
+        stop = min(start + chunk_rows, n)
+        part = time[start:stop]
+        if np.any(part[1:] < part[:-1]) or (start and time[start] < time[start - 1]):
+            return [(0, n)]
+        if stop < n:
+            # 回退到该时间步的第一条记录
+            aligned = start + int(np.searchsorted(part, time[stop], side='left'))
+            stop = aligned if aligned > start else stop
+        bounds.append(stop)
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def _unique_pairs(group_codes, value_codes, n_groups, n_values):
+    """返回去重后的 (分组, 取值) 编码对"""
+    n_values = max(n_values, 1)
+    if n_groups * n_values <= _BITMAP_LIMIT:
+        seen = np.zeros(n_groups * n_values, dtype=bool)
+        seen[group_codes * n_values + value_codes] = True
+        pairs = np.flatnonzero(seen)
+    else:
+        pairs = pd.unique(group_codes * np.int64(n_values) + value_codes)
+    return np.divmod(pairs, n_values)
+
+
+def make_time_intervals(time, bin_width=DEFAULT_BIN_WIDTH, origin=0):
+    """按数据的时间范围生成等宽时间窗边界，保证最后一条记录也落在时间窗内"""
+    if bin_width <= 0:
+        raise ValueError(f"时间窗宽度必须为正数: {bin_width}")
+    t_max = np.max(time) if len(time) else origin
+    n_bins = max(int(np.floor((t_max - origin) / bin_width)) + 1, 1)
+    if origin + n_bins * bin_width <= t_max:
+        n_bins += 1
+    return origin + np.arange(n_bins + 1) * bin_width
+
+
+def _hourly_factor(widths):
+    """车辆数换算为小时车流量的系数；整除时保持整数"""
+    factors = 3600 / widths
+    if np.all(factors == np.round(factors)):
+        return np.round(factors).astype(np.int64)
+    return factors
+
+
+class TrafficAggregate:
+    """按时间窗和路段累积的部分统计量
+
+    记录数、速度和、车长和（m）与时间步数可以直接相加；唯一车辆数不可相加，
+    因此保留去重后的 (时间窗, 路段, 车辆) 出现记录，汇总到更粗的时间窗时重新去重。
+    各二维数组的形状为 (时间窗数, 路段数)。
+    """
+
+    def __init__(self, time_intervals, edge_values, vehicle_values,
+                 counts, speed_sums, length_sums, step_counts, first_seen,
+                 presence_bins, presence_edges, presence_vehicles, n_rows=0):
+        self.time_intervals = np.asarray(time_intervals)
+        self.edge_values = np.asarray(edge_values, dtype=object)
+        self.vehicle_values = vehicle_values
+        self.counts = counts
+        self.speed_sums = speed_sums
+        self.length_sums = length_sums
+        self.step_counts = step_counts
+        # 各分组首次出现的先后次序，用于保持输出中路段的排列顺序
+        self.first_seen = first_seen
+        self.presence_bins = presence_bins
+        self.presence_edges = presence_edges
+        self.presence_vehicles = presence_vehicles
+        # 参与统计的记录数，合并时用于保持首次出现次序
+        self.n_rows = n_rows
+
+    @property
+    def n_bins(self):
+        return len(self.time_intervals) - 1
+
+    @property
+    def n_edges(self):
+        return len(self.edge_values)
+
+    @property
+    def bin_width(self):
+        """等宽时间窗的宽度；非等宽时返回None"""
+        widths = np.diff(self.time_intervals)
+        if len(widths) and np.allclose(widths, widths[0]):
+            return widths[0]
+        return None
+
+    @classmethod
+    def from_fcd(cls, fcd_df, time_intervals=None, bin_width=DEFAULT_BIN_WIDTH, origin=0,
+                 vehicle_lengths=None, chunk_rows=DEFAULT_AGGREGATION_CHUNK):
+        """扫描一次FCD数据，构建时间窗累积量
+
+        time_intervals为None时按bin_width和数据时间范围自动生成等宽时间窗。
+        时间窗为 [time_intervals[i], time_intervals[i+1])，区间外的记录不参与统计。
+        vehicle_lengths为车辆ID数组到车长数组（m）的映射函数，
+        例如VehicleTypeIndex.lengths；为None时所有车辆按默认车长计算。
+        记录按时间步对齐分块聚合后合并，中间数组的内存占用与chunk_rows成正比。
+        """
+        time = fcd_df['time'].to_numpy() if len(fcd_df) else np.empty(0)
+        if time_intervals is None:
+            time_intervals = make_time_intervals(time, bin_width, origin)
+        time_intervals = np.asarray(time_intervals)
+
+        if len(fcd_df) == 0 or len(time_intervals) < 2:
+            return cls.empty(time_intervals)
+
+        edge_codes, edge_values = _factorize(fcd_df['edge'])
+        id_codes, id_values = _factorize(fcd_df['id'])
+        speed = fcd_df['speed'].to_numpy()
+        id_lengths = None
+        if vehicle_lengths is not None:
+            id_lengths = np.asarray(vehicle_lengths(np.asarray(id_values)), dtype=float)
+
+        aggregate = None
+        for start, stop in _timestep_chunks(time, chunk_rows):
+            part = cls._from_arrays(time_intervals, time[start:stop], edge_codes[start:stop],
+                                    edge_values, id_codes[start:stop], id_values,
+                                    speed[start:stop], id_lengths)
+            aggregate = part if aggregate is None else aggregate.merge(part)
+        return aggregate
+
+    @classmethod
+    def _from_arrays(cls, time_intervals, time, edge_codes, edge_values,
+                     id_codes, id_values, speed, id_lengths=None):
+        """由编码后的列数组构建累积量"""
+        n_windows = len(time_intervals) - 1
+        window_codes = np.searchsorted(time_intervals, time, side='right') - 1
+
+        valid = (window_codes >= 0) & (window_codes < n_windows) & (edge_codes >= 0)
+        if not valid.all():
+            window_codes = window_codes[valid]
+            edge_codes = edge_codes[valid]
+            id_codes = id_codes[valid]
+            time = time[valid]
+            speed = speed[valid]
+
+        window_codes = window_codes.astype(np.int64)
+        edge_codes = edge_codes.astype(np.int64)
+        id_codes = id_codes.astype(np.int64)
+        time_codes, time_values = pd.factorize(time)
+
+        # 时间窗与路段组合为单一分组编码
+        n_edges = len(edge_values)
+        n_groups = n_windows * n_edges
+        group_codes = window_codes * n_edges + edge_codes
+
+        counts = np.bincount(group_codes, minlength=n_groups)
+        speed_sums = np.bincount(group_codes, weights=speed, minlength=n_groups)
+        if id_lengths is None:
+            length_sums = counts * (DEFAULT_VEHICLE_LENGTH * 1000)
+        else:
+            length_sums = np.bincount(group_codes, weights=id_lengths[id_codes], minlength=n_groups)
+
+        # 每个时间步只属于一个时间窗，按(路段, 时间步)去重后再归入时间窗
+        step_edges, step_index = _unique_pairs(edge_codes, time_codes, n_edges, len(time_values))
+        step_windows = np.searchsorted(time_intervals, time_values, side='right') - 1
+        step_counts = np.bincount(step_windows[step_index] * n_edges + step_edges,
+                                  minlength=n_groups)
+
+        first_seen = np.full(n_groups, _NEVER_SEEN, dtype=np.int64)
+        seen_groups = pd.unique(group_codes)
+        first_seen[seen_groups] = np.arange(len(seen_groups), dtype=np.int64)
+
+        presence_groups, presence_vehicles = _unique_pairs(
+            group_codes, id_codes, n_groups, len(id_values))
+        presence_bins, presence_edges = np.divmod(presence_groups, n_edges)
+
+        shape = (n_windows, n_edges)
+        return cls(time_intervals, edge_values, id_values,
+                   counts.reshape(shape), speed_sums.reshape(shape),
+                   length_sums.reshape(shape), step_counts.reshape(shape), first_seen.reshape(shape),
+                   presence_bins, presence_edges, presence_vehicles, n_rows=len(time))
+
+    @classmethod
+    def empty(cls, time_intervals):
+        """不含任何记录的累积量"""
+        n_windows = max(len(time_intervals) - 1, 0)
+        none = np.empty(0, dtype=np.int64)
+        return cls(time_intervals, [], [],
+                   np.zeros((n_windows, 0), dtype=np.int64),
+                   np.zeros((n_windows, 0)),
+                   np.zeros((n_windows, 0)),
+                   np.zeros((n_windows, 0), dtype=np.int64),
+                   np.zeros((n_windows, 0), dtype=np.int64),
+                   none, none, none)
+
+    def merge(self, other):
+        """合并另一份累积量，返回新的累积量
+
+        两者的时间窗须起点和宽度相同（长度可以不同），且统计的时间步互不重叠，
+        例如按时间步边界切分的相邻数据块；路段和车辆编码不同时按取值重新编码。
+        other中各分组的出现次序排在self之后。
+        """
+        longer, shorter = sorted((self.time_intervals, other.time_intervals), key=len, reverse=True)
+        if not np.allclose(longer[:len(shorter)], shorter):
+            raise ValueError("只能合并时间窗起点和宽度相同的累积量")
+        time_intervals = longer
+        n_bins = len(time_intervals) - 1
+
+        edge_values, self_edges, other_edges = _union_values(self.edge_values, other.edge_values)
+        vehicle_values, self_vehicles, other_vehicles = _union_values(
+            self.vehicle_values, other.vehicle_values)
+        n_edges = len(edge_values)
+
+        def expand(aggregate, values, edge_map, fill):
+            out = np.full((n_bins, n_edges), fill, dtype=values.dtype)
+            out[:aggregate.n_bins, edge_map] = values
+            return out
+
+        other_first = np.where(other.first_seen == _NEVER_SEEN, _NEVER_SEEN,
+                               other.first_seen + self.n_rows)
+
+        presence_groups, presence_vehicles = _unique_pairs(
+            np.concatenate([self.presence_bins * n_edges + self_edges[self.presence_edges],
+                            other.presence_bins * n_edges + other_edges[other.presence_edges]]),
+            np.concatenate([self_vehicles[self.presence_vehicles],
+                            other_vehicles[other.presence_vehicles]]),
+            n_bins * n_edges, len(vehicle_values))
+        presence_bins, presence_edges = (np.divmod(presence_groups, n_edges) if n_edges
+                                         else (presence_groups, presence_groups))
+
+        return TrafficAggregate(
+            time_intervals, edge_values, vehicle_values,
+            expand(self, self.counts, self_edges, 0) + expand(other, other.counts, other_edges, 0),
+            expand(self, self.speed_sums, self_edges, 0) + expand(other, other.speed_sums, other_edges, 0),
+            expand(self, self.length_sums, self_edges, 0) + expand(other, other.length_sums, other_edges, 0),
+            expand(self, self.step_counts, self_edges, 0) + expand(other, other.step_counts, other_edges, 0),
+            np.minimum(expand(self, self.first_seen, self_edges, _NEVER_SEEN),
+                       expand(other, other_first, other_edges, _NEVER_SEEN)),
+            presence_bins, presence_edges, presence_vehicles,
+            n_rows=self.n_rows + other.n_rows)
+
+    def save(self, path):
+        """保存为.npz文件（不使用pickle），用于断点续算等场景"""
+        np.savez(path,
+                 time_intervals=self.time_intervals,
+                 edge_values=np.asarray(self.edge_values, dtype=str),
+                 vehicle_values=np.asarray(self.vehicle_values, dtype=str),
+                 counts=self.counts, speed_sums=self.speed_sums,
+                 length_sums=self.length_sums, step_counts=self.step_counts,
+                 first_seen=self.first_seen,
+                 presence_bins=self.presence_bins, presence_edges=self.presence_edges,
+                 presence_vehicles=self.presence_vehicles,
+                 n_rows=np.int64(self.n_rows))
+
+    @classmethod
+    def load(cls, path):
+        """加载save()保存的累积量"""
+        with np.load(path, allow_pickle=False) as data:
+            return cls(data['time_intervals'],
+                       data['edge_values'].astype(object),
+                       data['vehicle_values'].astype(object),
+                       data['counts'], data['speed_sums'], data['length_sums'],
+                       data['step_counts'], data['first_seen'],
+                       data['presence_bins'], data['presence_edges'], data['presence_vehicles'],
+                       n_rows=int(data['n_rows']))
+
+    def rollup(self, bin_width):
+        """将等宽细粒度时间窗汇总为宽度为bin_width的粗时间窗
+
+        bin_width必须是当前时间窗宽度的整数倍，汇总只使用已有累积量，不重新扫描FCD。
+        """
+        fine_width = self.bin_width
+        if fine_width is None:
+            raise ValueError("只有等宽时间窗可以汇总")
+        factor = bin_width / fine_width
+        if factor < 1 or not np.isclose(factor, round(factor)):
+            raise ValueError(f"汇总时间窗宽度 {bin_width} 必须是当前宽度 {fine_width} 的整数倍")
+        factor = int(round(factor))
+
+        n_coarse = -(-self.n_bins // factor)
+        time_intervals = self.time_intervals[0] + np.arange(n_coarse + 1) * bin_width
+        if self.n_edges == 0:
+            return TrafficAggregate.empty(time_intervals)
+
+        def combine(values, fill, reducer):
+            padded = np.full((n_coarse * factor, self.n_edges), fill, dtype=values.dtype)
+            padded[:self.n_bins] = values
+            return reducer(padded.reshape(n_coarse, factor, self.n_edges), axis=1)
+
+        presence_groups, presence_vehicles = _unique_pairs(
+            (self.presence_bins // factor) * self.n_edges + self.presence_edges,
+            self.presence_vehicles, n_coarse * self.n_edges, len(self.vehicle_values))
+        presence_bins, presence_edges = np.divmod(presence_groups, self.n_edges)
+
+        return TrafficAggregate(
+            time_intervals, self.edge_values, self.vehicle_values,
+            combine(self.counts, 0, np.sum),
+            combine(self.speed_sums, 0, np.sum),
+            combine(self.length_sums, 0, np.sum),
+            combine(self.step_counts, 0, np.sum),
+            combine(self.first_seen, _NEVER_SEEN, np.min),
+            presence_bins, presence_edges, presence_vehicles, n_rows=self.n_rows)
+
+    def vehicle_counts(self):
+        """各时间窗、各路段的唯一车辆数"""
+        flat = np.bincount(self.presence_bins * self.n_edges + self.presence_edges,
+                           minlength=self.n_bins * self.n_edges)
+        return flat.reshape(self.n_bins, self.n_edges)
+
+    def edge_geometry(self, network=None):
+        """各路段长度（km）和车道数；network为NetworkIndex，未知路段使用默认值"""
+        if network is None:
+            return (np.full(self.n_edges, DEFAULT_SEGMENT_LENGTH),
+                    np.full(self.n_edges, DEFAULT_LANE_COUNT, dtype=float))
+        lengths, lane_counts = network.edge_arrays(
+            self.edge_values, DEFAULT_SEGMENT_LENGTH * 1000, DEFAULT_LANE_COUNT)
+        return lengths / 1000, lane_counts
+
+    def speed_density(self, network=None):
+        """各时间窗、各路段的平均速度（km/h）和密度（veh/km）二维数组，没有车辆的分组为NaN"""
+        segment_length, _ = self.edge_geometry(network)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            speed = self.speed_sums / self.counts * 3.6
+            density = self.counts / self.step_counts / segment_length
+        empty = self.counts == 0
+        speed[empty] = np.nan
+        density[empty] = np.nan
+        return speed, density
+
+    def to_traffic_stats(self, network=None):
+        """转换为traffic_stats数据框
+
+        network为NetworkIndex时使用真实路段长度和车道数计算密度与占有率。
+        输出行按时间窗升序排列，同一时间窗内路段按其在该时间窗中首次出现的顺序排列。
+        """
+        windows, edges = np.nonzero(self.counts)
+        if len(windows) == 0:
+            return pd.DataFrame(columns=TRAFFIC_STATS_COLUMNS)
+
+        order = np.lexsort((self.first_seen[windows, edges], windows))
+        windows = windows[order]
+        edges = edges[order]
+
+        t_start = self.time_intervals[windows]
+        t_end = self.time_intervals[windows + 1]
+        steps = self.step_counts[windows, edges]
+        segment_length, lane_count = self.edge_geometry(network)
+        segment_length = segment_length[edges]
+
+        # 计算车流量（通过的唯一车辆数，转换为小时车流量）
+        volume = self.vehicle_counts()[windows, edges] * _hourly_factor(t_end - t_start)
+        # 平均速度（km/h）和密度（时段内路段上的平均车辆数 / 路段长度）
+        avg_speed, density = self.speed_density(network)
+        avg_speed = avg_speed[windows, edges]
+        density = density[windows, edges]
+        # 计算占有率（车辆平均占用长度 / 车道总长度），占有率不超过100%
+        avg_occupied = self.length_sums[windows, edges] / steps / 1000  # km
+        occupancy = (avg_occupied / (segment_length * lane_count[edges])) * 100
+
+        return pd.DataFrame({
+            'time_start': t_start,
+            'time_end': t_end,
+            'time_center': (t_start + t_end) / 2,
+            'edge': self.edge_values[edges],
+            'volume': volume,
+            'avg_speed': avg_speed,
+            'density': density,
+            'occupancy': np.minimum(occupancy, 100),
+        }, columns=TRAFFIC_STATS_COLUMNS)
+
+
+def aggregate_traffic_stats(fcd_df, time_intervals=None, bin_width=DEFAULT_BIN_WIDTH, origin=0,
+                            network=None, vehicle_lengths=None):
+    """按时间窗和路段聚合FCD数据，返回traffic_stats数据框"""
+    aggregate = TrafficAggregate.from_fcd(fcd_df, time_intervals=time_intervals,
+                                          bin_width=bin_width, origin=origin,
+                                          vehicle_lengths=vehicle_lengths)
+    return aggregate.to_traffic_stats(network)
+
+
+def rollup_traffic_stats(aggregate, bin_widths=STANDARD_ROLLUP_WIDTHS, network=None):
+    """由细粒度累积量生成多个统计间隔的traffic_stats，返回 {宽度: 数据框}"""
+    return {width: aggregate.rollup(width).to_traffic_stats(network) for width in bin_widths}
@@ -3,59 +3,234 @@
 """
 交通流数据分析器（基于FCD和Trip数据）
 提取断面车流量、占有率、车头时距、平均通行速度等数据
+
+可作为库导入：模块本身只依赖标准库，NumPy、pandas、matplotlib及各分析模块在对应方法首次调用时才导入，
+同一个TrafficFlowAnalyzer实例可以反复用于多次分析
 """
 
 import os
-import xml.etree.ElementTree as ET
-import pandas as pd
-import matplotlib.pyplot as plt
-import numpy as np
+import argparse
 from datetime import datetime
-import json
+
+from analysis_defaults import (DEFAULT_BIN_WIDTH, STANDARD_ROLLUP_WIDTHS, DEFAULT_CHUNK_SIZE,
+                               CACHE_DIR, FCD_EXPORT_FORMATS)
+from pipeline_metrics import PipelineInstrumentation, instrumented, PROFILERS
+
+# 分析流程用到的重量级依赖，load_dependencies()可提前导入
+HEAVY_MODULES = ('numpy', 'pandas', 'matplotlib.figure', 'traffic_aggregator', 'fcd_reader',
+                 'output_cache', 'cross_sections', 'virtual_detectors', 'summary_reader',
+                 'chart_renderer', 'report_export', 'network_index')
+
+def load_dependencies():
+    """导入分析流程的全部重量级依赖（例如在后台线程中预热，缩短首次分析的启动时间）"""
+    import importlib
+    for name in HEAVY_MODULES:
+        importlib.import_module(name)
 
 class TrafficFlowAnalyzer:
-    def __init__(self):
-        """初始化交通流分析器"""
+    def __init__(self, cache_dir=CACHE_DIR, profile=None):
+        """初始化交通流分析器
+
+        cache_dir为解析结果的列式缓存目录，为None时不使用缓存；紧凑列存储（analyze_fcd_data(compact=True)）
+        必须写在磁盘上，cache_dir为None时改为写入临时目录，reset()或分析器被回收时删除；
+        各分析阶段的用时和内存由instrumentation记录，profile为要启用的剖析工具（'cprofile'、'tracemalloc'）
+        """
         self.data = {}
         self.results = {}
-        
-        # 设置中文字体
-        plt.rcParams['font.sans-serif'] = ['SimHei', 'DejaVu Sans']
-        plt.rcParams['axes.unicode_minus'] = False
-        
-    def analyze_fcd_data(self, file_path="vehicle_traces.xml"):
-        """分析FCD数据：从车辆轨迹计算交通参数"""
+        self.network_results = {}
+        self.network = None
+        self.vehicle_types = None
+        self.detectors = None
+        self.cache_dir = cache_dir
+        self._cache = None
+        self._scratch = None
+        self.instrumentation = PipelineInstrumentation(profile=profile)
+    
+    @property
+    def cache(self):
+        """解析结果的列式缓存，首次使用时创建"""
+        if self._cache is None and self.cache_dir:
+            from output_cache import OutputCache
+            self._cache = OutputCache(self.cache_dir)
+        return self._cache
+    
+    def _scratch_cache(self):
+        """不使用缓存时存放紧凑列存储的临时目录，reset()或分析器被回收时删除"""
+        if self._scratch is None:
+            import shutil
+            import tempfile
+            import weakref
+            from output_cache import OutputCache
+            directory = tempfile.mkdtemp(prefix='fcd_store_')
+            self._scratch = (OutputCache(directory), weakref.finalize(self, shutil.rmtree, directory, True))
+        return self._scratch[0]
+    
+    def reset(self):
+        """清除上一次分析的数据、结果和计时记录，保留已加载的缓存；用于同一实例的下一次分析"""
+        self.data = {}
+        self.results = {}
+        self.network_results = {}
+        self.instrumentation.reset()
+        if self._scratch is not None:
+            self._scratch[1]()
+            self._scratch = None
+        
+    @instrumented()
+    def analyze_fcd_data(self, file_path="vehicle_traces.xml", chunk_size=DEFAULT_CHUNK_SIZE, compact=False):
+        """分析FCD数据：从车辆轨迹计算交通参数
+
+        compact为True时使用磁盘上的紧凑列存储（float32数值列、最小整数编码列），
+        fcd_data直接引用只读内存映射数组，适合全天轨迹等超出内存的大文件
+        """
         if not os.path.exists(file_path):
             print(f"文件不存在: {file_path}")
             return None
         
         print("正在分析车辆轨迹数据...")
-        
-        tree = ET.parse(file_path)
-        root = tree.getroot()
-        
-        fcd_data = []
-        for timestep in root.findall('timestep'):
-            time = float(timestep.get('time'))
-            
-            for vehicle in timestep.findall('vehicle'):
-                fcd_data.append({
-                    'time': time,
-                    'id': vehicle.get('id'),
-                    'lane': vehicle.get('lane'),
-                    'edge': vehicle.get('lane').split('_')[0] if '_' in vehicle.get('lane', '') else vehicle.get('lane'),
-                    'pos': float(vehicle.get('pos', 0)),
-                    'speed': float(vehicle.get('speed', 0)),
-                    'x': float(vehicle.get('x', 0)),
-                    'y': float(vehicle.get('y', 0))
-                })
-        
-        df = pd.DataFrame(fcd_data)
+        from fcd_reader import read_fcd
+        from fcd_store import FCDColumnStore
+        
+        def parse(path):
+            # 流式增量解析，按块写入列缓冲区，避免整棵XML树和逐行字典常驻内存
+            return read_fcd(path, chunk_size=chunk_size).to_dataframe()
+        
+        if compact:
+            store = FCDColumnStore.open_or_build(file_path, self.cache or self._scratch_cache(),
+                                                 chunk_size=chunk_size)
+            self.data['fcd_store'] = store
+            df = store.to_dataframe()
+        else:
+            df = self._load_output(file_path, 'fcd', parse)
         self.data['fcd_data'] = df
+        self.data['fcd_file'] = file_path
+        self.data.pop('track_index', None)
+        self.data.pop('trajectories', None)
         
+        self.instrumentation.annotate(rows=len(df))
         print(f"提取了 {len(df)} 条轨迹数据记录")
         return df
     
+    @instrumented()
+    def analyze_fcd_parallel(self, file_path="vehicle_traces.xml", workers=None,
+                             bin_width=DEFAULT_BIN_WIDTH, chunk_size=DEFAULT_CHUNK_SIZE):
+        """多进程分片分析FCD数据
+
+        按时间步边界把轨迹文件切分后在进程池中并行解析和聚合，
+        只在主进程保留合并后的时间窗累积量（宽度为bin_width）和文件开头的样本记录；
+        之后的calculate_traffic_parameters直接使用该累积量，结果与串行分析一致
+        """
+        if not os.path.exists(file_path):
+            print(f"文件不存在: {file_path}")
+            return None
+        
+        print("正在并行分析车辆轨迹数据...")
+        from fcd_parallel import aggregate_fcd_parallel
+        
+        vehicle_lengths = self.vehicle_types.lengths if self.vehicle_types else None
+        aggregate, n_rows, sample = aggregate_fcd_parallel(
+            file_path, workers=workers, bin_width=bin_width,
+            vehicle_lengths=vehicle_lengths, chunk_size=chunk_size)
+        self.data.pop('fcd_data', None)
+        self.data.pop('track_index', None)
+        self.data.pop('trajectories', None)
+        self.data['fcd_sample'] = sample
+        self.data['traffic_aggregate'] = aggregate
+        self.instrumentation.annotate(rows=int(n_rows))
+        
+        print(f"提取了 {n_rows} 条轨迹数据记录")
+        return aggregate
+    
+    @instrumented()
+    def analyze_fcd_incremental(self, file_path="vehicle_traces.xml", bin_width=DEFAULT_BIN_WIDTH,
+                                follow=False, is_running=None, poll_interval=1.0):
+        """基于检查点增量分析FCD数据
+
+        只解析上次分析之后追加的时间步并合并到已保存的时间窗累积量（宽度为bin_width），
+        检查点保存在报告目录中。follow为True时持续跟踪仍在写入的轨迹文件，
+        直到is_running()返回False或文件写完
+        """
+        if not os.path.exists(file_path) and not follow:
+            print(f"文件不存在: {file_path}")
+            return None
+        
+        print("正在增量分析车辆轨迹数据...")
+        from incremental_analysis import IncrementalFCDAnalyzer
+        
+        vehicle_lengths = self.vehicle_types.lengths if self.vehicle_types else None
+        incremental = IncrementalFCDAnalyzer(file_path, bin_width=bin_width,
+                                             vehicle_lengths=vehicle_lengths)
+        if follow:
+            def report(aggregate, new_df):
+                print(f"  已处理至 {new_df['time'].max():g}s，新增 {len(new_df)} 条记录")
+            incremental.follow(is_running=is_running, poll_interval=poll_interval, on_update=report)
+        else:
+            new_df = incremental.update()
+            print(f"新增 {0 if new_df is None else len(new_df)} 条轨迹数据记录")
+        
+        aggregate = incremental.aggregate
+        if aggregate is None:
+            print("没有可分析的轨迹数据")
+            return None
+        self.data.pop('fcd_data', None)
+        self.data.pop('track_index', None)
+        self.data.pop('trajectories', None)
+        self.data['traffic_aggregate'] = aggregate
+        self.instrumentation.annotate(rows=int(aggregate.n_rows))
+        
+        print(f"累计 {aggregate.n_rows} 条轨迹数据记录")
+        return aggregate
+    
+    @instrumented()
+    def analyze_live(self, sim=None, bin_width=DEFAULT_BIN_WIDTH, on_window=None, sumo_binary="sumo"):
+        """通过TraCI实时分析仿真，不写出轨迹文件
+
+        sim为已连接的traci模块或具有相同接口的模拟仿真器；为None时启动不带输出文件的SUMO。
+        每个时间窗结束时调用on_window(time_start, time_end, traffic_stats)；
+        结束后保存宽度为bin_width的时间窗累积量，供calculate_traffic_parameters使用
+        """
+        print("正在通过TraCI实时分析仿真...")
+        from live_analysis import StreamingTrafficAnalyzer, start_traci, sumo_command
+        
+        own_connection = sim is None
+        if own_connection:
+            sim = start_traci(sumo_command(sumo_binary))
+        vehicle_lengths = self.vehicle_types.lengths if self.vehicle_types else None
+        stream = StreamingTrafficAnalyzer(sim, bin_width=bin_width, network=self.network,
+                                          vehicle_lengths=vehicle_lengths, on_window=on_window)
+        try:
+            aggregate = stream.run()
+        finally:
+            if own_connection:
+                sim.close()
+        
+        self.data.pop('fcd_data', None)
+        self.data.pop('track_index', None)
+        self.data.pop('trajectories', None)
+        self.data['traffic_aggregate'] = aggregate
+        self.data['window_stats'] = stream.window_stats
+        self.instrumentation.annotate(rows=int(stream.n_rows))
+        
+        print(f"共处理 {stream.n_rows} 条车辆状态记录，{len(stream.window_stats)} 个时间窗")
+        return aggregate
+    
+    @instrumented()
+    def load_network(self, net_file="highway.net.xml", route_file="highway-ramp.rou.xml"):
+        """加载路网几何索引和车型定义，用于按真实路段长度、车道数和车长计算密度与占有率"""
+        from network_index import load_network_index, load_vehicle_types
+        
+        if os.path.exists(net_file):
+            self.network = load_network_index(net_file)
+            print(f"已加载路网索引: {len(self.network.edges)} 个路段, {len(self.network.lanes)} 条车道")
+        else:
+            print(f"文件不存在: {net_file}")
+        
+        if os.path.exists(route_file):
+            self.vehicle_types = load_vehicle_types(route_file)
+            print(f"已加载车型定义: {len(self.vehicle_types.vtypes)} 种车型")
+        else:
+            print(f"文件不存在: {route_file}")
+    
+    @instrumented()
     def analyze_trip_data(self, file_path="trip_info.xml"):
         """分析行程数据：车头时距"""
         if not os.path.exists(file_path):
@@ -64,22 +239,7 @@ class TrafficFlowAnalyzer:
         
         print("正在分析车辆行程数据...")
         
-        tree = ET.parse(file_path)
-        root = tree.getroot()
-        
-        trip_data = []
-        for vehicle in root.findall('vehicleinfo'):
-            trip_data.append({
-                'id': vehicle.get('id'),
-                'depart': float(vehicle.get('depart', 0)),
-                'arrival': float(vehicle.get('arrival', 0)),
-                'duration': float(vehicle.get('duration', 0)),
-                'routeLength': float(vehicle.get('routeLength', 0)),
-                'speed': float(vehicle.get('routeLength', 0)) / max(float(vehicle.get('duration', 1)), 0.1),
-                'vtype': vehicle.get('vType', 'unknown')
-            })
-        
-        df = pd.DataFrame(trip_data)
+        df = self._load_output(file_path, 'trip', self._parse_trip_file)
         
         # 计算车头时距
         if not df.empty:
@@ -88,68 +248,99 @@ class TrafficFlowAnalyzer:
             df_sorted['headway'] = df_sorted['headway'].fillna(0)
             
         self.data['trip_data'] = df_sorted if not df.empty else df
+        self.instrumentation.annotate(rows=len(df))
         
         print(f"提取了 {len(df)} 条车辆行程记录")
         return df
     
-    def calculate_traffic_parameters(self):
-        """从FCD数据计算交通流参数"""
-        print("正在计算交通流参数...")
+    @instrumented()
+    def analyze_summary_data(self, file_path="summary.xml", bin_width=DEFAULT_BIN_WIDTH):
+        """分析summary输出：路网在网车辆数、停驶车辆数、平均速度等时间序列
+
+        直接读取SUMO逐步写出的路网统计，不需要从FCD轨迹重新推算
+        """
+        if not os.path.exists(file_path):
+            print(f"文件不存在: {file_path}")
+            return None
         
-        if 'fcd_data' not in self.data:
-            print("缺少FCD数据")
-            return
+        print("正在分析路网汇总数据...")
+        import pandas as pd
+        from summary_reader import read_summary, network_time_series, network_summary
         
-        fcd_df = self.data['fcd_data']
+        df = self._load_output(file_path, 'summary', read_summary)
+        self.data['summary_data'] = df
+        self.data['network_series'] = network_time_series(df, bin_width)
+        self.network_results = network_summary(df)
+        self.instrumentation.annotate(rows=len(df))
         
-        # 按时间段和路段统计
-        time_intervals = np.arange(0, 1600, 60)  # 60秒间隔
+        print(f"提取了 {len(df)} 个仿真步的路网统计")
+        for name, value in self.network_results.items():
+            if not pd.isna(value):
+                print(f"  {name}: {value:.2f}")
+        return df
+    
+    @staticmethod
+    def _parse_trip_file(file_path):
+        """解析tripinfo输出文件"""
+        import xml.etree.ElementTree as ET
+        import pandas as pd
         
-        traffic_stats = []
+        trip_data = []
+        for _, vehicle in ET.iterparse(file_path, events=('end',)):
+            # SUMO的tripinfo输出使用<tripinfo>元素，兼容旧格式的<vehicleinfo>
+            if vehicle.tag not in ('tripinfo', 'vehicleinfo'):
+                continue
+            trip_data.append({
+                'id': vehicle.get('id'),
+                'depart': float(vehicle.get('depart', 0)),
+                'arrival': float(vehicle.get('arrival', 0)),
+                'duration': float(vehicle.get('duration', 0)),
+                'routeLength': float(vehicle.get('routeLength', 0)),
+                'speed': float(vehicle.get('routeLength', 0)) / max(float(vehicle.get('duration', 1)), 0.1),
+                'vtype': vehicle.get('vType', 'unknown')
+            })
+            vehicle.clear()
         
-        for i in range(len(time_intervals) - 1):
-            t_start = time_intervals[i]
-            t_end = time_intervals[i + 1]
-            
-            # 获取时间段内的数据
-            period_data = fcd_df[(fcd_df['time'] >= t_start) & (fcd_df['time'] < t_end)]
+        return pd.DataFrame(trip_data, columns=['id', 'depart', 'arrival', 'duration',
+                                                'routeLength', 'speed', 'vtype'])
+    
+    def _load_output(self, file_path, kind, parser):
+        """解析仿真输出文件，启用缓存时优先读取列式缓存"""
+        if self.cache is None:
+            return parser(file_path)
+        return self.cache.get_or_parse(file_path, kind, parser)
+    
+    @instrumented()
+    def calculate_traffic_parameters(self, bin_width=DEFAULT_BIN_WIDTH, base_width=None):
+        """从FCD数据计算交通流参数
+
+        bin_width为统计时间窗宽度（秒），统计时间范围由数据自动推断；
+        指定base_width时先按该细粒度时间窗聚合，之后的各统计间隔均由其汇总得到
+        """
+        print("正在计算交通流参数...")
+        import pandas as pd
+        from traffic_aggregator import TrafficAggregate
+        from virtual_detectors import edge_detector_summary
+        
+        if 'fcd_data' in self.data:
+            fcd_df = self.data['fcd_data']
+            self.instrumentation.annotate(rows=len(fcd_df))
             
-            if not period_data.empty:
-                # 按路段统计
-                for edge in period_data['edge'].unique():
-                    edge_data = period_data[period_data['edge'] == edge]
-                    
-                    if not edge_data.empty:
-                        # 计算车流量（通过的唯一车辆数）
-                        vehicle_count = len(edge_data['id'].unique())
-                        volume = vehicle_count * 60  # 转换为小时车流量
-                        
-                        # 计算平均速度
-                        avg_speed = edge_data['speed'].mean() * 3.6  # 转换为km/h
-                        
-                        # 计算密度（时段内路段上的平均车辆数）
-                        # 假设路段长度为500m
-                        segment_length = 0.5  # km
-                        avg_vehicles = len(edge_data) / len(edge_data['time'].unique()) if len(edge_data['time'].unique()) > 0 else 0
-                        density = avg_vehicles / segment_length
-                        
-                        # 计算占有率（简化计算）
-                        # 假设每辆车长5m，车道宽3.5m
-                        vehicle_length = 0.005  # km
-                        occupancy = (avg_vehicles * vehicle_length / segment_length) * 100
-                        
-                        traffic_stats.append({
-                            'time_start': t_start,
-                            'time_end': t_end,
-                            'time_center': (t_start + t_end) / 2,
-                            'edge': edge,
-                            'volume': volume,
-                            'avg_speed': avg_speed,
-                            'density': density,
-                            'occupancy': min(occupancy, 100)  # 占有率不超过100%
-                        })
-        
-        traffic_df = pd.DataFrame(traffic_stats)
+            # 按时间段和路段统计（单次分组聚合）
+            vehicle_lengths = self.vehicle_types.lengths if self.vehicle_types else None
+            aggregate = TrafficAggregate.from_fcd(fcd_df, bin_width=base_width or bin_width,
+                                                  vehicle_lengths=vehicle_lengths)
+            self.data['traffic_aggregate'] = aggregate
+        elif 'traffic_aggregate' in self.data:
+            # 并行分片分析已得到细粒度累积量
+            aggregate = self.data['traffic_aggregate']
+        else:
+            print("缺少FCD数据")
+            return
+        
+        if aggregate.bin_width != bin_width:
+            aggregate = aggregate.rollup(bin_width)
+        traffic_df = aggregate.to_traffic_stats(self.network)
         self.data['traffic_stats'] = traffic_df
         
         # 计算各路段的统计结果
@@ -166,8 +357,27 @@ class TrafficFlowAnalyzer:
                     '平均占有率 (%)': edge_data['occupancy'].mean()
                 }
         
-        # 添加车头时距
-        if 'trip_data' in self.data and not self.data['trip_data'].empty:
+        # 添加车头时距：各路段虚拟断面上按车道计算的车头时距
+        if 'fcd_data' in self.data:
+            edge_headways = self.calculate_headways()
+            for edge in results:
+                if edge in edge_headways:
+                    results[edge]['平均车头时距 (s)'] = edge_headways[edge]
+            
+            # 虚拟线圈检测器测得的断面流量、时间平均速度和占有率
+            self.analyze_detectors(self.detectors, bin_width=bin_width)
+            for edge, summary in edge_detector_summary(self.data['detector_stats']).items():
+                if edge in results:
+                    results[edge]['断面流量 (veh/h)'] = summary['mean_flow']
+                    results[edge]['断面时间平均速度 (km/h)'] = summary['speed']
+                    results[edge]['断面占有率 (%)'] = summary['occupancy']
+            
+            # 逐车轨迹：各路段的平均行程时间和换道次数
+            for edge, summary in self.analyze_trajectories().items():
+                if edge in results:
+                    results[edge].update(summary)
+        elif 'trip_data' in self.data and not self.data['trip_data'].empty:
+            # 没有保留轨迹数据（并行/实时/增量分析）时退回按出发时刻计算的全局车头时距
             trip_df = self.data['trip_data']
             avg_headway = trip_df['headway'][trip_df['headway'] > 0].mean()
             
@@ -184,8 +394,216 @@ class TrafficFlowAnalyzer:
                 if not pd.isna(value):
                     print(f"  {param}: {value:.2f}")
     
-    def generate_charts(self):
-        """生成交通流图表"""
+    @instrumented()
+    def calculate_headways(self, sections=None):
+        """计算各虚拟断面上按车道的车头时距和车间距，返回各路段的平均车头时距
+
+        sections为CrossSection列表，默认在每个路段的中点设置一个断面
+        """
+        if 'fcd_data' not in self.data:
+            print("缺少FCD数据")
+            return {}
+        from cross_sections import (default_sections, find_crossings, compute_headways,
+                                    headway_summary, edge_mean_headways)
+        
+        fcd_df = self.data['fcd_data']
+        if sections is None:
+            sections = default_sections(fcd_df, self.network)
+        vehicle_lengths = self.vehicle_types.lengths if self.vehicle_types else None
+        self.instrumentation.annotate(rows=len(fcd_df))
+        crossings = find_crossings(fcd_df, sections, index=self._track_index())
+        headways = compute_headways(crossings, vehicle_lengths)
+        self.data['headways'] = headways
+        self.data['headway_summary'] = headway_summary(headways)
+        return edge_mean_headways(headways)
+    
+    @instrumented()
+    def analyze_detectors(self, detectors=None, bin_width=DEFAULT_BIN_WIDTH):
+        """计算虚拟线圈检测器各时间窗的断面流量、时间平均速度和占有率
+
+        detectors为CrossSection列表或SUMO附加文件路径（inductionLoop/e1Detector定义），
+        默认在每条车道的中点设置一个检测器
+        """
+        if 'fcd_data' not in self.data:
+            print("缺少FCD数据")
+            return None
+        from virtual_detectors import VirtualDetectorEngine, load_detectors, lane_detectors
+        
+        fcd_df = self.data['fcd_data']
+        if detectors is None:
+            detectors = lane_detectors(fcd_df, self.network)
+        elif isinstance(detectors, str):
+            detectors = load_detectors(detectors, self.network)
+        vehicle_lengths = self.vehicle_types.lengths if self.vehicle_types else None
+        engine = VirtualDetectorEngine(fcd_df, vehicle_lengths, index=self._track_index())
+        detector_stats = engine.measure(detectors, bin_width=bin_width)
+        self.data['detector_stats'] = detector_stats
+        self.instrumentation.annotate(rows=len(fcd_df))
+        print(f"虚拟检测器: {len(detectors)} 个，{detector_stats['count'].sum()} 次车辆通过")
+        return detector_stats
+    
+    @instrumented()
+    def analyze_trajectories(self):
+        """逐车轨迹分析：各路段行程时间、换道事件、匝道汇入和分流位置
+
+        返回 {路段: {'平均行程时间 (s)', '换道次数'}}
+        """
+        if 'fcd_data' not in self.data:
+            print("缺少FCD数据")
+            return {}
+        
+        store = self._trajectories()
+        self.instrumentation.annotate(rows=len(store))
+        arrivals = None
+        if 'trip_data' in self.data and not self.data['trip_data'].empty:
+            arrivals = self.data['trip_data'].set_index('id')['arrival']
+        travel_times = store.edge_travel_times(self.network, arrivals)
+        lane_changes = store.lane_changes()
+        self.data['edge_travel_times'] = travel_times
+        self.data['lane_changes'] = lane_changes
+        self.data['merge_locations'] = store.merge_locations()
+        self.data['diverge_locations'] = store.diverge_locations()
+        
+        complete = travel_times[travel_times['complete']]
+        mean_travel = complete.groupby('edge', sort=False, observed=True)['travel_time'].mean()
+        change_counts = lane_changes.groupby('edge', sort=False, observed=True).size()
+        summary = {}
+        for edge in mean_travel.index.append(change_counts.index).unique():
+            summary[edge] = {}
+            if edge in mean_travel.index:
+                summary[edge]['平均行程时间 (s)'] = mean_travel[edge]
+            summary[edge]['换道次数'] = int(change_counts.get(edge, 0))
+        
+        print(f"轨迹存储: {store.n_vehicles} 辆车，{len(lane_changes)} 次换道")
+        for name in ('merge_locations', 'diverge_locations'):
+            positions = self.data[name]['pos'].dropna()
+            if len(positions):
+                label = '汇入' if name == 'merge_locations' else '分流'
+                print(f"  {label}位置: {len(positions)} 辆车，平均 {positions.mean():.1f}m，"
+                      f"中位数 {positions.median():.1f}m")
+        return summary
+    
+    @instrumented()
+    def analyze_corridor(self, file_path="vehicle_traces.xml", time_bin=None, space_bin=None,
+                         edges=None):
+        """主线走廊 (时间 × 空间) 速度和密度网格
+
+        已解析的轨迹数据在内存中时直接累积，否则单遍流式读取轨迹文件（并行、增量分析时），
+        不保留轨迹数据。edges为按行驶方向排列的主线路段，默认M1→M2→M3
+        """
+        import numpy as np
+        from corridor_heatmap import (CorridorGeometry, CorridorHeatmap, MAINLINE_CORRIDOR,
+                                      DEFAULT_TIME_BIN, DEFAULT_SPACE_BIN)
+        
+        if self.network is None:
+            print("缺少路网几何索引，无法生成走廊时空图")
+            return None
+        time_bin = time_bin or DEFAULT_TIME_BIN
+        space_bin = space_bin or DEFAULT_SPACE_BIN
+        geometry = CorridorGeometry.from_network(self.network, edges or MAINLINE_CORRIDOR)
+        
+        if 'fcd_data' in self.data:
+            heatmap = CorridorHeatmap.from_fcd(self.data['fcd_data'], geometry,
+                                               time_bin=time_bin, space_bin=space_bin)
+        elif os.path.exists(file_path):
+            print(f"正在流式读取 {file_path} 生成走廊时空图...")
+            heatmap = CorridorHeatmap.from_fcd_file(file_path, geometry,
+                                                    time_bin=time_bin, space_bin=space_bin)
+        else:
+            print(f"文件不存在: {file_path}")
+            return None
+        self.instrumentation.annotate(rows=heatmap.n_rows)
+        self.data['corridor_heatmap'] = heatmap
+        
+        speed = heatmap.speed()
+        if np.isfinite(speed).any():
+            slowest = np.unravel_index(np.nanargmin(speed), speed.shape)
+            distance = heatmap.space_edges[slowest[1]]
+            print(f"走廊时空图: {geometry.length:.0f}m × {heatmap.n_bins} 个时间窗，"
+                  f"最低速度 {speed[slowest]:.1f}km/h 出现在 "
+                  f"{heatmap.time_edges[slowest[0]]:g}s、距离 {distance:.0f}m "
+                  f"({geometry.edge_at(distance + space_bin / 2) or '交叉口'})")
+        return heatmap
+    
+    def _trajectories(self):
+        """按 (车辆, 时间) 排序的轨迹存储；启用缓存时与解析结果一起保存，之后直接内存映射打开"""
+        if 'trajectories' not in self.data:
+            from trajectory_store import TrajectoryStore
+            fcd_df = self.data['fcd_data']
+            fcd_file = self.data.get('fcd_file')
+            if self.cache is not None and fcd_file and os.path.exists(fcd_file):
+                store = TrajectoryStore.open_or_build(fcd_file, fcd_df, self.cache)
+            else:
+                store = TrajectoryStore.from_fcd(fcd_df)
+            self.data['trajectories'] = store
+        return self.data['trajectories']
+    
+    def _track_index(self):
+        """轨迹索引只构建一次，由轨迹存储直接得到（无需再次排序），车头时距和虚拟检测器共用"""
+        if 'track_index' not in self.data:
+            from cross_sections import TrackIndex
+            self.data['track_index'] = TrackIndex.from_trajectories(self._trajectories())
+        return self.data['track_index']
+    
+    @instrumented()
+    def calculate_rollups(self, bin_widths=STANDARD_ROLLUP_WIDTHS):
+        """由已计算的细粒度统计汇总出多个统计间隔的交通流参数"""
+        if 'traffic_aggregate' not in self.data:
+            print("缺少交通统计数据，请先计算交通流参数")
+            return None
+        from traffic_aggregator import rollup_traffic_stats
+        
+        rollups = rollup_traffic_stats(self.data['traffic_aggregate'], bin_widths, self.network)
+        self.data['traffic_rollups'] = rollups
+        
+        print(f"已生成 {len(rollups)} 个统计间隔的汇总: "
+              + ", ".join(f"{width}s" for width in rollups))
+        return rollups
+    
+    @instrumented()
+    def analyze_capacity(self, bin_width=DEFAULT_BIN_WIDTH, **options):
+        """通行能力与流量崩溃分析：各路段的基本图拟合、崩溃事件、崩溃前流量与排队消散流量
+
+        直接使用细粒度累积量汇总到bin_width，不重新读取轨迹；options传给CapacityAnalysis.analyze()
+        """
+        if 'traffic_aggregate' not in self.data:
+            print("缺少交通统计数据，请先计算交通流参数")
+            return None
+        import pandas as pd
+        from capacity_analysis import CapacityAnalysis, capacity_summary
+        
+        analysis = CapacityAnalysis.from_aggregate(self.data['traffic_aggregate'], self.network, bin_width)
+        fundamental_diagram, breakdowns = analysis.analyze(**options)
+        self.data['fundamental_diagram'] = fundamental_diagram
+        self.data['breakdown_events'] = breakdowns
+        
+        summary = capacity_summary(fundamental_diagram, breakdowns)
+        for row in summary.itertuples():
+            if row.edge not in self.results:
+                continue
+            self.results[row.edge]['通行能力 (veh/h)'] = row.capacity
+            self.results[row.edge]['流量崩溃次数'] = row.breakdowns
+            if row.breakdowns:
+                self.results[row.edge]['崩溃前流量 (veh/h)'] = row.pre_breakdown_flow
+                self.results[row.edge]['排队消散流量 (veh/h)'] = row.discharge_flow
+                self.results[row.edge]['通行能力下降 (%)'] = row.capacity_drop * 100
+        
+        print(f"\n=== 通行能力分析（{bin_width:g}s 时间窗）===")
+        for row in summary.itertuples():
+            line = f"路段 {row.edge}: 通行能力 {row.capacity:.0f} veh/h，流量崩溃 {row.breakdowns} 次"
+            if row.breakdowns and not pd.isna(row.capacity_drop):
+                line += (f"，崩溃前流量 {row.pre_breakdown_flow:.0f} veh/h，"
+                         f"排队消散流量 {row.discharge_flow:.0f} veh/h（下降 {row.capacity_drop:.1%}）")
+            print(line)
+        return summary
+    
+    @instrumented()
+    def generate_charts(self, quality='full', workers=1):
+        """生成交通流图表
+
+        quality为'full'时输出300dpi的正式图表，'draft'时输出低分辨率草稿以便快速查看；
+        workers大于1时各图表在独立进程中并行渲染
+        """
         print("正在生成交通流图表...")
         
         if 'traffic_stats' not in self.data:
@@ -203,171 +621,60 @@ class TrafficFlowAnalyzer:
         if traffic_df.empty:
             print("没有交通数据可用于生成图表")
             return
-        
-        # 1. 交通流参数时变图 - 优化为2x3布局
-        plt.figure(figsize=(15, 10))
-        
-        # 车流量时变图
-        plt.subplot(2, 3, 1)
-        for edge in traffic_df['edge'].unique():
-            edge_data = traffic_df[traffic_df['edge'] == edge]
-            plt.plot(edge_data['time_center'], edge_data['volume'], 
-                    marker='o', markersize=4, label=f'{edge}', linewidth=2)
-        plt.title('车流量时变图', fontsize=14, fontweight='bold')
-        plt.xlabel('时间 (s)')
-        plt.ylabel('车流量 (veh/h)')
-        plt.legend()
-        plt.grid(True, alpha=0.3)
-        
-        # 速度时变图
-        plt.subplot(2, 3, 2)
-        for edge in traffic_df['edge'].unique():
-            edge_data = traffic_df[traffic_df['edge'] == edge]
-            plt.plot(edge_data['time_center'], edge_data['avg_speed'], 
-                    marker='s', markersize=4, label=f'{edge}', linewidth=2)
-        plt.title('平均速度时变图', fontsize=14, fontweight='bold')
-        plt.xlabel('时间 (s)')
-        plt.ylabel('速度 (km/h)')
-        plt.legend()
-        plt.grid(True, alpha=0.3)
-        
-        # 密度时变图
-        plt.subplot(2, 3, 3)
-        for edge in traffic_df['edge'].unique():
-            edge_data = traffic_df[traffic_df['edge'] == edge]
-            plt.plot(edge_data['time_center'], edge_data['density'], 
-                    marker='^', markersize=4, label=f'{edge}', linewidth=2)
-        plt.title('密度时变图', fontsize=14, fontweight='bold')
-        plt.xlabel('时间 (s)')
-        plt.ylabel('密度 (veh/km)')
-        plt.legend()
-        plt.grid(True, alpha=0.3)
-        
-        # 占有率时变图
-        plt.subplot(2, 3, 4)
-        for edge in traffic_df['edge'].unique():
-            edge_data = traffic_df[traffic_df['edge'] == edge]
-            plt.plot(edge_data['time_center'], edge_data['occupancy'], 
-                    marker='d', markersize=4, label=f'{edge}', linewidth=2)
-        plt.title('占有率时变图', fontsize=14, fontweight='bold')
-        plt.xlabel('时间 (s)')
-        plt.ylabel('占有率 (%)')
-        plt.legend()
-        plt.grid(True, alpha=0.3)
-        
-        # 速度-密度关系图
-        plt.subplot(2, 3, 5)
-        for edge in traffic_df['edge'].unique():
-            edge_data = traffic_df[traffic_df['edge'] == edge]
-            plt.scatter(edge_data['density'], edge_data['avg_speed'], 
-                       alpha=0.7, s=50, label=f'{edge}')
-        plt.title('速度-密度关系图', fontsize=14, fontweight='bold')
-        plt.xlabel('密度 (veh/km)')
-        plt.ylabel('速度 (km/h)')
-        plt.legend()
-        plt.grid(True, alpha=0.3)
-        
-        # 交通流效率分析图
-        plt.subplot(2, 3, 6)
-        # 计算各路段的流量-密度关系
-        edge_efficiency = {}
-        for edge in traffic_df['edge'].unique():
-            edge_data = traffic_df[traffic_df['edge'] == edge]
-            avg_volume = edge_data['volume'].mean()
-            avg_density = edge_data['density'].mean()
-            efficiency = avg_volume / max(avg_density, 0.1)  # 避免除零
-            edge_efficiency[edge] = efficiency
-        
-        edges = list(edge_efficiency.keys())
-        efficiencies = list(edge_efficiency.values())
-        colors = ['#1f77b4', '#ff7f0e', '#2ca02c', '#d62728', '#9467bd'][:len(edges)]
-        
-        bars = plt.bar(edges, efficiencies, color=colors, alpha=0.7, edgecolor='black')
-        plt.title('各路段交通效率对比', fontsize=14, fontweight='bold')
-        plt.xlabel('路段')
-        plt.ylabel('效率 (veh/h)/(veh/km)')
-        plt.xticks(rotation=45)
-        plt.grid(True, alpha=0.3, axis='y')
-        
-        # 在柱状图上添加数值标签
-        for bar, efficiency in zip(bars, efficiencies):
-            plt.text(bar.get_x() + bar.get_width()/2, bar.get_height() + max(efficiencies)*0.01, 
-                    f'{efficiency:.1f}', ha='center', va='bottom', fontweight='bold')
-        
-        plt.tight_layout()
-        chart_path = os.path.join(report_dir, f'traffic_flow_analysis_{timestamp}.png')
-        plt.savefig(chart_path, dpi=300, bbox_inches='tight')
-        plt.close()
-        
+        import numpy as np
+        from chart_renderer import ChartRenderer, group_by_edge
+        
+        # 按路段只分组一次，各图表共用
+        edge_series = group_by_edge(traffic_df)
+        renderer = ChartRenderer(report_dir, quality=quality, workers=workers)
+        
+        # 1. 交通流参数时变图 - 2x3布局
+        chart_path = renderer.add('traffic', f'traffic_flow_analysis_{timestamp}.png', edge_series)
+        
+        # 2. 分路段对比图
+        edge_means = {column: {edge: round(float(np.mean(edge_series[edge][column])), 2)
+                               for edge in sorted(edge_series)}
+                      for column in ('volume', 'avg_speed', 'density', 'occupancy')}
+        comparison_path = renderer.add('comparison', f'edge_comparison_{timestamp}.png', edge_means)
+        
+        # 3. 主线走廊时空图
+        corridor_path = None
+        if 'corridor_heatmap' in self.data and self.data['corridor_heatmap'].n_bins:
+            corridor_path = renderer.add('corridor', f'corridor_heatmap_{timestamp}.png',
+                                         self.data['corridor_heatmap'].chart_data())
+        
+        # 4. 路网时间序列图（summary输出）
+        network_path = None
+        if 'summary_data' in self.data and not self.data['summary_data'].empty:
+            summary_df = self.data['summary_data']
+            summary_series = {column: summary_df[column].to_numpy()
+                              for column in ('time', 'running', 'halting', 'meanWaitingTime')}
+            network_series = {column: values.to_numpy()
+                              for column, values in self.data['network_series'].items()}
+            network_path = renderer.add('network', f'network_summary_{timestamp}.png',
+                                        summary_series, network_series)
+        
+        renderer.render()
         print(f"交通流图表已保存: {chart_path}")
-        
-        # 生成分路段对比图
-        self._generate_comparison_charts(report_dir, timestamp)
+        print(f"路段对比图表已保存: {comparison_path}")
+        if corridor_path:
+            print(f"走廊时空图已保存: {corridor_path}")
+        if network_path:
+            print(f"路网时间序列图表已保存: {network_path}")
         
         return chart_path
     
-    def _generate_comparison_charts(self, report_dir, timestamp):
-        """生成分路段对比图表"""
-        if 'traffic_stats' not in self.data or self.data['traffic_stats'].empty:
-            return
-        
-        traffic_df = self.data['traffic_stats']
-        
-        # 计算各路段的平均值
-        edge_summary = traffic_df.groupby('edge').agg({
-            'volume': 'mean',
-            'avg_speed': 'mean',
-            'density': 'mean',
-            'occupancy': 'mean'
-        }).round(2)
-        
-        plt.figure(figsize=(15, 8))
-        
-        # 1. 平均车流量对比
-        plt.subplot(2, 2, 1)
-        bars1 = edge_summary['volume'].plot(kind='bar', color='lightblue', alpha=0.8)
-        plt.title('各路段平均车流量对比', fontsize=14, fontweight='bold')
-        plt.xlabel('路段')
-        plt.ylabel('车流量 (veh/h)')
-        plt.xticks(rotation=45)
-        plt.grid(True, alpha=0.3)
-        
-        # 2. 平均速度对比
-        plt.subplot(2, 2, 2)
-        bars2 = edge_summary['avg_speed'].plot(kind='bar', color='lightgreen', alpha=0.8)
-        plt.title('各路段平均速度对比', fontsize=14, fontweight='bold')
-        plt.xlabel('路段')
-        plt.ylabel('速度 (km/h)')
-        plt.xticks(rotation=45)
-        plt.grid(True, alpha=0.3)
-        
-        # 3. 平均密度对比
-        plt.subplot(2, 2, 3)
-        bars3 = edge_summary['density'].plot(kind='bar', color='lightcoral', alpha=0.8)
-        plt.title('各路段平均密度对比', fontsize=14, fontweight='bold')
-        plt.xlabel('路段')
-        plt.ylabel('密度 (veh/km)')
-        plt.xticks(rotation=45)
-        plt.grid(True, alpha=0.3)
-        
-        # 4. 平均占有率对比
-        plt.subplot(2, 2, 4)
-        bars4 = edge_summary['occupancy'].plot(kind='bar', color='lightyellow', alpha=0.8)
-        plt.title('各路段平均占有率对比', fontsize=14, fontweight='bold')
-        plt.xlabel('路段')
-        plt.ylabel('占有率 (%)')
-        plt.xticks(rotation=45)
-        plt.grid(True, alpha=0.3)
-        
-        plt.tight_layout()
-        comparison_path = os.path.join(report_dir, f'edge_comparison_{timestamp}.png')
-        plt.savefig(comparison_path, dpi=300, bbox_inches='tight')
-        plt.close()
+    @instrumented()
+    def save_results(self, fcd_format=None):
+        """保存分析结果
+
+        Excel报表以只写模式按块写出；fcd_format为'csv'或'parquet'时另外导出完整的FCD数据
+        （gzip压缩的CSV或Parquet），Excel中只保留轨迹数据样本
+        """
+        import pandas as pd
+        from fcd_parallel import SAMPLE_ROWS
+        from report_export import StreamingWorkbook, save_json, export_fcd
         
-        print(f"路段对比图表已保存: {comparison_path}")
-    
-    def save_results(self):
-        """保存分析结果"""
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
         
         # 确保报告目录存在
@@ -377,69 +684,191 @@ class TrafficFlowAnalyzer:
         
         # 保存为JSON格式
         json_file = os.path.join(report_dir, f"traffic_flow_results_{timestamp}.json")
-        with open(json_file, 'w', encoding='utf-8') as f:
-            json.dump(self.results, f, indent=2, ensure_ascii=False)
+        save_json(self.results, json_file)
         
         print(f"分析结果已保存: {json_file}")
         
+        if self.network_results:
+            network_file = os.path.join(report_dir, f"network_summary_{timestamp}.json")
+            save_json(self.network_results, network_file)
+            print(f"路网汇总已保存: {network_file}")
+        
         # 保存为Excel格式
         try:
             excel_file = os.path.join(report_dir, f"traffic_flow_data_{timestamp}.xlsx")
-            with pd.ExcelWriter(excel_file, engine='openpyxl') as writer:
+            with StreamingWorkbook(excel_file) as workbook:
                 if 'traffic_stats' in self.data:
-                    self.data['traffic_stats'].to_excel(writer, sheet_name='交通流统计', index=False)
+                    workbook.write_frame(self.data['traffic_stats'], '交通流统计')
+                for width, rollup_df in self.data.get('traffic_rollups', {}).items():
+                    workbook.write_frame(rollup_df, f'交通流统计_{width}s')
+                if 'headway_summary' in self.data:
+                    workbook.write_frame(self.data['headway_summary'], '车头时距')
+                if 'detector_stats' in self.data:
+                    workbook.write_frame(self.data['detector_stats'], '虚拟检测器')
+                if 'fundamental_diagram' in self.data:
+                    workbook.write_frame(self.data['fundamental_diagram'], '基本图拟合')
+                    workbook.write_frame(self.data['breakdown_events'], '流量崩溃事件')
+                if 'corridor_heatmap' in self.data:
+                    workbook.write_frame(self.data['corridor_heatmap'].to_frame(), '走廊时空图')
+                if 'edge_travel_times' in self.data:
+                    workbook.write_frame(self.data['edge_travel_times'], '路段行程时间')
+                    workbook.write_frame(self.data['lane_changes'], '换道事件')
+                    workbook.write_frame(self.data['merge_locations'], '匝道汇入')
+                    workbook.write_frame(self.data['diverge_locations'], '匝道分流')
                 if 'fcd_data' in self.data:
-                    # 只保存前1000行FCD数据（数据量较大）
-                    sample_fcd = self.data['fcd_data'].head(1000)
-                    sample_fcd.to_excel(writer, sheet_name='轨迹数据样本', index=False)
+                    # Excel中只保存前1000行FCD数据，完整数据通过fcd_format导出
+                    workbook.write_frame(self.data['fcd_data'].head(SAMPLE_ROWS), '轨迹数据样本')
+                elif self.data.get('fcd_sample') is not None:
+                    workbook.write_frame(self.data['fcd_sample'], '轨迹数据样本')
                 if 'trip_data' in self.data:
-                    self.data['trip_data'].to_excel(writer, sheet_name='行程数据', index=False)
+                    workbook.write_frame(self.data['trip_data'], '行程数据')
+                if 'network_series' in self.data:
+                    workbook.write_frame(self.data['network_series'], '路网时间序列')
                 
                 # 结果汇总
                 if self.results:
-                    results_df = pd.DataFrame(self.results).T
-                    results_df.to_excel(writer, sheet_name='结果汇总')
+                    workbook.write_frame(pd.DataFrame(self.results).T, '结果汇总', index=True)
+                if self.network_results:
+                    network_df = pd.Series(self.network_results, name='值').to_frame()
+                    workbook.write_frame(network_df, '路网汇总', index=True)
             
             print(f"数据表格已保存: {excel_file}")
         except ImportError:
             print("警告: 无法保存Excel文件，请安装openpyxl")
+        
+        # 导出完整FCD数据
+        if fcd_format and 'fcd_data' in self.data:
+            try:
+                fcd_file = export_fcd(self.data['fcd_data'],
+                                      os.path.join(report_dir, f"vehicle_traces_{timestamp}"), fcd_format)
+                print(f"完整轨迹数据已保存: {fcd_file}（{len(self.data['fcd_data'])} 条记录）")
+            except ImportError:
+                print("警告: 无法导出Parquet文件，请安装pyarrow")
+    
+    def save_timing_report(self, report_dir="traffic_flow_reports"):
+        """保存各分析阶段的计时报告（JSON），启用cProfile时同时保存各阶段的.prof文件"""
+        if not self.instrumentation.records:
+            return None
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        report_file = self.instrumentation.save(report_dir, timestamp)
+        
+        print(f"阶段计时报告已保存: {report_file}")
+        for stage, metrics in self.instrumentation.summary().items():
+            print(f"  {stage}: {metrics['seconds']:.2f}s，峰值内存 {metrics['peak_rss_mb']:.0f}MB")
+        return report_file
+
+def parse_args(argv=None):
+    """解析命令行参数"""
+    parser = argparse.ArgumentParser(description="交通流数据分析器")
+    parser.add_argument('--compact', action='store_true',
+                        help="使用内存映射的紧凑FCD列存储（适合超大轨迹文件）")
+    parser.add_argument('--live', action='store_true',
+                        help="通过TraCI实时分析仿真，不写出vehicle_traces.xml")
+    parser.add_argument('--incremental', action='store_true',
+                        help="增量分析：只处理上次分析之后追加的轨迹数据")
+    parser.add_argument('--follow', action='store_true',
+                        help="仿真运行的同时跟踪正在写入的轨迹文件（隐含--incremental）")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="FCD分片并行分析的进程数，大于1时按时间步切分轨迹文件并行解析和聚合")
+    parser.add_argument('--draft-charts', action='store_true',
+                        help="以低分辨率草稿模式快速生成图表（正式报告请使用默认的全质量输出）")
+    parser.add_argument('--chart-workers', type=int, default=1,
+                        help="并行渲染图表的进程数")
+    parser.add_argument('--export-fcd', choices=sorted(FCD_EXPORT_FORMATS), default=None,
+                        help="导出完整FCD数据（csv为gzip压缩的CSV，parquet需要pyarrow）")
+    parser.add_argument('--detectors', default=None,
+                        help="虚拟线圈检测器定义文件（SUMO附加文件中的inductionLoop），默认每条车道中点一个")
+    parser.add_argument('--profile', action='append', choices=PROFILERS, default=None,
+                        help="对各分析阶段运行剖析工具（可重复指定），结果写入阶段计时报告")
+    return parser.parse_args(argv)
+
+def print_window(time_start, time_end, traffic_stats):
+    """实时分析时输出刚结束的时间窗结果"""
+    if traffic_stats.empty:
+        print(f"  时间窗 [{time_start:g}, {time_end:g}) s: 无车辆")
+        return
+    print(f"  时间窗 [{time_start:g}, {time_end:g}) s: "
+          + ", ".join(f"{row.edge} {row.avg_speed:.1f}km/h" for row in traffic_stats.itertuples()))
 
-def main():
+def main(argv=None):
     """主函数"""
+    args = parse_args(argv)
     print("=== 交通流数据分析器 ===")
     
-    # 首先运行仿真生成数据
-    print("1. 运行仿真生成数据...")
-    try:
-        import subprocess
-        result = subprocess.run([
-            "sumo", 
-            "-c", "highway-ramp-analysis.sumocfg"
-        ], capture_output=True, text=True, timeout=120)
-        
-        if result.returncode == 0:
-            print("仿真运行成功，开始分析数据...")
-        else:
-            print("仿真运行失败:")
-            print(result.stderr)
-            return
-    except Exception as e:
-        print(f"运行仿真时出错: {e}")
-        return
+    analyzer = TrafficFlowAnalyzer(profile=args.profile)
+    analyzer.detectors = args.detectors
+    base_width = 10  # 细粒度统计时间窗（秒），各报表间隔由其汇总
     
-    # 分析数据
-    analyzer = TrafficFlowAnalyzer()
-    
-    print("\n2. 分析交通流数据...")
-    analyzer.analyze_fcd_data()
-    analyzer.analyze_trip_data()
-    analyzer.calculate_traffic_parameters()
+    if args.live:
+        print("1. 实时运行仿真并分析交通流数据...")
+        analyzer.load_network()
+        try:
+            analyzer.analyze_live(bin_width=base_width, on_window=print_window)
+        except Exception as e:
+            print(f"运行仿真时出错: {e}")
+            return
+    elif args.follow:
+        print("1. 运行仿真并跟踪轨迹文件...")
+        analyzer.load_network()
+        try:
+            import subprocess
+            process = subprocess.Popen(["sumo", "-c", "highway-ramp-analysis.sumocfg"],
+                                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        except Exception as e:
+            print(f"运行仿真时出错: {e}")
+            return
+        analyzer.analyze_fcd_incremental(bin_width=base_width, follow=True,
+                                         is_running=lambda: process.poll() is None)
+        if process.wait() != 0:
+            print("仿真运行失败")
+            return
+        analyzer.analyze_trip_data()
+        analyzer.analyze_summary_data(bin_width=base_width)
+    else:
+        # 首先运行仿真生成数据
+        print("1. 运行仿真生成数据...")
+        try:
+            import subprocess
+            with analyzer.instrumentation.stage('run_simulation'):
+                result = subprocess.run([
+                    "sumo", 
+                    "-c", "highway-ramp-analysis.sumocfg"
+                ], capture_output=True, text=True, timeout=120)
+            
+            if result.returncode == 0:
+                print("仿真运行成功，开始分析数据...")
+            else:
+                print("仿真运行失败:")
+                print(result.stderr)
+                return
+        except Exception as e:
+            print(f"运行仿真时出错: {e}")
+            return
+        
+        # 分析数据
+        print("\n2. 分析交通流数据...")
+        analyzer.load_network()
+        if args.incremental:
+            analyzer.analyze_fcd_incremental(bin_width=base_width)
+        elif args.workers > 1:
+            analyzer.analyze_fcd_parallel(workers=args.workers, bin_width=base_width)
+        else:
+            analyzer.analyze_fcd_data(compact=args.compact)
+        analyzer.analyze_trip_data()
+        analyzer.analyze_summary_data(bin_width=base_width)
+    analyzer.calculate_traffic_parameters(base_width=base_width)
+    analyzer.calculate_rollups()
+    analyzer.analyze_capacity()
+    if not args.live:
+        analyzer.analyze_corridor()
     
     print("\n3. 生成图表...")
-    analyzer.generate_charts()
+    analyzer.generate_charts(quality='draft' if args.draft_charts else 'full',
+                             workers=args.chart_workers)
     
     print("\n4. 保存结果...")
-    analyzer.save_results()
+    analyzer.save_results(fcd_format=args.export_fcd)
+    analyzer.save_timing_report()
     
     print("\n交通流数据分析完成！")
     print("请查看生成的图表和数据文件。")
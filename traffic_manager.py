@@ -6,83 +6,101 @@ SUMO交通仿真管理器
 """
 
 import subprocess
+import threading
 import os
-import sys
+
+from demand_generator import DEMAND_PRESETS
+
+# 车型配置名称 -> 需求场景（由demand_generator生成路径文件）
+VEHICLE_CONFIGS = DEMAND_PRESETS
 
 class SimpleTrafficManager:
     def __init__(self):
-        """初始化交通管理器"""
+        """初始化交通管理器
+
+        分析器在本进程内常驻并在多次分析之间复用；其NumPy、pandas、matplotlib等依赖
+        在菜单显示后于后台线程中预先导入，帮助、切换配置等操作不需要等待
+        """
         self.current_config = "basic"
+        self.analyzer = None
+        self._preload_thread = None
+    
+    def preload_analyzer(self):
+        """在后台线程中导入分析器的重量级依赖"""
+        if self._preload_thread is not None:
+            return
+        from traffic_flow_analyzer import load_dependencies
+        self._preload_thread = threading.Thread(target=load_dependencies, daemon=True)
+        self._preload_thread.start()
+    
+    def get_analyzer(self):
+        """常驻的交通流分析器，首次使用时创建"""
+        if self.analyzer is None:
+            from traffic_flow_analyzer import TrafficFlowAnalyzer
+            self.analyzer = TrafficFlowAnalyzer()
+        return self.analyzer
         
     def run_simulation(self):
-        """运行SUMO仿真（带GUI界面）"""
+        """运行SUMO仿真（带GUI界面），结束后在本进程内直接分析仿真输出"""
+        print("🚀 启动SUMO仿真...")
+        print("注意：仿真结束后将自动进行数据分析并生成图表（Ctrl+C 可取消）")
+        self.auto_analyze_traffic_flow(gui=True)
+    
+    @staticmethod
+    def print_progress(event):
+        """显示仿真和分析进度"""
+        fraction = event['fraction']
+        percent = f"[{fraction * 100:3.0f}%] " if fraction is not None else ""
+        icon = "🚗" if event['phase'] == 'simulation' else "📊"
+        print(f"{icon} {percent}{event['message']}")
+    
+    def auto_analyze_traffic_flow(self, gui=True, simulate=True):
+        """异步运行仿真和交通流数据分析
+
+        仿真直接写出轨迹、行程和路网汇总文件，分析在本进程内复用这些输出，不再重新运行仿真
+        """
+        import asyncio
+        from simulation_orchestrator import SimulationOrchestrator
+        
+        orchestrator = SimulationOrchestrator(on_progress=self.print_progress, analyzer=self.get_analyzer())
         try:
-            print("🚀 启动SUMO仿真...")
-            print("注意：仿真结束后将自动进行数据分析并生成图表")
-            
-            # 运行SUMO GUI仿真
-            result = subprocess.run([
-                "sumo-gui", 
-                "-c", "highway-ramp.sumocfg",
-                "--delay", "50",
-                "--step-length", "0.1"
-            ], check=True)
-            
-            print("✅ 仿真运行完成！")
-            
-            # 仿真结束后自动进行数据分析
-            print("\n🔄 仿真结束，开始自动数据分析...")
-            self.auto_analyze_traffic_flow()
-            
-        except subprocess.CalledProcessError as e:
-            print(f"❌ 仿真运行失败: {e}")
+            analyzer = asyncio.run(orchestrator.run(gui=gui, simulate=simulate))
+        except KeyboardInterrupt:
+            print("\n⏹ 已取消仿真和数据分析")
+            return
         except FileNotFoundError:
             print("❌ 找不到SUMO程序，请检查SUMO是否正确安装")
+            return
         except Exception as e:
             print(f"❌ 运行出错: {e}")
-    
-    def auto_analyze_traffic_flow(self):
-        """自动运行交通流数据分析"""
+            return
+        
+        if analyzer is None:
+            print("❌ 数据分析未完成")
+            return
+        
+        print("✅ 数据分析完成！")
+        print("\n📈 生成的图表文件：")
+        
+        # 检查生成的图表文件
+        reports_dir = "traffic_flow_reports"
+        if os.path.exists(reports_dir):
+            for file in os.listdir(reports_dir):
+                if file.endswith('.png'):
+                    print(f"  📊 {file}")
+        
+        print("\n🎯 分析结果已保存到 traffic_flow_reports/ 文件夹：")
+        print("  • *.png 图表文件 - 可视化图表")
+        print("  • *.xlsx 数据表格 - 详细数据")
+        print("  • *.json 分析结果 - 统计摘要")
+        
+        # 询问是否自动打开图表
         try:
-            print("📊 正在进行交通流数据分析...")
-            
-            # 运行数据分析器
-            result = subprocess.run([
-                sys.executable, "traffic_flow_analyzer.py"
-            ], capture_output=True, text=True, timeout=300)
-            
-            if result.returncode == 0:
-                print("✅ 数据分析完成！")
-                print("\n📈 生成的图表文件：")
-                
-                # 检查生成的图表文件
-                reports_dir = "traffic_flow_reports"
-                if os.path.exists(reports_dir):
-                    for file in os.listdir(reports_dir):
-                        if file.endswith('.png'):
-                            print(f"  📊 {file}")
-                
-                print("\n🎯 分析结果已保存到 traffic_flow_reports/ 文件夹：")
-                print("  • *.png 图表文件 - 可视化图表")
-                print("  • *.xlsx 数据表格 - 详细数据")
-                print("  • *.json 分析结果 - 统计摘要")
-                
-                # 询问是否自动打开图表
-                try:
-                    choice = input("\n是否自动打开生成的图表？(y/n): ").strip().lower()
-                    if choice == 'y':
-                        self.open_latest_charts()
-                except KeyboardInterrupt:
-                    print("\n跳过打开图表")
-                    
-            else:
-                print("❌ 数据分析失败:")
-                print(result.stderr)
-                
-        except subprocess.TimeoutExpired:
-            print("❌ 数据分析超时")
-        except Exception as e:
-            print(f"❌ 数据分析出错: {e}")
+            choice = input("\n是否自动打开生成的图表？(y/n): ").strip().lower()
+            if choice == 'y':
+                self.open_latest_charts()
+        except KeyboardInterrupt:
+            print("\n跳过打开图表")
     
     def open_latest_charts(self):
         """打开最新生成的图表"""
@@ -117,28 +135,27 @@ class SimpleTrafficManager:
             print(f"❌ 打开图表时出错: {e}")
 
     def analyze_traffic_flow(self):
-        """手动运行交通流数据分析"""
+        """手动运行交通流数据分析：已有仿真输出时直接分析，否则先运行无界面仿真"""
+        from simulation_orchestrator import SimulationOrchestrator
+        
         try:
             print("📊 开始交通流数据分析...")
-            choice = input("是否继续进行数据分析？这将运行仿真并生成图表 (y/n): ").strip().lower()
-            
-            if choice == 'y':
-                print("正在运行交通流分析...")
-                
-                # 运行数据分析器
-                result = subprocess.run([
-                    sys.executable, "traffic_flow_analyzer.py"
-                ], check=True)
-                
-                print("✅ 交通流数据分析完成！")
-                print("请查看生成的图表和数据文件。")
+            has_outputs = SimulationOrchestrator().outputs_ready()
+            if has_outputs:
+                prompt = "将分析已有的仿真输出，是否重新运行仿真？(y/n，直接回车为否): "
             else:
-                print("已取消数据分析")
-                
-        except subprocess.CalledProcessError as e:
-            print(f"❌ 数据分析失败: {e}")
-        except Exception as e:
-            print(f"❌ 分析出错: {e}")
+                prompt = "未找到仿真输出，是否运行仿真并生成图表？(y/n): "
+            choice = input(prompt).strip().lower()
+        except KeyboardInterrupt:
+            print("\n已取消数据分析")
+            return
+        
+        if choice == 'y':
+            self.auto_analyze_traffic_flow(gui=False, simulate=True)
+        elif has_outputs:
+            self.auto_analyze_traffic_flow(simulate=False)
+        else:
+            print("已取消数据分析")
 
     def switch_vehicle_config(self):
         """切换车辆配置"""
@@ -164,84 +181,38 @@ class SimpleTrafficManager:
 
     def set_basic_config(self):
         """设置基础车辆配置"""
-        basic_config = '''<?xml version="1.0" encoding="UTF-8"?>
-
-<routes xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" xsi:noNamespaceSchemaLocation="http://sumo.dlr.de/xsd/routes_file.xsd">
-
-    <!-- 车辆类型定义 -->
-    <vType id="passenger" accel="2.6" decel="4.5" sigma="0.5" length="4.5" minGap="2.5" maxSpeed="36.11" guiShape="passenger" color="1,0,0"/>
-
-    <!-- 路径定义 -->
-    <route id="r_1" edges="M1 M2 M3"/>
-    <route id="r_2" edges="onr M2 M3"/>
-
-    <!-- 交通流定义 -->
-    <flow id="f_1" route="r_1" begin="0" end="1600" vehsPerHour="600" type="passenger"/>
-    <flow id="f_2" route="r_2" begin="200" end="1400" vehsPerHour="400" type="passenger"/>
-
-</routes>'''
-        
-        with open("highway-ramp.rou.xml", "w", encoding="utf-8") as f:
-            f.write(basic_config)
+        self.write_route_file(VEHICLE_CONFIGS["basic"])
 
     def set_mixed_config(self):
         """设置混合车辆配置"""
-        mixed_config = '''<?xml version="1.0" encoding="UTF-8"?>
-
-<routes xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" xsi:noNamespaceSchemaLocation="http://sumo.dlr.de/xsd/routes_file.xsd">
-
-    <!-- 车辆类型定义 - 优化版 -->
-    <vType id="passenger" accel="2.8" decel="4.5" sigma="0.4" length="4.5" minGap="2.5" maxSpeed="36.11" guiShape="passenger" color="0,100,255"/>
-    <vType id="truck" accel="2.2" decel="3.5" sigma="0.3" length="10.0" minGap="2.5" maxSpeed="30.00" guiShape="truck" color="255,165,0"/>
-    <vType id="bus" accel="2.4" decel="4.0" sigma="0.3" length="11.0" minGap="2.5" maxSpeed="28.00" guiShape="bus" color="0,128,0"/>
-    <vType id="motorcycle" accel="4.0" decel="6.5" sigma="0.5" length="2.2" minGap="1.2" maxSpeed="36.11" guiShape="motorcycle" color="255,0,0"/>
-    <vType id="emergency" accel="3.2" decel="5.5" sigma="0.2" length="5.5" minGap="2.0" maxSpeed="36.11" guiShape="emergency" color="255,255,0"/>
-    <vType id="delivery" accel="2.6" decel="4.2" sigma="0.3" length="6.0" minGap="2.0" maxSpeed="32.00" guiShape="delivery" color="139,69,19"/>
-
-    <!-- 路径定义 -->
-    <route id="r_1" edges="M1 M2 M3"/>              <!-- 主线直行 -->
-    <route id="r_2" edges="onr M2 M3"/>             <!-- 上匝道汇入后直行 -->
-    <route id="r_3" edges="M1 M2 offr"/>            <!-- 主线后下匝道 -->
-    <route id="r_4" edges="onr M2 offr"/>           <!-- 上匝道汇入后下匝道 -->
-
-    <!-- 主线车流 - 80%直行，20%下匝道 -->
-    <!-- 主线直行流量 (M1-M2-M3) -->
-    <flow id="f_1_passenger_through" route="r_1" begin="0" end="1600" vehsPerHour="336" type="passenger"/>
-    <flow id="f_1_truck_through" route="r_1" begin="0" end="1600" vehsPerHour="72" type="truck"/>
-    <flow id="f_1_bus_through" route="r_1" begin="0" end="1600" vehsPerHour="24" type="bus"/>
-    <flow id="f_1_motorcycle_through" route="r_1" begin="0" end="1600" vehsPerHour="29" type="motorcycle"/>
-    <flow id="f_1_emergency_through" route="r_1" begin="0" end="1600" vehsPerHour="5" type="emergency"/>
-    <flow id="f_1_delivery_through" route="r_1" begin="0" end="1600" vehsPerHour="14" type="delivery"/>
-
-    <!-- 主线分流到下匝道 (M1-M2-offr) -->
-    <flow id="f_1_passenger_exit" route="r_3" begin="0" end="1600" vehsPerHour="84" type="passenger"/>
-    <flow id="f_1_truck_exit" route="r_3" begin="0" end="1600" vehsPerHour="18" type="truck"/>
-    <flow id="f_1_bus_exit" route="r_3" begin="0" end="1600" vehsPerHour="6" type="bus"/>
-    <flow id="f_1_motorcycle_exit" route="r_3" begin="0" end="1600" vehsPerHour="7" type="motorcycle"/>
-    <flow id="f_1_emergency_exit" route="r_3" begin="0" end="1600" vehsPerHour="1" type="emergency"/>
-    <flow id="f_1_delivery_exit" route="r_3" begin="0" end="1600" vehsPerHour="4" type="delivery"/>
+        self.write_route_file(VEHICLE_CONFIGS["mixed"])
 
-    <!-- 上匝道车流 - 70%直行，30%下匝道 -->
-    <!-- 上匝道直行流量 (onr-M2-M3) -->
-    <flow id="f_2_passenger_through" route="r_2" begin="0" end="1600" vehsPerHour="210" type="passenger"/>
-    <flow id="f_2_truck_through" route="r_2" begin="0" end="1600" vehsPerHour="21" type="truck"/>
-    <flow id="f_2_bus_through" route="r_2" begin="0" end="1600" vehsPerHour="7" type="bus"/>
-    <flow id="f_2_motorcycle_through" route="r_2" begin="0" end="1600" vehsPerHour="25" type="motorcycle"/>
-    <flow id="f_2_emergency_through" route="r_2" begin="0" end="1600" vehsPerHour="4" type="emergency"/>
-    <flow id="f_2_delivery_through" route="r_2" begin="0" end="1600" vehsPerHour="14" type="delivery"/>
+    @staticmethod
+    def write_route_file(scenario, route_file="highway-ramp.rou.xml"):
+        """将需求场景生成的路径文件写为仿真使用的路径文件"""
+        with open(route_file, "w", encoding="utf-8") as f:
+            f.write(scenario.render())
 
-    <!-- 上匝道分流到下匝道 (onr-M2-offr) -->
-    <flow id="f_2_passenger_exit" route="r_4" begin="0" end="1600" vehsPerHour="90" type="passenger"/>
-    <flow id="f_2_truck_exit" route="r_4" begin="0" end="1600" vehsPerHour="9" type="truck"/>
-    <flow id="f_2_bus_exit" route="r_4" begin="0" end="1600" vehsPerHour="3" type="bus"/>
-    <flow id="f_2_motorcycle_exit" route="r_4" begin="0" end="1600" vehsPerHour="10" type="motorcycle"/>
-    <flow id="f_2_emergency_exit" route="r_4" begin="0" end="1600" vehsPerHour="1" type="emergency"/>
-    <flow id="f_2_delivery_exit" route="r_4" begin="0" end="1600" vehsPerHour="6" type="delivery"/>
-
-</routes>'''
+    def run_batch_simulation(self):
+        """批量运行无界面仿真（需求水平 × 随机种子，使用当前车型配置）"""
+        from batch_runner import BatchRunner, scenario_grid
+        
+        try:
+            print("📦 批量场景仿真（无界面，多进程并行）")
+            demand_text = input("需求水平（流量倍数，空格分隔，默认 0.8 1.0 1.2）: ").strip()
+            seed_text = input("随机种子（空格分隔，默认 1 2 3）: ").strip()
+            demand_levels = [float(v) for v in demand_text.split()] or [0.8, 1.0, 1.2]
+            seeds = [int(v) for v in seed_text.split()] or [1, 2, 3]
+        except ValueError:
+            print("❌ 输入格式错误")
+            return
+        except KeyboardInterrupt:
+            print("\n已取消批量仿真")
+            return
         
-        with open("highway-ramp.rou.xml", "w", encoding="utf-8") as f:
-            f.write(mixed_config)
+        results = BatchRunner().run(scenario_grid(demand_levels, [self.current_config], seeds))
+        print("🎯 各场景的输出保存在 batch_runs/ 文件夹中")
+        return results
 
     def show_help(self):
         """显示帮助信息"""
@@ -251,7 +222,8 @@ class SimpleTrafficManager:
 功能说明：
 1. 🚗 运行仿真 - 启动SUMO GUI界面进行交通仿真
    • 自动设置50ms延迟，便于观察
-   • 仿真结束后自动进行数据分析
+   • 仿真直接写出轨迹、行程和路网汇总数据，结束后在本程序内自动分析
+   • 运行过程中显示仿真和分析进度，Ctrl+C 可取消
    • 自动生成交通流图表
 
 2. 🔧 切换车型配置 - 在不同车辆配置间切换
@@ -259,11 +231,17 @@ class SimpleTrafficManager:
    • 混合配置：6种车型混合（乘用车、卡车、公交、摩托车、救护车、货车）
 
 3. 📊 交通流数据分析 - 手动运行数据分析
+   • 已有仿真输出时直接分析，无需重新仿真
    • 提取断面车流量、占有率、车头时距、平均速度
    • 生成专业的交通流时变图表
    • 输出速度-密度关系图
    • 保存Excel和JSON格式数据
 
+4. 📦 批量场景仿真 - 无界面并行运行多个场景
+   • 按需求水平和随机种子组合场景，使用当前车型配置
+   • 每个场景在batch_runs/下的独立目录中运行
+   • 同时运行的sumo进程数不超过CPU核数
+
 系统特点：
 • 路网包含高速公路主线(120-130km/h)和匝道(90km/h)
 • 支持多种车型的真实交通仿真
@@ -287,6 +265,7 @@ class SimpleTrafficManager:
         """运行管理器主循环"""
         print("=== SUMO交通仿真管理器 ===")
         print("当前配置：高速公路-匝道仿真系统")
+        self.preload_analyzer()
         
         while True:
             try:
@@ -294,10 +273,11 @@ class SimpleTrafficManager:
                 print("1. 🚗 运行仿真 (仿真结束后自动生成图表)")
                 print("2. 🔧 切换车型配置")
                 print("3. 📊 手动交通流数据分析")
-                print("4. ❓ 帮助")
-                print("5. 🚪 退出")
+                print("4. 📦 批量场景仿真")
+                print("5. ❓ 帮助")
+                print("6. 🚪 退出")
                 
-                choice = input("\n请选择操作 (1-5): ").strip()
+                choice = input("\n请选择操作 (1-6): ").strip()
                 
                 if choice == "1":
                     self.run_simulation()
@@ -306,12 +286,14 @@ class SimpleTrafficManager:
                 elif choice == "3":
                     self.analyze_traffic_flow()
                 elif choice == "4":
-                    self.show_help()
+                    self.run_batch_simulation()
                 elif choice == "5":
+                    self.show_help()
+                elif choice == "6":
                     print("👋 再见！")
                     break
                 else:
-                    print("❌ 无效选择，请输入1-5")
+                    print("❌ 无效选择，请输入1-6")
                     
             except KeyboardInterrupt:
                 print("\n\n👋 程序已退出")
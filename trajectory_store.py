@@ -0,0 +1,326 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+车辆轨迹存储
+把FCD记录按 (车辆, 时间) 只排序一次，保存各列的排序数组和每辆车的起始偏移（CSR结构），
+任一车辆的轨迹都是一个O(1)的数组切片；
+在此基础上以向量化运算计算各路段的行程时间、换道事件以及汇入/分流位置，不对车辆逐个循环。
+轨迹存储与解析缓存保存在一起，源FCD文件未变化时以内存映射方式直接打开
+"""
+
+import os
+import pandas as pd
+import numpy as np
+
+from cross_sections import _codes
+from output_cache import OutputCache, CACHE_VERSION, source_signature
+
+# 缓存条目类型
+TRACKS_KIND = 'tracks'
+
+# 排序后保存的数值列和编码列
+VALUE_COLUMNS = ('time', 'pos', 'speed', 'x', 'y')
+CODE_COLUMNS = ('lane', 'edge')
+
+EDGE_TRAVEL_COLUMNS = ['vehicle', 'edge', 'entry_time', 'exit_time', 'travel_time', 'length', 'complete']
+LANE_CHANGE_COLUMNS = ['vehicle', 'time', 'edge', 'pos', 'from_lane', 'to_lane']
+MANEUVER_COLUMNS = ['vehicle', 'from_edge', 'to_edge', 'entry_time', 'time', 'pos', 'from_lane', 'to_lane']
+
+
+def is_internal_edge(edge):
+    """交叉口内部路段（SUMO中以':'开头）"""
+    return edge is None or str(edge).startswith(':')
+
+
+class TrajectoryStore:
+    """按 (车辆, 时间) 排序的轨迹存储
+
+    offsets长度为车辆数+1，第k辆车的记录为 [offsets[k], offsets[k+1])；
+    lane/edge为编码数组，对应的取值表为lane_values/edge_values（车道为空时编码为-1）
+    """
+
+    def __init__(self, columns, offsets, vehicle_ids, lane_values, edge_values):
+        self.columns = columns
+        self.offsets = offsets
+        self.vehicle_ids = vehicle_ids
+        self.lane_values = lane_values
+        self.edge_values = edge_values
+        self._vehicle_index = None
+        self._row_vehicle = None
+        self._runs = None
+
+    @classmethod
+    def from_fcd(cls, fcd_df):
+        """由FCD数据框构建：按 (车辆, 时间) 排序一次并计算各车的起始偏移"""
+        id_codes, vehicle_ids = _codes(fcd_df['id'])
+        lane_codes, lane_values = _codes(fcd_df['lane'])
+        edge_codes, edge_values = _codes(fcd_df['edge'])
+        time = fcd_df['time'].to_numpy(dtype=float)
+
+        order = np.lexsort((time, id_codes))
+        columns = {name: fcd_df[name].to_numpy(dtype=float)[order] for name in VALUE_COLUMNS}
+        columns['time'] = time[order]
+        columns['lane'] = lane_codes[order].astype(np.int32)
+        columns['edge'] = edge_codes[order].astype(np.int32)
+        counts = np.bincount(id_codes, minlength=len(vehicle_ids))
+        offsets = np.concatenate(([0], np.cumsum(counts))).astype(np.int64)
+        return cls(columns, offsets, vehicle_ids, lane_values, edge_values)
+
+    def save(self, directory):
+        """各数组保存为.npy文件，取值表写入manifest.json"""
+        os.makedirs(directory, exist_ok=True)
+        np.save(os.path.join(directory, "offsets.npy"), self.offsets)
+        for name, array in self.columns.items():
+            np.save(os.path.join(directory, f"{name}.npy"), np.ascontiguousarray(array))
+        return {
+            'rows': len(self),
+            'vehicles': self.vehicle_ids.tolist(),
+            'lanes': self.lane_values.tolist(),
+            'edges': self.edge_values.tolist(),
+        }
+
+    @classmethod
+    def load(cls, directory, manifest, mmap=True):
+        """以内存映射方式打开已保存的轨迹存储"""
+        mode = 'r' if mmap else None
+        columns = {name: np.load(os.path.join(directory, f"{name}.npy"), mmap_mode=mode)
+                   for name in VALUE_COLUMNS + CODE_COLUMNS}
+        offsets = np.load(os.path.join(directory, "offsets.npy"), mmap_mode=mode)
+
+        def values(items):
+            array = np.empty(len(items), dtype=object)
+            array[:] = items
+            return array
+        return cls(columns, offsets, values(manifest['vehicles']), values(manifest['lanes']),
+                   values(manifest['edges']))
+
+    @classmethod
+    def open_or_build(cls, fcd_file, fcd_df, cache=None):
+        """打开与FCD文件对应的缓存轨迹存储，不存在或源文件已变化时由fcd_df构建并保存"""
+        cache = cache or OutputCache()
+        entry = cache.entry_dir(fcd_file, TRACKS_KIND)
+        manifest = cache.is_valid(fcd_file, TRACKS_KIND)
+        if manifest is not None:
+            try:
+                return cls.load(entry, manifest, mmap=cache.mmap)
+            except (OSError, ValueError, KeyError):
+                pass
+
+        store = cls.from_fcd(fcd_df)
+        try:
+            tmp_entry = cache.temp_entry_dir(entry)
+            manifest = store.save(tmp_entry)
+            manifest.update(version=CACHE_VERSION, kind=TRACKS_KIND, source=source_signature(fcd_file))
+            cache.write_manifest(tmp_entry, manifest)
+            cache.commit_entry(tmp_entry, entry)
+        except OSError as e:
+            cache.discard_entry(entry)
+            print(f"警告: 无法写入轨迹存储 {entry}: {e}")
+        return store
+
+    def __len__(self):
+        return len(self.columns['time'])
+
+    @property
+    def n_vehicles(self):
+        return len(self.vehicle_ids)
+
+    def vehicle_codes(self, vehicle_ids):
+        """车辆ID对应的编码，未出现的车辆为-1"""
+        if self._vehicle_index is None:
+            self._vehicle_index = pd.Index(self.vehicle_ids)
+        return self._vehicle_index.get_indexer(np.asarray(vehicle_ids, dtype=object))
+
+    def track_slice(self, code):
+        """第code辆车的记录区间"""
+        return slice(int(self.offsets[code]), int(self.offsets[code + 1]))
+
+    def track(self, vehicle_id):
+        """单辆车的轨迹数据框（按时间排序），车辆不存在时返回空数据框"""
+        code = self.vehicle_codes([vehicle_id])[0]
+        rows = self.track_slice(code) if code >= 0 else slice(0, 0)
+        lanes = self.columns['lane'][rows]
+        edges = self.columns['edge'][rows]
+        return pd.DataFrame({
+            'time': self.columns['time'][rows],
+            'lane': np.where(lanes >= 0, self.lane_values[np.maximum(lanes, 0)], None),
+            'edge': np.where(edges >= 0, self.edge_values[np.maximum(edges, 0)], None),
+            **{name: self.columns[name][rows] for name in ('pos', 'speed', 'x', 'y')},
+        })
+
+    @property
+    def row_vehicle(self):
+        """各记录的车辆编码"""
+        if self._row_vehicle is None:
+            self._row_vehicle = np.repeat(np.arange(self.n_vehicles, dtype=np.int64), np.diff(self.offsets))
+        return self._row_vehicle
+
+    def runs(self):
+        """各车在同一路段上的连续记录段：vehicle、edge、start、stop（记录区间 [start, stop)）"""
+        if self._runs is None:
+            edge = self.columns['edge']
+            n = len(edge)
+            change = np.ones(n, dtype=bool)
+            if n:
+                change[1:] = edge[1:] != edge[:-1]
+                change[self.offsets[:-1][np.diff(self.offsets) > 0]] = True
+            start = np.flatnonzero(change)
+            self._runs = {
+                'vehicle': self.row_vehicle[start],
+                'edge': edge[start],
+                'start': start,
+                'stop': np.append(start[1:], n),
+            }
+        return self._runs
+
+    def _edge_mask(self, codes):
+        """路段编码是否为普通路段（非交叉口内部路段）"""
+        normal = np.array([not is_internal_edge(edge) for edge in self.edge_values], dtype=bool)
+        return (codes >= 0) & normal[np.maximum(codes, 0)]
+
+    def edge_travel_times(self, network=None, arrivals=None):
+        """各车在各普通路段上的行程时间
+
+        进入时刻为在该路段上的第一条记录，离开时刻为下一路段（含交叉口内部路段）上的第一条记录。
+        车辆在该路段上离开路网时没有下一路段：arrivals（车辆ID → tripinfo到达时刻）中有该车时以到达时刻为离开时刻；
+        否则最后一条记录按速度在一个记录间隔内驶过车道末端（车道长度取自network）时，离开时刻为下一个记录时刻。
+        仿真结束时仍在路段上的车辆以最后一条记录为离开时刻，complete为False
+        """
+        runs = self.runs()
+        time = self.columns['time']
+        pos = self.columns['pos']
+        keep = self._edge_mask(runs['edge'])
+        start, stop = runs['start'][keep], runs['stop'][keep]
+        vehicle = runs['vehicle'][keep]
+        # 同一车辆的下一个连续段紧接在stop处开始
+        has_next = (stop < len(time)) & (self.row_vehicle[np.minimum(stop, len(time) - 1)] == vehicle)
+        exit_row = np.where(has_next, stop, stop - 1)
+        entry = time[start]
+        exit_time = time[exit_row]
+        complete = has_next
+
+        last = stop - 1
+        if network is not None:
+            # 车道编码为-1时取到末尾的NaN
+            lane_length = np.array([network.lane_length(lane, np.nan) for lane in self.lane_values] + [np.nan],
+                                   dtype=float)[self.columns['lane'][last]]
+            previous = np.maximum(last - 1, 0)
+            interval = np.where((last > 0) & (self.row_vehicle[previous] == vehicle), time[last] - time[previous], 0.0)
+            reached = ~has_next & (pos[last] + self.columns['speed'][last] * interval >= lane_length)
+            exit_time = np.where(reached, time[last] + interval, exit_time)
+            complete = complete | reached
+        if arrivals is not None:
+            arrival = pd.Series(arrivals, dtype=float).reindex(self.vehicle_ids[vehicle]).to_numpy()
+            arrived = ~has_next & (arrival >= time[last])
+            exit_time = np.where(arrived, arrival, exit_time)
+            complete = complete | arrived
+        return pd.DataFrame({
+            'vehicle': self.vehicle_ids[vehicle],
+            'edge': self.edge_values[runs['edge'][keep]],
+            'entry_time': entry,
+            'exit_time': exit_time,
+            'travel_time': exit_time - entry,
+            'length': pos[last] - pos[start],
+            'complete': complete,
+        }, columns=EDGE_TRAVEL_COLUMNS)
+
+    def _lane_change_rows(self):
+        """换道记录行：与同一车辆的上一条记录在同一路段、不同车道"""
+        lane = self.columns['lane']
+        edge = self.columns['edge']
+        vehicle = self.row_vehicle
+        rows = np.flatnonzero((vehicle[1:] == vehicle[:-1]) & (edge[1:] == edge[:-1])
+                              & (lane[1:] != lane[:-1]) & (lane[1:] >= 0) & (lane[:-1] >= 0)) + 1
+        return rows
+
+    def lane_changes(self, edges=None):
+        """换道事件：时刻、路段、位置和换道前后的车道；edges为路段列表时只返回这些路段上的换道"""
+        rows = self._lane_change_rows()
+        edge = self.columns['edge'][rows]
+        if edges is not None:
+            codes = pd.Index(self.edge_values).get_indexer(list(edges))
+            keep = np.isin(edge, codes[codes >= 0])
+            rows, edge = rows[keep], edge[keep]
+        lane = self.columns['lane']
+        return pd.DataFrame({
+            'vehicle': self.vehicle_ids[self.row_vehicle[rows]],
+            'time': self.columns['time'][rows],
+            'edge': self.edge_values[edge],
+            'pos': self.columns['pos'][rows],
+            'from_lane': self.lane_values[lane[rows - 1]],
+            'to_lane': self.lane_values[lane[rows]],
+        }, columns=LANE_CHANGE_COLUMNS)
+
+    def lane_change_counts(self):
+        """各路段的换道次数"""
+        changes = self.lane_changes()
+        return changes.groupby('edge', sort=True, observed=True).size().rename('lane_changes')
+
+    def _transitions(self, from_edge, to_edge):
+        """由from_edge（之间可以有交叉口内部路段）驶入to_edge的各车
+
+        返回 (车辆编码, from_edge上的连续段序号, to_edge上的连续段序号)，路段不存在时返回None
+        """
+        codes = pd.Index(self.edge_values).get_indexer([from_edge, to_edge])
+        if (codes < 0).any():
+            return None
+        runs = self.runs()
+        normal = np.flatnonzero(self._edge_mask(runs['edge']))
+        vehicle = runs['vehicle'][normal]
+        edge = runs['edge'][normal]
+        follows = np.flatnonzero((vehicle[1:] == vehicle[:-1])
+                                 & (edge[:-1] == codes[0]) & (edge[1:] == codes[1]))
+        return vehicle[follows + 1], normal[follows], normal[follows + 1]
+
+    def _lane_change_in(self, start, stop, last):
+        """各记录区间 [start, stop) 内的第一次（last为False）或最后一次换道记录行，没有换道时为-1"""
+        changes = self._lane_change_rows()
+        if not len(changes):
+            return np.full(len(start), -1, dtype=np.int64)
+        if last:
+            index = np.searchsorted(changes, stop, side='left') - 1
+            row = changes[np.maximum(index, 0)]
+            valid = (index >= 0) & (row >= start)
+        else:
+            index = np.searchsorted(changes, start, side='left')
+            row = changes[np.minimum(index, len(changes) - 1)]
+            valid = (index < len(changes)) & (row < stop)
+        return np.where(valid, row, -1)
+
+    def _maneuvers(self, from_edge, to_edge, on_from_edge, last):
+        """驶过from_edge -> to_edge的各车在其中一个路段上的第一次或最后一次换道"""
+        found = self._transitions(from_edge, to_edge)
+        if found is None:
+            return pd.DataFrame(columns=MANEUVER_COLUMNS)
+        vehicle, from_run, to_run = found
+        runs = self.runs()
+        run = from_run if on_from_edge else to_run
+        start, stop = runs['start'][run], runs['stop'][run]
+        row = self._lane_change_in(start, stop, last)
+        valid = row >= 0
+        row = np.where(valid, row, start)
+        lane = self.columns['lane']
+        return pd.DataFrame({
+            'vehicle': self.vehicle_ids[vehicle],
+            'from_edge': from_edge,
+            'to_edge': to_edge,
+            'entry_time': self.columns['time'][start],
+            'time': np.where(valid, self.columns['time'][row], np.nan),
+            'pos': np.where(valid, self.columns['pos'][row], np.nan),
+            'from_lane': np.where(valid, self.lane_values[lane[np.maximum(row - 1, 0)]], None),
+            'to_lane': np.where(valid, self.lane_values[lane[row]], None),
+        }, columns=MANEUVER_COLUMNS)
+
+    def merge_locations(self, ramp_edge='onr', mainline_edge='M2'):
+        """由匝道驶入主线的车辆在主线上第一次换道（汇入主线车道）的时刻和位置
+
+        entry_time为驶入主线该路段的时刻；在主线上没有换道的车辆（如直接驶向下匝道）time/pos为NaN
+        """
+        return self._maneuvers(ramp_edge, mainline_edge, on_from_edge=False, last=False)
+
+    def diverge_locations(self, mainline_edge='M2', exit_edge='offr'):
+        """由主线驶入出口匝道的车辆在主线上最后一次换道（进入分流车道）的时刻和位置
+
+        entry_time为驶入主线该路段的时刻；在主线上没有换道的车辆time/pos为NaN
+        """
+        return self._maneuvers(mainline_edge, exit_edge, on_from_edge=True, last=True)
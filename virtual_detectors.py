@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+虚拟线圈检测器
+在指定的 (路段, 车道, 位置) 处设置虚拟检测器，由轨迹索引插值得到每辆车车头和车尾通过检测器的时刻，
+一次处理即可得到任意多个检测器在各时间窗内的断面流量、时间平均速度和占有率。
+检测器可以直接声明，也可以从SUMO附加文件中的inductionLoop/e1Detector定义读取
+"""
+
+import xml.etree.ElementTree as ET
+import pandas as pd
+import numpy as np
+
+from fcd_reader import lane_to_edge
+from cross_sections import CrossSection, TrackIndex, DEFAULT_VEHICLE_LENGTH_M
+from traffic_aggregator import make_time_intervals, DEFAULT_BIN_WIDTH
+
+DETECTOR_STATS_COLUMNS = ['detector', 'edge', 'lane', 'pos', 'time_start', 'time_end', 'time_center',
+                          'count', 'flow', 'speed', 'occupancy']
+
+# 找不到车尾通过记录时按 车长/速度 估计占用时间，速度下限（m/s）
+_MIN_SPEED = 0.1
+
+
+def load_detectors(additional_file, network=None):
+    """读取SUMO附加文件中的线圈检测器定义
+
+    pos为负数时表示距车道终点的距离，需要network（NetworkIndex）提供车道长度
+    """
+    detectors = []
+    for _, elem in ET.iterparse(additional_file, events=('end',)):
+        if elem.tag not in ('inductionLoop', 'e1Detector'):
+            continue
+        lane = elem.get('lane')
+        pos = float(elem.get('pos', 0))
+        if pos < 0:
+            if network is None or lane not in network.lanes:
+                raise ValueError(f"检测器 {elem.get('id')} 使用负位置，需要路网中车道 {lane} 的长度")
+            pos += network.lanes[lane]['length']
+        detectors.append(CrossSection(lane_to_edge(lane), pos, lane=lane, name=elem.get('id')))
+        elem.clear()
+    return detectors
+
+
+def lane_detectors(fcd_df, network=None, fraction=0.5):
+    """在每条出现过的车道上按长度的fraction处设置一个检测器
+
+    network为NetworkIndex时使用真实车道长度，否则使用观测到的最大位置
+    """
+    lanes = pd.unique(fcd_df['lane'].dropna())
+    max_pos = fcd_df.groupby('lane', observed=True)['pos'].max()
+    detectors = []
+    for lane in lanes:
+        info = network.lanes.get(lane) if network is not None else None
+        length = info['length'] if info else float(max_pos[lane])
+        detectors.append(CrossSection(lane_to_edge(lane), length * fraction, lane=lane,
+                                      name=f"det_{lane}"))
+    return detectors
+
+
+class VirtualDetectorEngine:
+    """基于轨迹索引的虚拟检测器计算
+
+    fcd_df只在构建轨迹索引时使用一次；vehicle_lengths为车辆ID数组到车长数组（m）的映射函数，
+    用于确定车尾通过时刻（占有时间）。
+    """
+
+    def __init__(self, fcd_df, vehicle_lengths=None, index=None):
+        self.index = index or TrackIndex(fcd_df)
+        if vehicle_lengths is not None:
+            self.vehicle_lengths = np.asarray(vehicle_lengths(self.index.id_values.astype(str)), dtype=float)
+        else:
+            self.vehicle_lengths = np.full(len(self.index.id_values), DEFAULT_VEHICLE_LENGTH_M)
+
+    def passages(self, detectors):
+        """各检测器上每辆车的通过记录：检测器序号、车辆编码、车头/车尾通过时刻和通过速度"""
+        front = self.index.crossing_arrays(detectors)
+        # 车尾通过：位置阈值加上车长；车辆可能在车头通过后换道，不限定车道
+        rear = self.index.crossing_arrays(detectors, vehicle_offsets=self.vehicle_lengths,
+                                          match_lane=False)
+
+        n_vehicles = len(self.index.id_values)
+        front_keys = front['section'] * n_vehicles + front['vehicle']
+        rear_keys = rear['section'] * n_vehicles + rear['vehicle']
+        rear_order = np.lexsort((rear['time'], rear_keys))
+        rear_keys = rear_keys[rear_order]
+        rear_times = rear['time'][rear_order]
+
+        # 同一辆车在同一检测器上的第一次车尾通过
+        match = np.searchsorted(rear_keys, front_keys, side='left')
+        found = match < len(rear_keys)
+        found[found] = (rear_keys[match[found]] == front_keys[found])
+        rear_time = np.full(len(front_keys), np.nan)
+        rear_time[found] = rear_times[match[found]]
+        found &= rear_time >= front['time']
+
+        # 车尾未在同一路段上通过（检测器靠近路段终点）时按 车长/速度 估计
+        lengths = self.vehicle_lengths[front['vehicle']]
+        estimate = front['time'] + lengths / np.maximum(front['speed'], _MIN_SPEED)
+        rear_time = np.where(found, rear_time, estimate)
+
+        return {
+            'detector': front['section'],
+            'vehicle': front['vehicle'],
+            'front_time': front['time'],
+            'rear_time': rear_time,
+            'speed': front['speed'],
+        }
+
+    def measure(self, detectors, bin_width=DEFAULT_BIN_WIDTH, time_intervals=None):
+        """各检测器、各时间窗的断面统计
+
+        count为通过车辆数，flow为小时流量（veh/h），speed为时间平均速度（km/h），
+        occupancy为检测器被占用的时间比例（%）
+        """
+        detectors = list(detectors)
+        if time_intervals is None:
+            time_intervals = make_time_intervals(self.index.time, bin_width)
+        time_intervals = np.asarray(time_intervals, dtype=float)
+        n_windows = len(time_intervals) - 1
+        n_detectors = len(detectors)
+        if n_detectors == 0 or n_windows < 1:
+            return pd.DataFrame(columns=DETECTOR_STATS_COLUMNS)
+
+        passages = self.passages(detectors)
+        n_groups = n_detectors * n_windows
+
+        # 流量和速度：按车头通过时刻归入时间窗
+        windows = np.searchsorted(time_intervals, passages['front_time'], side='right') - 1
+        valid = (windows >= 0) & (windows < n_windows)
+        groups = passages['detector'][valid] * n_windows + windows[valid]
+        counts = np.bincount(groups, minlength=n_groups)
+        speed_sums = np.bincount(groups, weights=passages['speed'][valid], minlength=n_groups)
+
+        # 占有率：占用区间 [车头通过, 车尾通过] 可能跨越多个时间窗，按时间窗拆分后累加重叠时长
+        start = passages['front_time']
+        stop = passages['rear_time']
+        first = np.clip(np.searchsorted(time_intervals, start, side='right') - 1, 0, n_windows - 1)
+        last = np.clip(np.searchsorted(time_intervals, stop, side='right') - 1, 0, n_windows - 1)
+        spans = np.maximum(last - first + 1, 0)
+        piece = np.repeat(np.arange(len(start)), spans)
+        piece_window = np.repeat(first, spans) + (np.arange(len(piece)) - np.repeat(np.cumsum(spans) - spans, spans))
+        overlap = (np.minimum(stop[piece], time_intervals[piece_window + 1])
+                   - np.maximum(start[piece], time_intervals[piece_window]))
+        occupied = np.bincount(passages['detector'][piece] * n_windows + piece_window,
+                               weights=np.maximum(overlap, 0), minlength=n_groups)
+
+        widths = np.diff(time_intervals)
+        detector_index = np.repeat(np.arange(n_detectors), n_windows)
+        window_index = np.tile(np.arange(n_windows), n_detectors)
+        width = widths[window_index]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            speed = np.where(counts > 0, speed_sums / counts * 3.6, np.nan)
+
+        t_start = time_intervals[window_index]
+        t_end = time_intervals[window_index + 1]
+        return pd.DataFrame({
+            'detector': np.array([d.name for d in detectors], dtype=object)[detector_index],
+            'edge': np.array([d.edge for d in detectors], dtype=object)[detector_index],
+            'lane': np.array([d.lane for d in detectors], dtype=object)[detector_index],
+            'pos': np.array([d.pos for d in detectors])[detector_index],
+            'time_start': t_start,
+            'time_end': t_end,
+            'time_center': (t_start + t_end) / 2,
+            'count': counts,
+            'flow': counts * 3600 / width,
+            'speed': speed,
+            'occupancy': np.minimum(occupied / width * 100, 100),
+        }, columns=DETECTOR_STATS_COLUMNS)
+
+
+def edge_detector_summary(detector_stats):
+    """按路段汇总检测器结果：各时间窗车道流量相加后取平均/最大，速度按车辆数加权，占有率取车道平均"""
+    if detector_stats.empty:
+        return {}
+    grouped = detector_stats.groupby(['edge', 'time_start'], sort=False, observed=True)
+    per_window = grouped.agg(count=('count', 'sum'), flow=('flow', 'sum'), occupancy=('occupancy', 'mean'))
+    speed_sums = (detector_stats['speed'].fillna(0) * detector_stats['count']).groupby(
+        [detector_stats['edge'], detector_stats['time_start']], sort=False, observed=True).sum()
+    per_window['speed_sum'] = speed_sums
+
+    summary = {}
+    for edge, rows in per_window.groupby(level='edge', sort=False, observed=True):
+        vehicles = rows['count'].sum()
+        summary[edge] = {
+            'mean_flow': rows['flow'].mean(),
+            'max_flow': rows['flow'].max(),
+            'speed': rows['speed_sum'].sum() / vehicles if vehicles else np.nan,
+            'occupancy': rows['occupancy'].mean(),
+        }
+    return summary